@@ -0,0 +1,273 @@
+# Per-step mask latency of `JsonSchemaLogitsProcessor` across vocabulary
+# sizes, schema shapes and output lengths. Runs offline on synthetic
+# vocabularies, or on a tokenizer already in the local cache. Results are
+# written as JSON, and compared against an earlier run to catch regressions:
+#
+#   PYTHONPATH=. python benchmarks/mask_latency.py --output new.json
+#   PYTHONPATH=. python benchmarks/mask_latency.py --compare old.json
+import argparse
+import json
+import platform
+import random
+import statistics
+import string
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import torch
+from synthetic import synthetic_vocabulary
+from transformers import AutoTokenizer
+
+from json_schema_logits_processor import JsonSchemaLogitsProcessor
+from json_schema_logits_processor.schema.interative_schema import \
+    parse_schema_from_string
+from json_schema_logits_processor.vocabulary import VocabularyIndex
+
+# how long string values and arrays get, per output length
+LENGTHS = {"short": 1, "long": 8}
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 8)))
+        for _ in range(count)
+    )
+
+
+def flat_case(rng: random.Random, scale: int) -> tuple[dict, dict]:
+    # many keys, one level deep
+    types = ["string", "integer", "boolean", "number"]
+    properties = {f"field_{i:02}": {"type": types[i % 4]} for i in range(20)}
+    values = {
+        "string": lambda: _words(rng, 2 * scale),
+        "integer": lambda: rng.randint(-1000, 1000),
+        "boolean": lambda: rng.random() < 0.5,
+        "number": lambda: round(rng.uniform(-100, 100), 3),
+    }
+    document = {key: values[value["type"]]() for key, value in properties.items()}
+    return {"type": "object", "properties": properties}, document
+
+
+def enum_case(rng: random.Random, scale: int) -> tuple[dict, dict]:
+    # a large enum, where every step narrows down the matching values
+    choices = sorted({_words(rng, 1) + f"_{i}" for i in range(1000)})
+    schema = {
+        "type": "object",
+        "properties": {
+            "kind": {"type": "enum", "values": choices},
+            "labels": {
+                "type": "array",
+                "items": {"type": "enum", "values": choices},
+            },
+            "note": {"type": "string"},
+        },
+    }
+    document = {
+        "kind": rng.choice(choices),
+        "labels": rng.choices(choices, k=4 * scale),
+        "note": _words(rng, scale),
+    }
+    return schema, document
+
+
+def nested_case(rng: random.Random, scale: int) -> tuple[dict, dict]:
+    # objects in arrays in objects
+    leaf = {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer", "minimum": 0},
+            "name": {"type": "string"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["id"],
+    }
+    schema = {
+        "type": "object",
+        "properties": {
+            "owner": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "meta": leaf},
+            },
+            "items": {"type": "array", "items": leaf},
+        },
+    }
+
+    def leaf_value():
+        return {
+            "id": rng.randint(0, 10_000),
+            "name": _words(rng, 2),
+            "tags": [_words(rng, 1) for _ in range(2)],
+        }
+
+    document = {
+        "owner": {"name": _words(rng, 2), "meta": leaf_value()},
+        "items": [leaf_value() for _ in range(2 * scale)],
+    }
+    return schema, document
+
+
+SHAPES = {"flat": flat_case, "enum": enum_case, "nested": nested_case}
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def run_steps(
+    processor: JsonSchemaLogitsProcessor, token_ids: list[int]
+) -> list[float]:
+    # one row, one token more every step, like `generate`
+    scores = torch.zeros(1, len(processor.decoded_tokens))
+    steps = [torch.tensor([token_ids[:i]]) for i in range(1, len(token_ids) + 1)]
+    seconds = []
+    for input_ids in steps:
+        start = time.perf_counter()
+        processor(input_ids, scores)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run_case(
+    tokenizer, vocabulary, shape: str, length: str, trace_memory: bool
+) -> dict:
+    schema_dict, document = SHAPES[shape](random.Random(0), LENGTHS[length])
+    schema = parse_schema_from_string(json.dumps(schema_dict))
+    token_ids = [tokenizer.bos_token_id] + tokenizer.encode(
+        json.dumps(document), add_special_tokens=False
+    )
+
+    start = time.perf_counter()
+    processor = JsonSchemaLogitsProcessor(schema, tokenizer, vocabulary=vocabulary)
+    construction_seconds = time.perf_counter() - start
+    seconds = run_steps(processor, token_ids)
+    token_sets = processor.token_set_stats()
+    masks = processor.mask_stats()
+    result = {
+        "vocab_size": len(vocabulary),
+        "shape": shape,
+        "length": length,
+        "output_tokens": len(token_ids) - 1,
+        "construction_ms": construction_seconds * 1000,
+        "step_ms": {
+            "p50": percentile(seconds, 0.5) * 1000,
+            "p99": percentile(seconds, 0.99) * 1000,
+            "mean": statistics.fmean(seconds) * 1000,
+            "max": max(seconds) * 1000,
+            # the first step decodes and walks from scratch
+            "first": seconds[0] * 1000,
+        },
+        "caches": {
+            "memo_entries": len(processor.memo),
+            "token_set_entries": token_sets.entries,
+            "token_set_bytes": token_sets.resident_bytes,
+            "token_set_hit_rate": token_sets.hit_rate,
+            "mask_entries": masks.entries,
+            "mask_bytes": masks.resident_bytes,
+            "mask_hit_rate": masks.hit_rate,
+        },
+    }
+    if trace_memory:
+        # a second, slower pass: tracing allocations skews the timings
+        processor.clear()
+        tracemalloc.start()
+        run_steps(processor, token_ids)
+        result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result
+
+
+def compare(results: list[dict], baseline_path: Path, tolerance: float) -> list[str]:
+    def key(result):
+        return result["vocab_size"], result["shape"], result["length"]
+
+    baseline = {key(r): r for r in json.loads(baseline_path.read_text())["results"]}
+    regressions = []
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        for metric in ("p50", "p99"):
+            ratio = result["step_ms"][metric] / max(old["step_ms"][metric], 1e-9)
+            if ratio > tolerance:
+                regressions.append(
+                    f"{key(result)} {metric} {old['step_ms'][metric]:.3f} ms -> "
+                    f"{result['step_ms'][metric]:.3f} ms ({ratio:.2f}x)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--vocab-sizes", type=int, nargs="+", default=[32_000, 50_000, 128_000]
+    )
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES))
+    parser.add_argument("--lengths", nargs="+", choices=LENGTHS, default=list(LENGTHS))
+    parser.add_argument(
+        "--tokenizer", help="a cached pretrained tokenizer, instead of --vocab-sizes"
+    )
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path, help="an earlier --output file")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    vocabularies, results = [], []
+    for vocab_size in [None] if args.tokenizer else args.vocab_sizes:
+        start = time.perf_counter()
+        if args.tokenizer:
+            tokenizer = AutoTokenizer.from_pretrained(
+                args.tokenizer, local_files_only=True
+            )
+            vocabulary = VocabularyIndex.build(tokenizer)
+            vocab_size = len(vocabulary)
+        else:
+            tokenizer, vocabulary = synthetic_vocabulary(vocab_size)
+        vocabularies.append(
+            {
+                "tokenizer": args.tokenizer or "synthetic",
+                "vocab_size": vocab_size,
+                "build_ms": (time.perf_counter() - start) * 1000,
+            }
+        )
+        for shape in args.shapes:
+            for length in args.lengths:
+                result = run_case(
+                    tokenizer, vocabulary, shape, length, args.trace_memory
+                )
+                results.append(result)
+                print(
+                    f"vocab {vocab_size:>7} {shape:>6} {length:>5} "
+                    f"({result['output_tokens']:>4} tokens): "
+                    f"p50 {result['step_ms']['p50']:8.3f} ms  "
+                    f"p99 {result['step_ms']['p99']:8.3f} ms  "
+                    f"construction {result['construction_ms']:8.2f} ms",
+                    file=sys.stderr,
+                )
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "machine": platform.machine(),
+        },
+        "vocabularies": vocabularies,
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Compares computing the masks of a batch serially, on a thread pool and on
+# a process pool. Runs offline on a synthetic tokenizer by default:
+#
+#   PYTHONPATH=. python benchmarks/parallel_masks.py --batch-size 64 --workers 1 2 4 8
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from synthetic import synthetic_vocabulary
+from transformers import AutoTokenizer
+
+from json_schema_logits_processor import JsonSchemaLogitsProcessor
+from json_schema_logits_processor.parallel import process_pool
+from json_schema_logits_processor.schema.interative_schema import \
+    parse_schema_from_string
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "country": {"type": "enum", "values": ["Germany", "France", "Japan"]},
+        "age": {"type": "integer", "minimum": 0, "maximum": 150},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 4},
+        "active": {"type": "boolean"},
+    },
+}
+WORDS = ["name", "country", "age", "tags", "active", "alpha", "beta", "gamma"]
+
+
+def batch_input_ids(tokenizer, batch_size: int) -> torch.Tensor:
+    # rows cut at different points of different documents, left padded
+    rng = random.Random(1)
+    rows = []
+    for _ in range(batch_size):
+        document = json.dumps(
+            {
+                "name": " ".join(rng.choices(WORDS, k=3)),
+                "country": rng.choice(SCHEMA["properties"]["country"]["values"]),
+                "age": rng.randint(0, 150),
+                "tags": rng.choices(WORDS, k=rng.randint(0, 4)),
+            }
+        )
+        ids = tokenizer.encode(document, add_special_tokens=False)
+        rows.append([tokenizer.bos_token_id] + ids[: rng.randint(1, len(ids))])
+    length = max(map(len, rows))
+    return torch.tensor(
+        [[tokenizer.pad_token_id] * (length - len(row)) + row for row in rows]
+    )
+
+
+def run(
+    processor, input_ids, repeats: int, workers: int = 0
+) -> tuple[float, torch.Tensor]:
+    # `workers` > 0 computes the masks on a process pool of that size
+    scores = torch.zeros(input_ids.shape[0], len(processor.decoded_tokens))
+    best, masks = float("inf"), None
+    for _ in range(repeats):
+        # a fresh start every time, so every row is parsed and walked again
+        processor.clear()
+        executor = None
+        if workers:
+            # forked workers keep their own parser memos, so they're forked
+            # again from the cleared processor, and started before timing
+            executor = process_pool(processor, workers)
+            executor.submit(int).result()
+            processor.executor = executor
+        start = time.perf_counter()
+        masks = processor(input_ids, scores)
+        best = min(best, time.perf_counter() - start)
+        if executor is not None:
+            executor.shutdown()
+    return best, masks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", help="a pretrained tokenizer name or path")
+    parser.add_argument("--vocab-size", type=int, default=8000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.tokenizer:
+        tokenizer, vocabulary = AutoTokenizer.from_pretrained(args.tokenizer), None
+    else:
+        tokenizer, vocabulary = synthetic_vocabulary(args.vocab_size)
+    schema = parse_schema_from_string(json.dumps(SCHEMA))
+    input_ids = batch_input_ids(tokenizer, args.batch_size)
+
+    def processor(**kwargs):
+        return JsonSchemaLogitsProcessor(
+            schema, tokenizer, vocabulary=vocabulary, token_set_cache_size=0, **kwargs
+        )
+
+    serial, expected = run(processor(), input_ids, args.repeats)
+    results = [{"executor": "serial", "workers": 1, "seconds": serial}]
+    for workers in args.workers:
+        with ThreadPoolExecutor(workers) as executor:
+            seconds, masks = run(processor(executor=executor), input_ids, args.repeats)
+        assert torch.equal(masks, expected), "thread pool masks differ"
+        results.append({"executor": "thread", "workers": workers, "seconds": seconds})
+        seconds, masks = run(processor(), input_ids, args.repeats, workers)
+        assert torch.equal(masks, expected), "process pool masks differ"
+        results.append({"executor": "process", "workers": workers, "seconds": seconds})
+    for result in results:
+        result["speedup"] = serial / result["seconds"]
+        print(
+            f"{result['executor']:>8} x{result['workers']:<3} "
+            f"{result['seconds'] * 1000:9.1f} ms  {result['speedup']:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
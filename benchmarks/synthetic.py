@@ -0,0 +1,95 @@
+# A synthetic vocabulary and tokenizer, so the benchmarks run offline and
+# give the same numbers for the same vocabulary size on every machine.
+import random
+import string
+
+from json_schema_logits_processor.trie import Trie
+from json_schema_logits_processor.vocabulary import (VocabularyIndex,
+                                                     build_token_trie)
+
+BOS, PAD, EOS = 0, 1, 2
+JSON_PIECES = [
+    "{", "}", "[", "]", ":", ",", '"', '{"', '"}', '":', '": ', '", "', '",',
+    "true", "false", "null", " ", "  ", "\n", "\n  ", "\n    ", "\\", '\\"',
+    "\\n", "\\u", "-", ".", "e", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9",
+]
+
+
+def synthetic_tokens(vocab_size: int, seed: int = 0) -> list[str]:
+    # Special tokens decode to nothing, then every printable character and
+    # some JSON punctuation, then word pieces with and without a leading
+    # space, like a BPE vocabulary. The last token decodes to nothing too,
+    # like Bart's <mask>, so it rather than EOS is the one the trie keeps
+    # for the empty text.
+    rng = random.Random(seed)
+    tokens = ["", "", ""]
+    seen = set()
+    for token in list(string.printable) + JSON_PIECES + list("éüßø中文"):
+        if token not in seen:
+            seen.add(token)
+            tokens.append(token)
+    letters = string.ascii_lowercase
+    # roughly how common each letter is in English
+    weights = [
+        8, 2, 3, 4, 12, 2, 2, 6, 7, 1, 1, 4, 2, 7, 8, 2, 1, 6, 6, 9, 3, 1, 2, 1, 2, 1
+    ]
+    while len(tokens) < vocab_size - 1:
+        piece = "".join(rng.choices(letters, weights, k=rng.randint(2, 9)))
+        piece = rng.choice(["", " ", " ", '"', "_"]) + piece
+        if rng.random() < 0.05:
+            piece = piece.capitalize() + rng.choice(['"', '",', '":', "s"])
+        if piece not in seen:
+            seen.add(piece)
+            tokens.append(piece)
+    return tokens + [""]
+
+
+class SyntheticTokenizer:
+    # Just what the processor uses of a tokenizer. `encode` is greedy
+    # longest match, good enough to turn a document into token ids.
+    def __init__(self, tokens: list[str]):
+        self.tokens = tokens
+        self.bos_token_id, self.pad_token_id, self.eos_token_id = BOS, PAD, EOS
+        self.vocab_size = len(tokens)
+        self._trie = Trie(EOS)
+        for i, token in enumerate(tokens):
+            if token:
+                self._trie.insert(token, i)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def decode(self, token_ids, skip_special_tokens: bool = True) -> str:
+        return "".join(self.tokens[int(i)] for i in token_ids)
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        token_ids = []
+        start = 0
+        while start < len(text):
+            node, end, token_id = self._trie.root, start, None
+            for i in range(start, len(text)):
+                node = node.children.get(text[i])
+                if node is None:
+                    break
+                if node.id is not None:
+                    end, token_id = i + 1, node.id
+            if token_id is None:
+                raise ValueError(f"can't encode {text[start]!r}")
+            token_ids.append(token_id)
+            start = end
+        return token_ids
+
+
+def synthetic_vocabulary(
+    vocab_size: int, seed: int = 0
+) -> tuple[SyntheticTokenizer, VocabularyIndex]:
+    tokens = synthetic_tokens(vocab_size, seed)
+    vocabulary = VocabularyIndex(
+        tokens,
+        build_token_trie(tokens, EOS),
+        eos_token_id=EOS,
+        pad_token_id=PAD,
+        bos_token_id=BOS,
+        fingerprint=f"synthetic-{vocab_size}-{seed}",
+    )
+    return SyntheticTokenizer(tokens), vocabulary
@@ -1,2 +1,4 @@
 from .json_schema_logits_processor import JsonSchemaLogitsProcessor
-
+from .metrics import StepMetrics
+from .schema_cache import CacheStats, CompiledSchemaCache
+from .vocabulary import VocabularyIndex
@@ -0,0 +1,165 @@
+import logging
+import sys
+import threading
+from collections import deque
+from typing import Hashable
+
+from json_schema_logits_processor.iterative_parser import (
+    _parse_one_token, canonical_state_key, initial_parser_state)
+from json_schema_logits_processor.iterative_parser.types import \
+    IterativeParserResult
+from json_schema_logits_processor.schema.interative_schema import (JsonSchema,
+                                                                   SchemaId)
+from json_schema_logits_processor.trie import CompactTrie, Trie
+
+logger = logging.getLogger(__name__)
+
+DEAD_STATE = -1
+# compiling gives up past this many token states, see `TokenAutomaton.compile`
+DEFAULT_MAX_STATES = 20_000
+# rough size of one entry in a transition dict, used for cache accounting
+_TRANSITION_BYTES = 64
+
+
+class CharacterAutomaton:
+    def __init__(self, schema: JsonSchema):
+        self.schema = schema
+        self.transitions: list[dict[str, int]] = []
+        self.accepting: list[bool] = []
+        # one (text, parser result) pair that reaches each state, used to
+        # expand transitions that have not been seen yet
+        self._representatives: list[tuple[str, IterativeParserResult]] = []
+        self._state_ids: dict[Hashable, int] = {}
+        self._transition_count = 0
+        # automata are shared between processors through the compiled schema
+        # cache, so new states are added under a lock
+        self._lock = threading.Lock()
+        self.initial_state = self._add_state("", initial_parser_state())
+
+    @property
+    def nbytes(self) -> int:
+        return self._transition_count * _TRANSITION_BYTES
+
+    def __len__(self):
+        return len(self.transitions)
+
+    def _add_state(self, text: str, result: IterativeParserResult) -> int:
+        key = canonical_state_key(self.schema, result)
+        state = self._state_ids.get(key)
+        if state is not None:
+            return state
+        state = len(self.transitions)
+        self._state_ids[key] = state
+        self.transitions.append({})
+        self.accepting.append(result.complete and result.schema_id == SchemaId(0))
+        self._representatives.append((text, result))
+        return state
+
+    def step(self, state: int, char: str) -> int:
+        if state == DEAD_STATE:
+            return DEAD_STATE
+        transitions = self.transitions[state]
+        next_state = transitions.get(char)
+        if next_state is None:
+            with self._lock:
+                next_state = transitions.get(char)
+                if next_state is not None:
+                    return next_state
+                text, result = self._representatives[state]
+                out = _parse_one_token(text + char, result, self.schema)
+                next_state = (
+                    self._add_state(text + char, out) if out.valid else DEAD_STATE
+                )
+                transitions[char] = next_state
+                self._transition_count += 1
+        return next_state
+
+    def parser_state(self, state: int) -> IterativeParserResult:
+        # a parser result `state` was reached with, it accepts the same
+        # continuations as every other
+        return self._representatives[state][1]
+
+    def run(self, text: str, state: int | None = None) -> int:
+        if state is None:
+            state = self.initial_state
+        for char in text:
+            state = self.step(state, char)
+            if state == DEAD_STATE:
+                break
+        return state
+
+
+class TokenAutomaton:
+    def __init__(self, characters: CharacterAutomaton, trie: Trie | CompactTrie):
+        self.characters = characters
+        self.trie = trie
+        self.allowed_tokens: dict[int, list[int]] = {}
+        self.next_states: dict[int, dict[int, int]] = {}
+        self._table_bytes = 0
+        # set once compiling has given up, processors then walk the trie
+        self.too_large = False
+
+    def __len__(self):
+        return len(self.allowed_tokens)
+
+    @property
+    def nbytes(self) -> int:
+        return self._table_bytes + self.characters.nbytes
+
+    def valid_tokens(self, state: int) -> list[int]:
+        allowed = self.allowed_tokens.get(state)
+        if allowed is None:
+            allowed = self._compile_state(state)
+        return allowed
+
+    def next_state(self, state: int, token_id: int) -> int:
+        if state not in self.next_states:
+            self._compile_state(state)
+        return self.next_states[state].get(token_id, DEAD_STATE)
+
+    def compile(self, max_states: int | None = DEFAULT_MAX_STATES) -> bool:
+        # Some schemas have too many states to compile, or infinitely many,
+        # so compiling stops after `max_states` and returns False. States
+        # compiled so far stay usable.
+        if self.too_large:
+            return False
+        queue = deque([self.characters.initial_state])
+        seen = {self.characters.initial_state}
+        while queue:
+            if max_states is not None and len(seen) > max_states:
+                logger.warning(
+                    "schema automaton has more than %d token states, "
+                    "falling back to walking the vocabulary trie",
+                    max_states,
+                )
+                self.too_large = True
+                return False
+            state = queue.popleft()
+            self.valid_tokens(state)
+            for next_state in self.next_states[state].values():
+                if next_state not in seen:
+                    seen.add(next_state)
+                    queue.append(next_state)
+        return True
+
+    def _compile_state(self, state: int) -> list[int]:
+        allowed, next_states = self.trie.find_valid_token_states(state, self._step)
+        if state not in self.allowed_tokens:
+            self._table_bytes += sys.getsizeof(allowed) + sys.getsizeof(next_states)
+        self.allowed_tokens[state] = allowed
+        self.next_states[state] = next_states
+        return allowed
+
+    def _step(self, state: int, char: str) -> tuple[int | None, bool]:
+        next_state = self.characters.step(state, char)
+        if next_state == DEAD_STATE:
+            return None, False
+        return next_state, self.characters.accepting[next_state]
+
+
+def compile_token_automaton(
+    schema: JsonSchema, trie: Trie | CompactTrie
+) -> TokenAutomaton:
+    automaton = TokenAutomaton(CharacterAutomaton(schema), trie)
+    automaton.compile()
+    return automaton
@@ -1,23 +1,39 @@
-from transformers.utils.import_utils import lru_cache
+from collections import OrderedDict
+from typing import Hashable
 
+from json_schema_logits_processor.iterative_parser.array_parser import \
+    is_valid_array
+from json_schema_logits_processor.iterative_parser.characters import (
+    NextCharacters, other_character, schema_alphabet)
 from json_schema_logits_processor.iterative_parser.enum_parser import \
     is_valid_enum
+from json_schema_logits_processor.iterative_parser.literal_parser import \
+    is_valid_literal
+from json_schema_logits_processor.iterative_parser.number_parser import (
+    is_bounded, is_valid_number, range_key)
 from json_schema_logits_processor.iterative_parser.object_parser import \
     is_valid_object
 from json_schema_logits_processor.iterative_parser.string_parser import \
     is_valid_string
-from json_schema_logits_processor.iterative_parser.types import \
-    IterativeParserResult
+from json_schema_logits_processor.iterative_parser.types import (
+    EMPTY_STACK, IncrementalArrayValue, IncrementalLiteralValue,
+    IncrementalNumberValue, IncrementalObjectValue, IncrementalStringValue,
+    IncrementalUnionValue, IterativeParserResult, trim_parser_state)
+from json_schema_logits_processor.iterative_parser.union_parser import \
+    is_valid_union
 from json_schema_logits_processor.schema.interative_schema import (
-    EnumJsonSchema, JsonSchema, ObjectJsonSchema, SchemaId, StringJsonSchema)
+    ArrayJsonSchema, BooleanJsonSchema, EnumJsonSchema, JsonSchema,
+    JsonSchemaUnion, NullJsonSchema, NumberJsonSchema, ObjectJsonSchema,
+    SchemaId, StringJsonSchema, UnionJsonSchema)
 
 
 def parse_partial_json_value(
     root_string: str,
     next_token: str,
     schema: JsonSchema,
+    memo: "ParserMemo | None" = None,
 ) -> tuple[bool, bool]:
-    penultimate_state = _parse_partial_json_value(root_string, schema)
+    penultimate_state = _parse_partial_json_value(root_string, schema, memo)
     if not penultimate_state.valid:
         return (
             penultimate_state.valid,
@@ -28,49 +44,248 @@ def parse_partial_json_value(
             penultimate_state.valid,
             penultimate_state.complete and penultimate_state.schema_id == SchemaId(0),
         )
-    out = _parse_one_token(root_string + next_token, penultimate_state, schema)
+    index = penultimate_state.string_index
+    char = (
+        root_string[index]
+        if index < len(root_string)
+        else next_token[index - len(root_string)]
+    )
+    out = _parse_char(penultimate_state, char, schema, memo)
     return out.valid, out.complete and out.schema_id == SchemaId(0)
 
 
-@lru_cache(maxsize=1_000_000)
-def _parse_partial_json_value(
-    json_str: str, schema: JsonSchema
+def initial_parser_state() -> IterativeParserResult:
+    return IterativeParserResult(
+        valid=True,
+        complete=False,
+        string_index=0,
+        schema_id=SchemaId(0),
+        next_state=0,
+        value_stack=EMPTY_STACK,
+    )
+
+
+def advance_partial_json_value(
+    tail: str,
+    state: IterativeParserResult,
+    text: str,
+    schema: JsonSchema,
+    memo: "ParserMemo | None" = None,
+) -> tuple[str, IterativeParserResult]:
+    # `tail` is the part of the decoded text `state` still refers to, see
+    # `trim_parser_state`. Only the new characters are parsed, one at a
+    # time, and the text is joined once at the end.
+    consumed = 0
+    for char in text:
+        if not state.valid:
+            break
+        consumed += 1
+        state = _parse_char(state, char, schema, memo)
+    return trim_parser_state(tail + text[:consumed], state)
+
+
+def canonical_state_key(schema: JsonSchema, result: IterativeParserResult) -> Hashable:
+    # Two parser results with the same key accept exactly the same
+    # continuations. The parser only ever looks at the character at
+    # `string_index`, so the absolute offsets can be dropped. Accumulated
+    # values only matter for enums, where they are checked against the
+    # allowed values, for numbers with a range, where they are summed up by
+    # `range_key`, for literals and for the alternatives of a union.
+    value_stack = []
+    for schema_id, value in result.value_stack:
+        if isinstance(value, IncrementalObjectValue):
+            value_stack.append(
+                (schema_id, (value.remaining_keys, value.latest_added_key))
+            )
+        elif isinstance(value, IncrementalStringValue) and isinstance(
+            schema[schema_id], EnumJsonSchema
+        ):
+            value_stack.append((schema_id, value.value))
+        elif isinstance(value, IncrementalNumberValue) and is_bounded(
+            schema[schema_id]
+        ):
+            number_schema = schema[schema_id]
+            assert isinstance(number_schema, NumberJsonSchema)
+            value_stack.append((schema_id, range_key(value.value, number_schema)))
+        elif isinstance(value, IncrementalArrayValue):
+            # counts past both bounds behave the same
+            array_schema = schema[schema_id]
+            assert isinstance(array_schema, ArrayJsonSchema)
+            bound = max(array_schema.min_items, array_schema.max_items or 0)
+            value_stack.append((schema_id, min(value.count, bound)))
+        elif isinstance(value, IncrementalLiteralValue):
+            value_stack.append((schema_id, value.value))
+        elif isinstance(value, IncrementalUnionValue):
+            value_stack.append(
+                (
+                    schema_id,
+                    tuple(canonical_state_key(schema, state) for state in value.states),
+                )
+            )
+        else:
+            value_stack.append((schema_id, None))
+    return (
+        result.valid,
+        result.complete,
+        result.schema_id,
+        result.next_state,
+        tuple(value_stack),
+    )
+
+
+class ParserMemo:
+    # Parsing one character only depends on the previous state and that
+    # character, so results are memoized on exactly that. The table belongs
+    # to whoever is parsing (a processor, a request) rather than the module,
+    # holds at most `max_entries` results, oldest dropped first, and is
+    # freed with `clear`.
+    def __init__(self, schema: JsonSchema, max_entries: int = 100_000):
+        self.schema = schema
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._results: OrderedDict[
+            tuple[IterativeParserResult, str], IterativeParserResult
+        ] = OrderedDict()
+        self._alphabet: frozenset[str] | None = None
+        self._other_character = ""
+
+    def __len__(self):
+        return len(self._results)
+
+    def parse(
+        self, json_str: str, state: IterativeParserResult
+    ) -> IterativeParserResult:
+        return self.step(state, json_str[state.string_index])
+
+    def step(self, state: IterativeParserResult, char: str) -> IterativeParserResult:
+        # `parse` for the character at `state.string_index`, without the text
+        # before it
+        key = (state, char)
+        out = self._results.get(key)
+        if out is not None:
+            self.hits += 1
+            return out
+        self.misses += 1
+        out = _parse_one_token(_CharAt(char), state, self.schema)
+        if len(self._results) >= self.max_entries:
+            self._results.popitem(last=False)
+        self._results[key] = out
+        return out
+
+    @property
+    def alphabet(self) -> frozenset[str]:
+        if self._alphabet is None:
+            self._alphabet = schema_alphabet(self.schema)
+            self._other_character = other_character(self._alphabet)
+        return self._alphabet
+
+    def next_characters(self, state: IterativeParserResult) -> NextCharacters:
+        # Everything `state` accepts next, from one parse per character of
+        # the alphabet and one for all the others.
+        alphabet = self.alphabet
+        successors = {}
+        for char in alphabet:
+            out = self.step(state, char)
+            if out.valid:
+                successors[char] = out
+        others = self.step(state, self._other_character).valid
+        return NextCharacters(successors, alphabet, others)
+
+    def clear(self):
+        self._results.clear()
+
+
+class _CharAt:
+    # Stands in for the text when parsing a single character, the parsers
+    # only ever read the one at the state's `string_index`.
+    __slots__ = ("char",)
+
+    def __init__(self, char: str):
+        self.char = char
+
+    def __getitem__(self, index: int) -> str:
+        return self.char
+
+
+def _parse_next(
+    json_str: str,
+    state: IterativeParserResult,
+    schema: JsonSchema,
+    memo: ParserMemo | None,
 ) -> IterativeParserResult:
-    if json_str == "":
-        return IterativeParserResult(
-            valid=True,
-            complete=False,
-            string_index=0,
-            schema_id=SchemaId(0),
-            next_state=0,
-            value_stack=(),
-        )
-    previous_result = _parse_partial_json_value(json_str[:-1], schema)
-    if not previous_result.valid:
-        return previous_result
+    if memo is None:
+        return _parse_one_token(json_str, state, schema)
+    return memo.parse(json_str, state)
+
+
+def _parse_char(
+    state: IterativeParserResult,
+    char: str,
+    schema: JsonSchema,
+    memo: ParserMemo | None,
+) -> IterativeParserResult:
+    if memo is None:
+        return _parse_one_token(_CharAt(char), state, schema)
+    return memo.step(state, char)
+
 
-    new_result = _parse_one_token(json_str, previous_result, schema)
-    return new_result
+def _parse_partial_json_value(
+    json_str: str, schema: JsonSchema, memo: ParserMemo | None = None
+) -> IterativeParserResult:
+    result = initial_parser_state()
+    for _ in json_str:
+        if not result.valid:
+            break
+        result = _parse_next(json_str, result, schema, memo)
+    return result
 
 
-@lru_cache(maxsize=1_000_000)
 def _parse_one_token(
     json_str: str, state: IterativeParserResult, schema: JsonSchema
 ) -> IterativeParserResult:
     curr_schema = schema[state.schema_id]
+    if state.complete and isinstance(curr_schema, (NumberJsonSchema, UnionJsonSchema)):
+        # a complete number (or union holding one) can still go on,
+        # otherwise the character belongs to whatever comes after it
+        out = _parse_value(json_str, curr_schema, state, schema)
+        if out.valid:
+            return out
     if state.complete:
+        if curr_schema.parent_id is not None and isinstance(
+            schema[curr_schema.parent_id], UnionJsonSchema
+        ):
+            # alternatives are parsed as if they were the root, see
+            # `is_valid_union`, and there is nothing after a finished one
+            return IterativeParserResult(
+                valid=False,
+                complete=False,
+                string_index=state.string_index,
+                schema_id=state.schema_id,
+                next_state=state.next_state,
+                value_stack=state.value_stack,
+            )
         if curr_schema.parent_id is None:  # root node
             # we should be done, if we have more non-whitespace characters
             # then we are invalid
             return IterativeParserResult(
-                valid=len(json_str[state.string_index :].strip()) == 0,
-                complete=len(json_str) == state.string_index,
+                valid=json_str[state.string_index].isspace(),
+                complete=False,
                 string_index=state.string_index + 1,
                 schema_id=state.schema_id,
                 next_state=0,
                 value_stack=state.value_stack,
             )
         curr_schema = schema[curr_schema.parent_id]
+    return _parse_value(json_str, curr_schema, state, schema)
+
+
+def _parse_value(
+    json_str: str,
+    curr_schema: JsonSchemaUnion,
+    state: IterativeParserResult,
+    schema: JsonSchema,
+) -> IterativeParserResult:
     match curr_schema:
         case StringJsonSchema():
             return is_valid_string(json_str, curr_schema, state)
@@ -78,5 +293,23 @@ def _parse_one_token(
             return is_valid_object(json_str, curr_schema, state)
         case EnumJsonSchema():
             return is_valid_enum(json_str, curr_schema, state)
+        case NumberJsonSchema():
+            return is_valid_number(json_str, curr_schema, state)
+        case ArrayJsonSchema():
+            return is_valid_array(
+                json_str,
+                curr_schema,
+                state,
+                lambda json_str, state: _parse_one_token(json_str, state, schema),
+            )
+        case BooleanJsonSchema() | NullJsonSchema():
+            return is_valid_literal(json_str, curr_schema, state)
+        case UnionJsonSchema():
+            return is_valid_union(
+                json_str,
+                curr_schema,
+                state,
+                lambda json_str, state: _parse_one_token(json_str, state, schema),
+            )
         case default:
             raise ValueError(f"Unknown schema type {default}")
@@ -0,0 +1,125 @@
+from typing import Callable
+
+from json_schema_logits_processor.iterative_parser.types import (
+    WHITESPACE, IncrementalArrayValue, IterativeParserResult,
+    IterativeParserValue, pop_array_value, pop_value, push_value)
+from json_schema_logits_processor.schema.interative_schema import \
+    ArrayJsonSchema
+
+
+class ArrayState:
+    START = 0
+    OPEN = 1
+    POST_VALUE = 2
+    ELEMENT = 3
+    DONE = 4
+
+
+def _resume(
+    array_schema: ArrayJsonSchema, previous_state: IterativeParserResult
+) -> tuple[int, int, IterativeParserValue]:
+    item_value, rest = pop_value(previous_state.value_stack, array_schema.items)
+    array_value, rest = pop_array_value(rest, array_schema.id)
+    if array_value is None:
+        return 0, previous_state.next_state, rest
+    if item_value is not None:
+        # coming back from completing an element, only its count is kept
+        return array_value.count + 1, ArrayState.POST_VALUE, rest
+    if previous_state.next_state == ArrayState.START:
+        return 0, ArrayState.START, rest
+    return array_value.count, previous_state.next_state, rest
+
+
+def is_valid_array(
+    partial_json: str,
+    array_schema: ArrayJsonSchema,
+    previous_state: IterativeParserResult,
+    parse_item: Callable[[str, IterativeParserResult], IterativeParserResult],
+) -> IterativeParserResult:
+    # `parse_item` parses one character of an element, it is only needed
+    # for the first one since an element can't be told apart from the end
+    # of the array before seeing it.
+    count, next_state, rest = _resume(array_schema, previous_state)
+    string_index = previous_state.string_index
+    char = partial_json[string_index]
+    if next_state in (ArrayState.OPEN, ArrayState.ELEMENT) and char not in WHITESPACE:
+        if next_state == ArrayState.OPEN and char == "]":
+            return _close(string_index, array_schema, count, rest)
+        if array_schema.max_items is not None and count >= array_schema.max_items:
+            return _invalid(string_index, array_schema, next_state, count, rest)
+        return parse_item(
+            partial_json,
+            IterativeParserResult(
+                valid=True,
+                complete=False,
+                string_index=string_index,
+                schema_id=array_schema.items,
+                next_state=0,
+                value_stack=push_value(
+                    rest, array_schema.id, IncrementalArrayValue(count)
+                ),
+            ),
+        )
+    if char in WHITESPACE and next_state != ArrayState.DONE:
+        return _valid(string_index, array_schema, next_state, count, rest)
+    if next_state == ArrayState.START and char == "[":
+        return _valid(string_index, array_schema, ArrayState.OPEN, count, rest)
+    if next_state == ArrayState.POST_VALUE:
+        if char == "," and (
+            array_schema.max_items is None or count < array_schema.max_items
+        ):
+            return _valid(string_index, array_schema, ArrayState.ELEMENT, count, rest)
+        if char == "]":
+            return _close(string_index, array_schema, count, rest)
+    return _invalid(string_index, array_schema, next_state, count, rest)
+
+
+def _valid(
+    string_index: int,
+    array_schema: ArrayJsonSchema,
+    next_state: int,
+    count: int,
+    rest: IterativeParserValue,
+) -> IterativeParserResult:
+    return IterativeParserResult(
+        valid=True,
+        complete=False,
+        string_index=string_index + 1,
+        schema_id=array_schema.id,
+        next_state=next_state,
+        value_stack=push_value(rest, array_schema.id, IncrementalArrayValue(count)),
+    )
+
+
+def _close(
+    string_index: int,
+    array_schema: ArrayJsonSchema,
+    count: int,
+    rest: IterativeParserValue,
+) -> IterativeParserResult:
+    valid = count >= array_schema.min_items
+    return IterativeParserResult(
+        valid=valid,
+        complete=valid,
+        string_index=string_index + 1 if valid else string_index,
+        schema_id=array_schema.id,
+        next_state=ArrayState.DONE,
+        value_stack=push_value(rest, array_schema.id, IncrementalArrayValue(count)),
+    )
+
+
+def _invalid(
+    string_index: int,
+    array_schema: ArrayJsonSchema,
+    next_state: int,
+    count: int,
+    rest: IterativeParserValue,
+) -> IterativeParserResult:
+    return IterativeParserResult(
+        valid=False,
+        complete=False,
+        string_index=string_index,
+        schema_id=array_schema.id,
+        next_state=next_state,
+        value_stack=push_value(rest, array_schema.id, IncrementalArrayValue(count)),
+    )
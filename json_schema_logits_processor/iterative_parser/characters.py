@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+
+from json_schema_logits_processor.iterative_parser.number_parser import \
+    DIGITS
+from json_schema_logits_processor.iterative_parser.types import (
+    WHITESPACE, IterativeParserResult)
+from json_schema_logits_processor.schema.interative_schema import (
+    EnumJsonSchema, JsonSchema)
+
+# every character `str.isspace` accepts, a complete root value ends on any
+SPACES = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004"
+    "\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+# numbers, the letters of true, false and null, and punctuation
+_SYNTAX = DIGITS + "-+.eE" + "truefalsn" + '{}[]:,"\\'
+
+
+@dataclass
+class NextCharacters:
+    # The characters of the schema's alphabet a parser state accepts, with
+    # the state each one leads to. Characters outside the alphabet are all
+    # accepted or all rejected, see `others`. They are only ever accepted
+    # inside a string, where each becomes part of the value, so they still
+    # have to be parsed one by one.
+    successors: dict[str, IterativeParserResult]
+    alphabet: frozenset[str]
+    others: bool
+
+
+def schema_alphabet(schema: JsonSchema) -> frozenset[str]:
+    # The characters the parsers of `schema` tell apart: whitespace, JSON
+    # syntax and the letters of enum values and object keys. Every parser
+    # rejects any other character, except inside a string.
+    chars = set(SPACES + WHITESPACE + _SYNTAX)
+    for curr_schema in schema.schemas.values():
+        if isinstance(curr_schema, EnumJsonSchema):
+            for value in curr_schema.values:
+                chars.update(value)
+    return frozenset(chars)
+
+
+def other_character(alphabet: frozenset[str]) -> str:
+    # a character from the private use area standing in for all the
+    # characters outside `alphabet`
+    return next(
+        char for char in map(chr, range(0xE000, 0xF900)) if char not in alphabet
+    )
@@ -1,3 +1,5 @@
+from bisect import bisect_left
+
 from json_schema_logits_processor.iterative_parser.string_parser import \
     is_valid_string
 from json_schema_logits_processor.iterative_parser.types import (
@@ -15,10 +17,7 @@ def is_valid_enum(
     string_value, _ = pop_string_value(out.value_stack, enum_schema.id)
     assert string_value is not None
     if not out.complete:
-        valid = (
-            any(value.startswith(string_value.value) for value in enum_schema.values)
-            and out.valid
-        )
+        valid = out.valid and _has_value_with_prefix(enum_schema, string_value.value)
         return IterativeParserResult(
             valid=valid,
             complete=out.complete,
@@ -28,10 +27,23 @@ def is_valid_enum(
             value_stack=out.value_stack,
         )
     return IterativeParserResult(
-        valid=out.valid and string_value.value in enum_schema.values,
+        valid=out.valid and _has_value(enum_schema, string_value.value),
         complete=out.complete,
         string_index=out.string_index,
         schema_id=enum_schema.id,
         next_state=out.next_state,
         value_stack=out.value_stack,
     )
+
+
+def _has_value_with_prefix(enum_schema: EnumJsonSchema, prefix: str) -> bool:
+    # the first value not sorting before `prefix` is the only candidate
+    values = enum_schema.sorted_values
+    i = bisect_left(values, prefix)
+    return i < len(values) and values[i].startswith(prefix)
+
+
+def _has_value(enum_schema: EnumJsonSchema, value: str) -> bool:
+    values = enum_schema.sorted_values
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
@@ -0,0 +1,54 @@
+from json_schema_logits_processor.iterative_parser.types import (
+    WHITESPACE, IncrementalLiteralValue, IterativeParserResult,
+    IterativeParserValue, pop_literal_value, push_value)
+from json_schema_logits_processor.schema.interative_schema import (
+    BooleanJsonSchema, NullJsonSchema, SchemaId)
+
+
+class LiteralState:
+    START = 0
+    LITERAL = 1
+
+
+def literals(schema: BooleanJsonSchema | NullJsonSchema) -> tuple[str, ...]:
+    if isinstance(schema, BooleanJsonSchema):
+        return ("true", "false")
+    return ("null",)
+
+
+def _resume(
+    schema_id: SchemaId, previous_state: IterativeParserResult
+) -> tuple[str, int, int, IterativeParserValue]:
+    value, rest = pop_literal_value(previous_state.value_stack, schema_id)
+    if value is None or previous_state.next_state == LiteralState.START:
+        return "", previous_state.string_index, LiteralState.START, rest
+    return (
+        value.value,
+        previous_state.string_index,
+        previous_state.next_state,
+        rest,
+    )
+
+
+def is_valid_literal(
+    partial_json: str,
+    schema: BooleanJsonSchema | NullJsonSchema,
+    previous_state: IterativeParserResult,
+) -> IterativeParserResult:
+    value, string_idx, next_state, rest = _resume(schema.id, previous_state)
+    char = partial_json[string_idx]
+    if next_state == LiteralState.START and char in WHITESPACE:
+        valid, complete = True, False
+    else:
+        value = value + char
+        next_state = LiteralState.LITERAL
+        valid = any(literal.startswith(value) for literal in literals(schema))
+        complete = valid and value in literals(schema)
+    return IterativeParserResult(
+        valid=valid,
+        complete=complete,
+        string_index=string_idx + 1 if valid else string_idx,
+        schema_id=schema.id,
+        next_state=next_state,
+        value_stack=push_value(rest, schema.id, IncrementalLiteralValue(value)),
+    )
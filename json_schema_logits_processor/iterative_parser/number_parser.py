@@ -0,0 +1,220 @@
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+from typing import Hashable, Iterator
+
+from json_schema_logits_processor.iterative_parser.types import (
+    WHITESPACE, IncrementalNumberValue, IterativeParserResult,
+    IterativeParserValue, pop_number_value, push_value)
+from json_schema_logits_processor.schema.interative_schema import (
+    NumberJsonSchema, SchemaId)
+
+
+class NumberState:
+    START = 0
+    MINUS = 1
+    ZERO = 2
+    INTEGER = 3
+    DOT = 4
+    FRACTION = 5
+    EXPONENT = 6
+    EXPONENT_SIGN = 7
+    EXPONENT_DIGITS = 8
+
+
+# states where the literal read so far is a whole number
+COMPLETE_STATES = (
+    NumberState.ZERO,
+    NumberState.INTEGER,
+    NumberState.FRACTION,
+    NumberState.EXPONENT_DIGITS,
+)
+DIGITS = "0123456789"
+
+
+def _resume(
+    schema_id: SchemaId, previous_state: IterativeParserResult
+) -> tuple[str, int, int, IterativeParserValue]:
+    value, rest = pop_number_value(previous_state.value_stack, schema_id)
+    if value is None or previous_state.next_state == NumberState.START:
+        return "", previous_state.string_index, previous_state.next_state, rest
+    return (
+        value.value,
+        previous_state.string_index,
+        previous_state.next_state,
+        rest,
+    )
+
+
+def is_valid_number(
+    partial_json: str,
+    schema: NumberJsonSchema,
+    previous_state: IterativeParserResult,
+) -> IterativeParserResult:
+    # Numbers have no closing character: once the literal is a complete
+    # number it stays open for more digits, and the parent parser gets the
+    # first character that doesn't fit, see `_parse_one_token`.
+    value, string_idx, next_state, rest = _resume(schema.id, previous_state)
+    char = partial_json[string_idx]
+    valid, next_state = _next(char, next_state, schema)
+    if next_state != NumberState.START:
+        value = value + char
+    valid = valid and _can_reach_range(value, next_state, schema)
+    complete = valid and next_state in COMPLETE_STATES and _in_range(value, schema)
+    return IterativeParserResult(
+        valid=valid,
+        complete=complete,
+        string_index=string_idx + 1 if valid else string_idx,
+        schema_id=schema.id,
+        next_state=next_state,
+        value_stack=push_value(rest, schema.id, IncrementalNumberValue(value)),
+    )
+
+
+def _next(char: str, next_state: int, schema: NumberJsonSchema) -> tuple[bool, int]:
+    # exponents make range checks on prefixes impractical, so they are only
+    # allowed for unbounded numbers
+    allow_fraction = not schema.integer
+    allow_exponent = allow_fraction and not is_bounded(schema)
+    if next_state == NumberState.START:
+        if char in WHITESPACE:
+            return True, NumberState.START
+        if char == "-":
+            return True, NumberState.MINUS
+    if next_state in (NumberState.START, NumberState.MINUS):
+        if char == "0":
+            return True, NumberState.ZERO
+        if char in DIGITS:
+            return True, NumberState.INTEGER
+        return False, next_state
+    if next_state in (NumberState.ZERO, NumberState.INTEGER):
+        if char in DIGITS and next_state == NumberState.INTEGER:
+            return True, NumberState.INTEGER
+        if char == "." and allow_fraction:
+            return True, NumberState.DOT
+    if next_state in (NumberState.DOT, NumberState.FRACTION):
+        if char in DIGITS:
+            return True, NumberState.FRACTION
+        if next_state == NumberState.DOT:
+            return False, next_state
+    if next_state in (NumberState.ZERO, NumberState.INTEGER, NumberState.FRACTION):
+        if char in "eE" and allow_exponent:
+            return True, NumberState.EXPONENT
+        return False, next_state
+    if next_state == NumberState.EXPONENT and char in "+-":
+        return True, NumberState.EXPONENT_SIGN
+    if char in DIGITS:
+        return True, NumberState.EXPONENT_DIGITS
+    return False, next_state
+
+
+def is_bounded(schema: NumberJsonSchema) -> bool:
+    return schema.minimum is not None or schema.maximum is not None
+
+
+def range_key(value: str, schema: NumberJsonSchema) -> Hashable:
+    # What the literal read so far of a bounded number means for the rest:
+    # its sign and how its magnitude compares with each bound's. Everything
+    # after it is decided by those comparisons, and each only needs the
+    # digits read so far up to the length of the bound's, so a schema has
+    # finitely many keys however long its numbers get.
+    return (
+        value.startswith("-"),
+        *(
+            _compare_digits(value.lstrip("-"), _bound_digits(bound))
+            for bound in (schema.minimum, schema.maximum)
+            if bound is not None
+        ),
+    )
+
+
+def _bound_digits(bound: float) -> str:
+    digits = format(abs(Decimal(str(bound))), "f")
+    if "." in digits:
+        digits = digits.rstrip("0").rstrip(".")
+    return digits
+
+
+def _compare_digits(digits: str, bound: str) -> tuple:
+    # -1, 0 or 1 as `digits` is below, level with or above `bound` so far,
+    # along with as much of its length as can still change that
+    integer, _, fraction = digits.partition(".")
+    bound_integer, _, bound_fraction = bound.partition(".")
+    if len(integer) > len(bound_integer):
+        return ("integer", None, 1)
+    order = _order(integer, bound_integer[: len(integer)])
+    if order != 0 or len(integer) < len(bound_integer):
+        return ("integer", len(integer), order)
+    order = _order(fraction[: len(bound_fraction)], bound_fraction[: len(fraction)])
+    if order == 0 and fraction[len(bound_fraction) :].strip("0"):
+        order = 1
+    if order != 0:
+        return ("fraction", None, order)
+    return ("fraction", min(len(fraction), len(bound_fraction)), order)
+
+
+def _order(digits: str, bound: str) -> int:
+    # digit strings of the same length compare like the numbers they spell
+    return (digits > bound) - (digits < bound)
+
+
+def _in_range(value: str, schema: NumberJsonSchema) -> bool:
+    number = Decimal(value)
+    if schema.minimum is not None and number < Decimal(str(schema.minimum)):
+        return False
+    if schema.maximum is not None and number > Decimal(str(schema.maximum)):
+        return False
+    return True
+
+
+def _can_reach_range(value: str, next_state: int, schema: NumberJsonSchema) -> bool:
+    # Whether any number starting with `value` is in range. Without
+    # exponents the magnitudes it can still reach are a union of [low, high)
+    # intervals, with high None for unbounded, see `_magnitudes`.
+    if not is_bounded(schema) or next_state == NumberState.START:
+        return True
+    if next_state == NumberState.ZERO and schema.integer:
+        return _in_range(value, schema)
+    # bounds on the value become bounds on its magnitude
+    minimum = None if schema.minimum is None else Decimal(str(schema.minimum))
+    maximum = None if schema.maximum is None else Decimal(str(schema.maximum))
+    if value.startswith("-"):
+        minimum, maximum = (
+            None if maximum is None else -maximum,
+            None if minimum is None else -minimum,
+        )
+    if schema.integer:
+        # only whole magnitudes can be reached
+        if minimum is not None:
+            minimum = minimum.to_integral_value(rounding=ROUND_CEILING)
+        if maximum is not None:
+            maximum = maximum.to_integral_value(rounding=ROUND_FLOOR)
+    for low, high in _magnitudes(value.lstrip("-"), next_state, maximum):
+        if maximum is not None and low > maximum:
+            continue
+        if minimum is not None and high is not None and high <= minimum:
+            continue
+        return True
+    return False
+
+
+def _magnitudes(
+    digits: str, next_state: int, maximum: Decimal | None
+) -> Iterator[tuple[Decimal, Decimal | None]]:
+    if next_state == NumberState.MINUS:
+        yield Decimal(0), None
+    elif next_state == NumberState.ZERO:
+        yield Decimal(0), Decimal(1)
+    elif next_state == NumberState.INTEGER:
+        # every further digit multiplies the integer by ten, and a fraction
+        # adds less than one: d digits on become [d * 10^k, (d + 1) * 10^k)
+        integer = Decimal(digits)
+        if maximum is None:
+            yield integer, None
+            return
+        scale = Decimal(1)
+        while integer * scale <= maximum:
+            yield integer * scale, (integer + 1) * scale
+            scale *= 10
+    else:
+        integer_part, _, fraction = digits.partition(".")
+        low = Decimal(f"{integer_part}.{fraction}" if fraction else integer_part)
+        yield low, low + Decimal(1).scaleb(-len(fraction))
@@ -1,5 +1,7 @@
+from json_schema_logits_processor.iterative_parser.enum_parser import \
+    is_valid_enum
 from json_schema_logits_processor.iterative_parser.types import (
-    WHITESPACE, IncrementalObjectValue, IterativeParserResult,
+    EMPTY_STACK, WHITESPACE, IncrementalObjectValue, IterativeParserResult,
     IterativeParserValue, pop_object_value, pop_string_value, pop_value,
     push_value)
 from json_schema_logits_processor.schema.interative_schema import \
@@ -11,6 +13,7 @@ class ObjectState:
     POST_VALUE = 1
     COLON = 2
     DONE = 3
+    OPEN = 4
 
 
 def _resume(
@@ -52,7 +55,15 @@ def _resume(
         # This means we are coming back from completing parsing a key.
         # We need to set our next state appropriately, remove the new key from
         # remaining keys, and remove the key entry from the value
-        assert keys_value.value in object_value.remaining_keys
+        if keys_value.value not in object_value.remaining_keys:
+            # the key has already been used in this object
+            return (
+                previous_state.string_index,
+                ObjectState.DONE,
+                object_value.remaining_keys,
+                keys_value.value,
+                rest,
+            )
         return (
             previous_state.string_index,
             ObjectState.COLON,
@@ -86,12 +97,32 @@ def is_valid_object(
     string_index, next_state, remaining_keys, latest_key, rest = _resume(
         object_schema, previous_state
     )
+    object_value = IncrementalObjectValue(remaining_keys, latest_key)
+    if (
+        next_state is ObjectState.OPEN
+        and partial_json[string_index] not in WHITESPACE
+        and partial_json[string_index] != "}"
+    ):
+        # the first key, parsed by the keys schema from this character on
+        return is_valid_enum(
+            partial_json,
+            object_schema.keys_schema,
+            IterativeParserResult(
+                valid=True,
+                complete=False,
+                string_index=string_index,
+                schema_id=object_schema.keys_schema.id,
+                next_state=0,
+                value_stack=push_value(rest, object_schema.id, object_value),
+            ),
+        )
     out = _next(
         partial_json,
         string_index,
         next_state,
         object_schema,
         latest_key,
+        remaining_keys,
     )
     return IterativeParserResult(
         string_index=out.string_index,
@@ -99,9 +130,7 @@ def is_valid_object(
         valid=out.valid,
         complete=out.complete,
         schema_id=out.schema_id,
-        value_stack=push_value(
-            rest, object_schema.id, IncrementalObjectValue(remaining_keys, latest_key)
-        ),
+        value_stack=push_value(rest, object_schema.id, object_value),
     )
 
 
@@ -111,13 +140,25 @@ def _next(
     next_state: int,
     object_schema: ObjectJsonSchema,
     latest_key: str | None = None,
+    remaining_keys: tuple[str, ...] = (),
 ) -> IterativeParserResult:
     if next_state is ObjectState.START:
         return _start(partial_json, string_index, object_schema)
+    if next_state is ObjectState.OPEN:
+        return _open(partial_json, string_index, object_schema)
     if next_state is ObjectState.POST_VALUE:
-        return _post_value(partial_json, string_index, object_schema)
+        return _post_value(partial_json, string_index, object_schema, remaining_keys)
     if next_state is ObjectState.COLON:
         return _colon(partial_json, string_index, object_schema, latest_key)
+    if next_state is ObjectState.DONE:
+        return IterativeParserResult(
+            valid=False,
+            complete=False,
+            string_index=string_index,
+            schema_id=object_schema.id,
+            next_state=ObjectState.DONE,
+            value_stack=EMPTY_STACK,
+        )
     raise ValueError(f"Unknown state {next_state}")
 
 
@@ -131,9 +172,9 @@ def _start(
             valid=True,
             complete=False,
             string_index=string_index + 1,
-            schema_id=object_schema.keys_schema.id,
-            next_state=0,
-            value_stack=(),
+            schema_id=object_schema.id,
+            next_state=ObjectState.OPEN,
+            value_stack=EMPTY_STACK,
         )
     if partial_json[string_index] in WHITESPACE:
         return IterativeParserResult(
@@ -142,7 +183,7 @@ def _start(
             string_index=string_index + 1,
             schema_id=object_schema.id,
             next_state=ObjectState.START,
-            value_stack=(),
+            value_stack=EMPTY_STACK,
         )
     return IterativeParserResult(
         valid=False,
@@ -150,7 +191,41 @@ def _start(
         string_index=string_index,
         schema_id=object_schema.id,
         next_state=ObjectState.DONE,
-        value_stack=(),
+        value_stack=EMPTY_STACK,
+    )
+
+
+def _open(
+    partial_json: str,
+    string_index: int,
+    object_schema: ObjectJsonSchema,
+) -> IterativeParserResult:
+    # anything but whitespace or "}" is the first key, see `is_valid_object`
+    if partial_json[string_index] in WHITESPACE:
+        return IterativeParserResult(
+            valid=True,
+            complete=False,
+            string_index=string_index + 1,
+            schema_id=object_schema.id,
+            next_state=ObjectState.OPEN,
+            value_stack=EMPTY_STACK,
+        )
+    if len(object_schema.required) == 0:
+        return IterativeParserResult(
+            valid=True,
+            complete=True,
+            string_index=string_index + 1,
+            schema_id=object_schema.id,
+            next_state=ObjectState.DONE,
+            value_stack=EMPTY_STACK,
+        )
+    return IterativeParserResult(
+        valid=False,
+        complete=False,
+        string_index=string_index,
+        schema_id=object_schema.id,
+        next_state=ObjectState.OPEN,
+        value_stack=EMPTY_STACK,
     )
 
 
@@ -167,7 +242,7 @@ def _colon(
             string_index=string_index + 1,
             schema_id=object_schema.id,
             next_state=ObjectState.COLON,
-            value_stack=(),
+            value_stack=EMPTY_STACK,
         )
     if partial_json[string_index] == ":":
         assert latest_key is not None
@@ -178,7 +253,7 @@ def _colon(
             string_index=string_index + 1,
             schema_id=schema_id,
             next_state=0,
-            value_stack=(),
+            value_stack=EMPTY_STACK,
         )
     return IterativeParserResult(
         valid=False,
@@ -186,7 +261,7 @@ def _colon(
         string_index=string_index,
         schema_id=object_schema.id,
         next_state=ObjectState.COLON,
-        value_stack=(),
+        value_stack=EMPTY_STACK,
     )
 
 
@@ -194,6 +269,7 @@ def _post_value(
     partial_json: str,
     string_index: int,
     object_schema: ObjectJsonSchema,
+    remaining_keys: tuple[str, ...] = (),
 ) -> IterativeParserResult:
     if partial_json[string_index] in WHITESPACE:
         return IterativeParserResult(
@@ -202,7 +278,7 @@ def _post_value(
             string_index=string_index + 1,
             schema_id=object_schema.id,
             next_state=ObjectState.POST_VALUE,
-            value_stack=(),
+            value_stack=EMPTY_STACK,
         )
     if partial_json[string_index] == ",":
         return IterativeParserResult(
@@ -211,16 +287,18 @@ def _post_value(
             string_index=string_index + 1,
             schema_id=object_schema.keys_schema.id,
             next_state=0,
-            value_stack=(),
+            value_stack=EMPTY_STACK,
         )
-    if partial_json[string_index] == "}":
+    if partial_json[string_index] == "}" and not any(
+        key in remaining_keys for key in object_schema.required
+    ):
         return IterativeParserResult(
             valid=True,
             complete=True,
             string_index=string_index + 1,
             schema_id=object_schema.id,
             next_state=ObjectState.DONE,
-            value_stack=(),
+            value_stack=EMPTY_STACK,
         )
     return IterativeParserResult(
         valid=False,
@@ -228,5 +306,5 @@ def _post_value(
         string_index=string_index,
         schema_id=object_schema.id,
         next_state=ObjectState.POST_VALUE,
-        value_stack=(),
+        value_stack=EMPTY_STACK,
     )
@@ -14,18 +14,18 @@ class StringState:
 
 def _resume(
     schema_id: SchemaId, previous_state: IterativeParserResult
-) -> tuple[int, int, int, IterativeParserValue]:
+) -> tuple[IncrementalStringValue, int, int, IterativeParserValue]:
     value, rest = pop_string_value(previous_state.value_stack, schema_id)
-    if value is None:
+    if value is None or previous_state.next_state == StringState.START:
         return (
-            previous_state.string_index,
+            IncrementalStringValue("", previous_state.string_index),
             previous_state.string_index,
             previous_state.next_state,
             rest,
         )
 
     return (
-        value.start_index,
+        value,
         previous_state.string_index,
         previous_state.next_state,
         rest,
@@ -37,53 +37,47 @@ def is_valid_string(
     schema: StringJsonSchema | EnumJsonSchema,
     previous_state: IterativeParserResult,
 ) -> IterativeParserResult:
-    value_start_idx, string_idx, next_state, rest = _resume(schema.id, previous_state)
-
-    valid, next_state, new_index = _next(partial_json, string_idx, next_state)
-    return_value = _parse_value(partial_json, value_start_idx, new_index)
-    new_value = IncrementalStringValue(value=return_value, start_index=value_start_idx)
+    value, string_idx, next_state, rest = _resume(schema.id, previous_state)
+
+    previous_state_id = next_state
+    # the character is read once, the text is never sliced
+    char = partial_json[string_idx]
+    valid, next_state, new_index = _next(char, string_idx, next_state)
+    if previous_state_id != StringState.START and next_state != StringState.DONE:
+        # the value is built one character at a time, without the functional
+        # quotes, on top of the previous one rather than copied
+        value = value.append(char)
     return IterativeParserResult(
         valid=valid,
         complete=next_state == StringState.DONE,
         string_index=new_index,
         schema_id=schema.id,
         next_state=next_state if next_state != StringState.DONE else 0,
-        value_stack=push_value(rest, schema.id, new_value),
+        value_stack=push_value(rest, schema.id, value),
     )
 
 
-def _parse_value(value: str, start_idx: int, end_idx: int):
-    value = value[start_idx:end_idx]
-    value = value.lstrip()
-    # remove functional quotes
-    if len(value) > 0 and value.startswith('"'):
-        value = value[1:]
-    if len(value) > 0 and value.endswith('"') and len(value) > 1 and value[-2] != "\\":
-        value = value[:-1]
-    return value
-
-
-def _next(partial_json: str, start_idx: int, next_state: int):
+def _next(char: str, start_idx: int, next_state: int):
     if next_state == StringState.START:
-        return _start(partial_json, start_idx)
+        return _start(char, start_idx)
     if next_state == StringState.STRING:
-        return _string(partial_json, start_idx)
+        return _string(char, start_idx)
     if next_state == StringState.ESCAPE:
         return True, StringState.STRING, start_idx + 1
     raise ValueError(f"Unknown state {next_state}")
 
 
-def _start(partial_json: str, start_idx: int):
-    if partial_json[start_idx] in WHITESPACE:
+def _start(char: str, start_idx: int):
+    if char in WHITESPACE:
         return (True, StringState.START, start_idx + 1)
-    if partial_json[start_idx].startswith('"'):
+    if char == '"':
         return (True, StringState.STRING, start_idx + 1)
     return (False, StringState.START, start_idx)
 
 
-def _string(partial_json: str, start_idx: int):
-    if partial_json[start_idx].startswith('"'):
+def _string(char: str, start_idx: int):
+    if char == '"':
         return (True, StringState.DONE, start_idx + 1)
-    if partial_json[start_idx].startswith("\\"):
+    if char == "\\":
         return (True, StringState.ESCAPE, start_idx + 1)
     return (True, StringState.STRING, start_idx + 1)
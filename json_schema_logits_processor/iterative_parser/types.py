@@ -1,19 +1,146 @@
 from dataclasses import dataclass
-from typing import Optional, Union
+from typing import Iterable, Iterator, Optional, Union
 
 from json_schema_logits_processor.schema.interative_schema import SchemaId
 
 
-@dataclass
 class IncrementalStringValue:
-    value: str
-    start_index: int
+    # The text of a string value without its quotes. Characters are added
+    # on top of the previous value instead of copying it, with a rolling
+    # hash, so a step costs the same at any length. The text is only joined
+    # together when `value` is read.
+    __slots__ = ("start_index", "_previous", "_chars", "_length", "_hash", "_value")
+
+    def __init__(self, value: str, start_index: int):
+        self.start_index = start_index
+        self._previous: IncrementalStringValue | None = None
+        self._chars: str | None = None
+        self._length = len(value)
+        self._hash = _extend_hash(0, value)
+        self._value: str | None = value
+
+    def append(self, chars: str) -> "IncrementalStringValue":
+        out = object.__new__(IncrementalStringValue)
+        out.start_index = self.start_index
+        out._previous = self
+        out._chars = chars
+        if len(chars) == 1:
+            out._length = self._length + 1
+            out._hash = (self._hash * _HASH_BASE + ord(chars)) & _HASH_MASK
+        else:
+            out._length = self._length + len(chars)
+            out._hash = _extend_hash(self._hash, chars)
+        out._value = None
+        return out
+
+    def with_start_index(self, start_index: int) -> "IncrementalStringValue":
+        out = object.__new__(IncrementalStringValue)
+        out.start_index = start_index
+        out._previous = self._previous
+        out._chars = self._chars
+        out._length = self._length
+        out._hash = self._hash
+        out._value = self._value
+        return out
+
+    @property
+    def value(self) -> str:
+        if self._value is None:
+            chunks = []
+            node: IncrementalStringValue | None = self
+            while node is not None:
+                chunk, node = _chunk(node)
+                chunks.append(chunk)
+            self._value = "".join(reversed(chunks))
+            # the earlier values are no longer needed to build this one, so
+            # they can be freed
+            self._previous = None
+            self._chars = None
+        return self._value
+
+    def text_from(self, start: int) -> str:
+        # the text after its first `start` characters, walking back only
+        # over the chunks that hold it
+        chunks = []
+        length = self._length
+        node: IncrementalStringValue | None = self
+        while length > start and node is not None:
+            chunk, node = _chunk(node)
+            chunks.append(chunk[max(0, start - (length - len(chunk))) :])
+            length -= len(chunk)
+        return "".join(reversed(chunks))
+
+    def __eq__(self, other):
+        if not isinstance(other, IncrementalStringValue):
+            return NotImplemented
+        return (
+            self.start_index == other.start_index
+            and self._length == other._length
+            and self._hash == other._hash
+            and _same_text(self, other)
+        )
 
     def __hash__(self):
-        return hash((self.value, self.start_index))
+        return hash((self._hash, self.start_index))
+
+    def __repr__(self):
+        return (
+            f"IncrementalStringValue(value={self.value!r}, "
+            f"start_index={self.start_index})"
+        )
 
+    def __reduce__(self):
+        return IncrementalStringValue, (self.value, self.start_index)
 
-@dataclass
+
+def _chunk(
+    node: IncrementalStringValue,
+) -> tuple[str, IncrementalStringValue | None]:
+    # the last part of the text of `node`, and the node with the rest
+    value = node._value
+    if value is not None:
+        return value, None
+    previous, chars = node._previous, node._chars
+    if previous is None or chars is None:
+        # another thread joined the text in the meantime
+        return node._value, None
+    return chars, previous
+
+
+def _same_text(a: IncrementalStringValue, b: IncrementalStringValue) -> bool:
+    # Compares two texts of the same length from the end, chunk by chunk,
+    # without joining them. Chains that meet share the rest.
+    a_text, b_text = "", ""
+    a_node: IncrementalStringValue | None = a
+    b_node: IncrementalStringValue | None = b
+    while True:
+        if not a_text and not b_text and a_node is b_node:
+            return True
+        if not a_text and a_node is not None:
+            a_text, a_node = _chunk(a_node)
+            continue
+        if not b_text and b_node is not None:
+            b_text, b_node = _chunk(b_node)
+            continue
+        if not a_text or not b_text:
+            return False
+        n = min(len(a_text), len(b_text))
+        if a_text[len(a_text) - n :] != b_text[len(b_text) - n :]:
+            return False
+        a_text, b_text = a_text[: len(a_text) - n], b_text[: len(b_text) - n]
+
+
+_HASH_BASE = 1_000_003
+_HASH_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _extend_hash(value_hash: int, chars: str) -> int:
+    for char in chars:
+        value_hash = (value_hash * _HASH_BASE + ord(char)) & _HASH_MASK
+    return value_hash
+
+
+@dataclass(slots=True)
 class IncrementalObjectValue:
     remaining_keys: tuple[str, ...]
     latest_added_key: str | None
@@ -22,71 +149,230 @@ class IncrementalObjectValue:
         return hash((self.remaining_keys,))
 
 
-IterativeParserValue = tuple[
-    tuple[
-        SchemaId,
-        Union[
-            IncrementalStringValue,
-            IncrementalObjectValue,
-        ],
+@dataclass(slots=True)
+class IncrementalNumberValue:
+    # the number literal read so far
+    value: str
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+@dataclass(slots=True)
+class IncrementalArrayValue:
+    # number of elements completed so far
+    count: int
+
+    def __hash__(self):
+        return hash(self.count)
+
+
+@dataclass(slots=True)
+class IncrementalLiteralValue:
+    # the part of true, false or null read so far
+    value: str
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+@dataclass(slots=True)
+class IncrementalUnionValue:
+    # the parser state of every alternative that still matches, each parsed
+    # as if it were the root
+    states: tuple["IterativeParserResult", ...]
+
+    def __hash__(self):
+        return hash(self.states)
+
+
+Frame = tuple[
+    SchemaId,
+    Union[
+        IncrementalStringValue,
+        IncrementalObjectValue,
+        IncrementalNumberValue,
+        IncrementalArrayValue,
+        IncrementalLiteralValue,
+        IncrementalUnionValue,
     ],
-    ...,
 ]
 
 
+class ValueStack:
+    # The values being parsed, innermost last, as an immutable linked list
+    # of (schema id, value) frames. Pushing and popping share the frames
+    # below, so both take the same time at any depth. The hash is worked
+    # out frame by frame when it is first asked for, and kept. Iterates,
+    # indexes and compares like the tuple of its frames.
+    __slots__ = ("rest", "frame", "depth", "_hash")
+
+    def __init__(self, rest: "ValueStack | None" = None, frame: Frame | None = None):
+        self.rest = rest
+        self.frame = frame
+        if rest is None:
+            self.depth, self._hash = 0, 0
+        else:
+            self.depth = rest.depth + 1
+            self._hash = None
+
+    @classmethod
+    def of(cls, frames: Iterable[Frame]) -> "ValueStack":
+        if isinstance(frames, ValueStack):
+            return frames
+        stack = EMPTY_STACK
+        for frame in frames:
+            stack = ValueStack(stack, frame)
+        return stack
+
+    def push(self, schema_id: SchemaId, value) -> "ValueStack":
+        return ValueStack(self, (schema_id, value))
+
+    def frames(self) -> tuple[Frame, ...]:
+        frames = []
+        node = self
+        while node.depth > 0:
+            frames.append(node.frame)
+            node = node.rest
+        return tuple(reversed(frames))
+
+    def __iter__(self) -> Iterator[Frame]:
+        return iter(self.frames())
+
+    def __len__(self):
+        return self.depth
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ValueStack.of(self.frames()[index])
+        return self.frames()[index]
+
+    def __eq__(self, other):
+        if isinstance(other, tuple):
+            return self.frames() == other
+        if not isinstance(other, ValueStack):
+            return NotImplemented
+        if self.depth != other.depth:
+            return False
+        # stacks pushed onto the same frames stop comparing where they meet
+        while self is not other:
+            if self.frame != other.frame:
+                return False
+            self, other = self.rest, other.rest
+        return True
+
+    def __hash__(self):
+        if self._hash is None:
+            unhashed = []
+            node = self
+            while node._hash is None:
+                unhashed.append(node)
+                node = node.rest
+            for node in reversed(unhashed):
+                node._hash = hash((node.rest._hash, node.frame))
+        return self._hash
+
+    def __repr__(self):
+        return f"ValueStack({self.frames()!r})"
+
+    def __reduce__(self):
+        return ValueStack.of, (self.frames(),)
+
+
+EMPTY_STACK = ValueStack()
+IterativeParserValue = ValueStack
+
+
 def push_value(
     value_stack: IterativeParserValue,
     schema_id: SchemaId,
-    value: Union[IncrementalStringValue, IncrementalObjectValue],
+    value: Union[
+        IncrementalStringValue,
+        IncrementalObjectValue,
+        IncrementalNumberValue,
+        IncrementalArrayValue,
+        IncrementalLiteralValue,
+        IncrementalUnionValue,
+    ],
 ) -> IterativeParserValue:
-    return value_stack + ((schema_id, value),)
+    return ValueStack(value_stack, (schema_id, value))
 
 
 def pop_value(
     value_stack: IterativeParserValue,
     schema_id: SchemaId,
-):
-    if len(value_stack) == 0:
+) -> tuple[Optional[Frame], IterativeParserValue]:
+    frame = value_stack.frame
+    if frame is None or frame[0] != schema_id:
         return None, value_stack
-    if len(value_stack) == 1:
-        rest, value = (), value_stack[0]
-    else:
-        rest, value = value_stack[:-1], value_stack[-1]
-    if value[0] != schema_id:
-        return None, value_stack
-    return value, rest
+    return frame, value_stack.rest
 
 
 def pop_string_value(
     value_stack: IterativeParserValue,
     schema_id: SchemaId,
 ) -> tuple[Optional[IncrementalStringValue], IterativeParserValue]:
-    if len(value_stack) == 0:
+    frame = value_stack.frame
+    if frame is None or frame[0] != schema_id:
+        return None, value_stack
+    assert isinstance(frame[1], IncrementalStringValue)
+    return frame[1], value_stack.rest
+
+
+def pop_number_value(
+    value_stack: IterativeParserValue,
+    schema_id: SchemaId,
+) -> tuple[Optional[IncrementalNumberValue], IterativeParserValue]:
+    frame = value_stack.frame
+    if frame is None or frame[0] != schema_id:
+        return None, value_stack
+    assert isinstance(frame[1], IncrementalNumberValue)
+    return frame[1], value_stack.rest
+
+
+def pop_literal_value(
+    value_stack: IterativeParserValue,
+    schema_id: SchemaId,
+) -> tuple[Optional[IncrementalLiteralValue], IterativeParserValue]:
+    frame = value_stack.frame
+    if frame is None or frame[0] != schema_id:
         return None, value_stack
-    if len(value_stack) == 1:
-        rest, value = (), value_stack[0]
-    else:
-        rest, value = value_stack[:-1], value_stack[-1]
-    if value[0] != schema_id:
+    assert isinstance(frame[1], IncrementalLiteralValue)
+    return frame[1], value_stack.rest
+
+
+def pop_union_value(
+    value_stack: IterativeParserValue,
+    schema_id: SchemaId,
+) -> tuple[Optional[IncrementalUnionValue], IterativeParserValue]:
+    frame = value_stack.frame
+    if frame is None or frame[0] != schema_id:
         return None, value_stack
-    assert value[0] == schema_id
-    assert isinstance(value[1], IncrementalStringValue)
-    return value[1], rest
+    assert isinstance(frame[1], IncrementalUnionValue)
+    return frame[1], value_stack.rest
 
 
 def pop_object_value(
-    valueStack: IterativeParserValue,
+    value_stack: IterativeParserValue,
     schema_id: SchemaId,
 ) -> tuple[Optional[IncrementalObjectValue], IterativeParserValue]:
-    if len(valueStack) == 0:
-        return None, valueStack
-    if len(valueStack) == 1:
-        rest, value = (), valueStack[0]
-    else:
-        rest, value = valueStack[:-1], valueStack[-1]
-    assert value[0] == schema_id
-    assert isinstance(value[1], IncrementalObjectValue)
-    return value[1], rest
+    frame = value_stack.frame
+    if frame is None or frame[0] != schema_id:
+        # a nested object that has not started yet
+        return None, value_stack
+    assert isinstance(frame[1], IncrementalObjectValue)
+    return frame[1], value_stack.rest
+
+
+def pop_array_value(
+    value_stack: IterativeParserValue,
+    schema_id: SchemaId,
+) -> tuple[Optional[IncrementalArrayValue], IterativeParserValue]:
+    frame = value_stack.frame
+    if frame is None or frame[0] != schema_id:
+        return None, value_stack
+    assert isinstance(frame[1], IncrementalArrayValue)
+    return frame[1], value_stack.rest
 
 
 def find_value(
@@ -104,7 +390,7 @@ def _replace_value(
     return_value: IncrementalStringValue | IncrementalObjectValue,
 ) -> IterativeParserValue:
     if previous_value is None:
-        return ((schema_id, return_value),)
+        return EMPTY_STACK.push(schema_id, return_value)
     new_value = []
     found = False
     for value in previous_value:
@@ -115,10 +401,10 @@ def _replace_value(
             new_value.append(value)
     if not found:
         new_value.append((schema_id, return_value))
-    return tuple(new_value)
+    return ValueStack.of(new_value)
 
 
-@dataclass
+@dataclass(slots=True)
 class IterativeParserResult:
     valid: bool
     complete: bool
@@ -127,6 +413,11 @@ class IterativeParserResult:
     next_state: int
     value_stack: IterativeParserValue
 
+    def __post_init__(self):
+        # a tuple of frames is taken wherever a stack is
+        if not isinstance(self.value_stack, ValueStack):
+            self.value_stack = ValueStack.of(self.value_stack)
+
     def __hash__(self):
         return hash(
             (
@@ -140,4 +431,29 @@ class IterativeParserResult:
         )
 
 
+def trim_parser_state(
+    tail: str, state: IterativeParserResult
+) -> tuple[str, IterativeParserResult]:
+    # The parsers only ever look at the character at `string_index`, so
+    # everything before it can be dropped and the indexes rebased onto the
+    # remaining tail. String start indexes can end up negative, they are
+    # only kept for reference.
+    offset = state.string_index
+    if offset == 0:
+        return tail, state
+    value_stack = EMPTY_STACK
+    for schema_id, value in state.value_stack:
+        if isinstance(value, IncrementalStringValue):
+            value = value.with_start_index(value.start_index - offset)
+        value_stack = value_stack.push(schema_id, value)
+    return tail[offset:], IterativeParserResult(
+        valid=state.valid,
+        complete=state.complete,
+        string_index=state.string_index - offset,
+        schema_id=state.schema_id,
+        next_state=state.next_state,
+        value_stack=value_stack,
+    )
+
+
 WHITESPACE = " \t\n\r"
@@ -0,0 +1,90 @@
+from dataclasses import replace
+from typing import Callable
+
+from json_schema_logits_processor.iterative_parser.types import (
+    EMPTY_STACK, WHITESPACE, IncrementalUnionValue, IterativeParserResult,
+    IterativeParserValue, pop_union_value, push_value)
+from json_schema_logits_processor.schema.interative_schema import (
+    SchemaId, UnionJsonSchema)
+
+
+class UnionState:
+    START = 0
+    ACTIVE = 1
+
+
+def _start(alternatives: tuple[SchemaId, ...]) -> tuple[IterativeParserResult, ...]:
+    return tuple(
+        IterativeParserResult(
+            valid=True,
+            complete=False,
+            string_index=0,
+            schema_id=alternative,
+            next_state=0,
+            value_stack=EMPTY_STACK,
+        )
+        for alternative in alternatives
+    )
+
+
+def _resume(
+    union_schema: UnionJsonSchema, previous_state: IterativeParserResult, char: str
+) -> tuple[tuple[IterativeParserResult, ...], IterativeParserValue]:
+    value, rest = pop_union_value(previous_state.value_stack, union_schema.id)
+    if value is None or previous_state.next_state == UnionState.START:
+        # only the alternatives that can start with `char` are parsed
+        alternatives = union_schema.alternatives_by_first_char.get(char, ())
+        return _start(alternatives), rest
+    return value.states, rest
+
+
+def is_valid_union(
+    partial_json: str,
+    union_schema: UnionJsonSchema,
+    previous_state: IterativeParserResult,
+    parse: Callable[[str, IterativeParserResult], IterativeParserResult],
+) -> IterativeParserResult:
+    # Every alternative that still matches is advanced side by side, each
+    # with its own state, so a character is only parsed once per live
+    # alternative and alternatives drop out as soon as they stop matching.
+    # Their string indexes are kept at 0 and set on every step, so equal
+    # states hash equally wherever they are in the text. Every alternative
+    # accepts whitespace before its value, so the union skips it itself and
+    # the first character after it picks the alternatives with one lookup.
+    string_index = previous_state.string_index
+    char = partial_json[string_index]
+    if previous_state.next_state == UnionState.START and char in WHITESPACE:
+        _, rest = pop_union_value(previous_state.value_stack, union_schema.id)
+        return IterativeParserResult(
+            valid=True,
+            complete=False,
+            string_index=string_index + 1,
+            schema_id=union_schema.id,
+            next_state=UnionState.START,
+            value_stack=rest,
+        )
+    states, rest = _resume(union_schema, previous_state, char)
+    next_states = []
+    for state in states:
+        out = parse(partial_json, replace(state, string_index=string_index))
+        if out.valid:
+            next_states.append(replace(out, string_index=0))
+    valid = len(next_states) > 0
+    if not valid:
+        next_states = list(states)
+    complete = any(
+        state.complete and state.schema_id in union_schema.alternatives
+        for state in next_states
+    )
+    return IterativeParserResult(
+        valid=valid,
+        complete=valid and complete,
+        string_index=string_index + 1 if valid else string_index,
+        schema_id=union_schema.id,
+        next_state=UnionState.ACTIVE,
+        value_stack=push_value(
+            rest,
+            union_schema.id,
+            IncrementalUnionValue(tuple(dict.fromkeys(next_states))),
+        ),
+    )
@@ -1,129 +1,884 @@
-from dataclasses import dataclass
-from typing import Callable
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import (CancelledError, Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from dataclasses import dataclass, replace
+from typing import Callable, Hashable
 
 import torch
 from transformers import LogitsProcessor, PreTrainedTokenizer
 
-from json_schema_logits_processor.iterative_parser import \
-    parse_partial_json_value
-from json_schema_logits_processor.schema.interative_schema import JsonSchema
+from json_schema_logits_processor.automaton import DEAD_STATE, TokenAutomaton
+from json_schema_logits_processor.iterative_parser import (
+    ParserMemo, advance_partial_json_value, canonical_state_key,
+    initial_parser_state)
+from json_schema_logits_processor.iterative_parser.string_parser import \
+    StringState
+from json_schema_logits_processor.iterative_parser.types import \
+    IterativeParserResult
+from json_schema_logits_processor.metrics import StepMetrics, phase_timer
+from json_schema_logits_processor.parallel import worker_valid_tokens
+from json_schema_logits_processor.schema.interative_schema import (
+    JsonSchema, SchemaId, StringJsonSchema)
+from json_schema_logits_processor.schema_cache import (
+    CacheStats, CompiledSchemaCache, default_compiled_schema_cache)
+from json_schema_logits_processor.trie import CharacterClass
+from json_schema_logits_processor.vocabulary import VocabularyIndex
 
 
 @dataclass
-class TrieNode:
-    id: int | None = None
-    is_root: bool = False
+class PrefetchStats:
+    # hits are calls that found their masks prefetched, `ready` of them
+    # without waiting
+    hits: int = 0
+    misses: int = 0
+    ready: int = 0
+    compute_seconds: float = 0.0
+    wait_seconds: float = 0.0
 
-    def __init__(self):
-        self.children = {}
+    @property
+    def hidden_seconds(self) -> float:
+        # mask computation that overlapped with the model instead of
+        # delaying `__call__`
+        return max(0.0, self.compute_seconds - self.wait_seconds)
 
 
-class Trie:
-    def __init__(self, eos_token_id: int):
-        self.root = TrieNode()
-        self.root.is_root = True
-        self.eos_token_id = eos_token_id
-
-    def insert(self, token: str, id: int):
-        node = self.root
-        for char in token:
-            if char not in node.children:
-                node.children[char] = TrieNode()
-            node = node.children[char]
-        node.id = id
+@dataclass
+class SequenceState:
+    # the decoded text `parser_state` still refers to, not the whole sequence
+    tail: str
+    parser_state: IterativeParserResult
+    automaton_state: int | None = None
 
-    def _search_for_valid_token_ids(
-        self,
-        prefix: str,
-        next_token: str,
-        node: TrieNode,
-        is_valid: Callable[[str, str], tuple[bool, bool]],
-        valid_token_ids: list[int],
-    ):
-        stack = [(prefix, next_token, node)]  # Create a stack with the initial state
-        while stack:  # While the stack is not empty
-            prefix, next_token, node = stack.pop()
 
-            valid, complete = None, None
-            if not node.is_root:
-                valid, complete = is_valid(prefix, next_token)
-            new_prefix = prefix + next_token
+class _CountedSteps(dict):
+    # a character class that counts the children the trie walk enters
+    # through it, see `StepMetrics.trie_nodes_visited`
+    def __init__(self, stepped: dict, counts: list[int]):
+        super().__init__(stepped)
+        self.counts = counts
 
-            if valid is False:
-                continue
-            for letter, child_node in node.children.items():
-                stack.append(
-                    (new_prefix, letter, child_node)
-                )  # Add children to the stack
-
-            if node.id is not None:
-                valid_token_ids.append(node.id)
-            if complete is True:
-                valid_token_ids.append(self.eos_token_id)
-
-    def find_valid_tokens(
-        self, prefix: str, is_valid: Callable[[str, str], tuple[bool, bool]]
-    ):
-        valid_tokens = []
-        self._search_for_valid_token_ids("", prefix, self.root, is_valid, valid_tokens)
-        return valid_tokens
+    def get(self, char, default=None):
+        out = super().get(char, default)
+        if out is not None and out[0] is not None:
+            self.counts[1] += 1
+        return out
 
 
 class JsonSchemaLogitsProcessor(LogitsProcessor):
     def __init__(
-        self, schema: JsonSchema, tokenizer: PreTrainedTokenizer, verbose: bool = False
+        self,
+        schema: JsonSchema,
+        tokenizer: PreTrainedTokenizer,
+        verbose: bool = False,
+        precompile: bool = False,
+        cache_dir: str | os.PathLike | None = None,
+        vocabulary: VocabularyIndex | None = None,
+        compiled_cache: CompiledSchemaCache | None = None,
+        memo_size: int = 100_000,
+        token_set_cache_size: int = 4096,
+        lazy_top_k: int | None = None,
+        executor: Executor | None = None,
+        mask_cache_size: int = 256,
+        profile: bool = False,
+        on_step: Callable[[StepMetrics], None] | None = None,
     ):
         super().__init__()
         self.verbose = verbose
         self.schema = schema
         self.tokenizer = tokenizer
-        self.bos_token_id = tokenizer.bos_token_id
-        self.padding_token_id = tokenizer.pad_token_id
-        assert tokenizer.eos_token_id is not None
-        self.eos_token_id = tokenizer.eos_token_id
-        self.decoded_tokens = self.tokenizer.batch_decode(
-            torch.arange(self.tokenizer.vocab_size), skip_special_tokens=True
+        if vocabulary is None:
+            vocabulary = VocabularyIndex.from_tokenizer(tokenizer, cache_dir)
+        self.vocabulary = vocabulary
+        self.bos_token_id = vocabulary.bos_token_id
+        self.padding_token_id = vocabulary.pad_token_id
+        self.eos_token_id = vocabulary.eos_token_id
+        self.decoded_tokens = vocabulary.decoded_tokens
+        self.decoded_token_tree = vocabulary.trie
+        # With a compiled schema cache the automaton fills in lazily and is
+        # shared with every other processor for the same schema.
+        self.automaton: TokenAutomaton | None = None
+        if precompile or compiled_cache is not None:
+            if compiled_cache is None:
+                compiled_cache = default_compiled_schema_cache
+            self.automaton = compiled_cache.get(
+                self.schema, self.vocabulary, compile=precompile
+            )
+            if self.automaton.too_large:
+                # too many states to compile, valid tokens come from trie
+                # walks and the token set cache instead
+                self.automaton = None
+        # parser results for the current generation, see `clear`
+        self.memo = ParserMemo(schema, max_entries=memo_size)
+        # allowed tokens per canonical parser state, kept across generations
+        self.token_set_cache_size = token_set_cache_size
+        self._token_sets: OrderedDict[Hashable, list[int]] = OrderedDict()
+        self._token_set_bytes = 0
+        self._token_set_stats = CacheStats()
+        self._token_sets_lock = threading.Lock()
+        # Boolean masks per canonical state, size and device. They take a
+        # byte per token, so far fewer are kept than token sets.
+        self.mask_cache_size = mask_cache_size
+        self._masks: OrderedDict[Hashable, torch.Tensor] = OrderedDict()
+        self._mask_stats = CacheStats()
+        self._full_masks: dict[tuple[int, torch.device], torch.Tensor] = {}
+        # check the best scoring tokens before computing every valid token
+        self.lazy_top_k = lazy_top_k
+        self._lazy_top_k_stats = CacheStats()
+        # Valid tokens of several rows are computed on `executor` when
+        # given. Process pools have to come from `parallel.process_pool`.
+        self.executor = executor
+        self._thread_local = threading.local()
+        self._thread_memos: list[ParserMemo] = []
+        self._thread_memos_lock = threading.Lock()
+        # see `prefetch`
+        self._prefetch_executor: ThreadPoolExecutor | None = None
+        self._prefetched: tuple | None = None
+        self._prefetch_stats = PrefetchStats()
+        # Per-phase timings and counters of `__call__`, passed to `on_step`
+        # after every call and summed up in `step_metrics`. Without either
+        # the timers are never started.
+        self.profile = profile or on_step is not None
+        self.on_step = on_step
+        self._step_metrics = StepMetrics()
+        self._metrics: StepMetrics | None = None
+        self._metrics_lock = threading.Lock()
+        # per row parser state of the last batch we were called with
+        self._sequences: list[SequenceState] = []
+        self._previous_input_ids: torch.Tensor | None = None
+
+    def clear(self):
+        self._cancel_prefetch()
+        self.memo.clear()
+        with self._thread_memos_lock:
+            for memo in self._thread_memos:
+                memo.clear()
+        with self._token_sets_lock:
+            self._token_sets.clear()
+            self._token_set_bytes = 0
+            self._masks.clear()
+        self._sequences = []
+        self._previous_input_ids = None
+
+    def close(self):
+        # Stops the prefetch thread, if `prefetch` started one. A later
+        # `prefetch` starts a new one.
+        self._cancel_prefetch()
+        executor, self._prefetch_executor = self._prefetch_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def __enter__(self) -> "JsonSchemaLogitsProcessor":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        executor = getattr(self, "_prefetch_executor", None)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def token_set_stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._token_set_stats.hits,
+            misses=self._token_set_stats.misses,
+            evictions=self._token_set_stats.evictions,
+            entries=len(self._token_sets),
+            resident_bytes=self._token_set_bytes,
         )
-        self.decoded_token_tree = self._build_decoded_token_tree()
 
-    def _build_decoded_token_tree(self):
-        trie = Trie(self.eos_token_id)
-        for i, token in enumerate(self.decoded_tokens):
-            trie.insert(token, i)
-        return trie
+    def start_sequence(self, text: str = "") -> SequenceState:
+        # The state of one sequence, for callers that drive generation
+        # themselves instead of through `__call__`. States are immutable, so
+        # any number of sequences can share the processor.
+        return self._start_sequence(text)
+
+    def advance(self, sequence: SequenceState, token_ids: list[int]) -> SequenceState:
+        return self._advance_sequence(
+            sequence, "".join(self._decode_token(t) for t in token_ids)
+        )
+
+    def compute_mask(
+        self, sequence: SequenceState, size: int | None = None
+    ) -> torch.Tensor:
+        return self._compute_mask(sequence, size)
+
+    async def compute_mask_async(
+        self, sequence: SequenceState, size: int | None = None
+    ) -> torch.Tensor:
+        # Runs `compute_mask` on `executor` (the event loop's default one for
+        # process pools), so the event loop and the model's forward pass
+        # keep going meanwhile. A cancelled call stops the walk at its next
+        # character instead of finishing it in the background.
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        if isinstance(executor, ProcessPoolExecutor):
+            executor = None
+        cancelled = threading.Event()
+        try:
+            return await loop.run_in_executor(
+                executor, self._compute_mask, sequence, size, cancelled
+            )
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    def _compute_mask(
+        self,
+        sequence: SequenceState,
+        size: int | None = None,
+        cancelled: threading.Event | None = None,
+    ) -> torch.Tensor:
+        # A boolean mask over `size` token ids, the vocabulary by default.
+        # It is shared with every sequence in the same state, so it must not
+        # be changed in place.
+        return self._get_masks(
+            [sequence],
+            size or len(self.decoded_tokens),
+            torch.device("cpu"),
+            cancelled=cancelled,
+        )[0]
+
+    def _valid_or_end_tokens(self, valid_tokens: list[int]) -> list[int]:
+        # with nothing valid left the sequence can only end
+        if len(valid_tokens) > 0:
+            return valid_tokens
+        if self.padding_token_id is not None:
+            return [self.eos_token_id, self.padding_token_id]
+        return [self.eos_token_id]
+
+    def lazy_top_k_stats(self) -> CacheStats:
+        # hits are rows answered from the top-k tokens alone
+        return CacheStats(
+            hits=self._lazy_top_k_stats.hits, misses=self._lazy_top_k_stats.misses
+        )
+
+    def prefetch(self, input_ids: torch.LongTensor):
+        # Starts computing the valid tokens for `input_ids` on a background
+        # thread, so they are ready by the time `__call__` gets the logits
+        # for them. `MaskPrefetcher` calls this as soon as a token is picked.
+        self._cancel_prefetch()
+        sequences = self._advance_sequences(input_ids)
+        finished = self._finished_rows(input_ids)
+        rows = [i for i, is_finished in enumerate(finished) if not is_finished]
+        if self._prefetch_executor is None:
+            self._prefetch_executor = ThreadPoolExecutor(1)
+        cancelled = threading.Event()
+        # the walk counts into metrics of its own, added to the call that
+        # takes its result
+        metrics = StepMetrics() if self.profile else None
+        future = self._prefetch_executor.submit(
+            self._timed_valid_tokens, [sequences[i] for i in rows], cancelled, metrics
+        )
+        self._prefetched = (input_ids, rows, future, cancelled, metrics)
+
+    def prefetch_stats(self) -> PrefetchStats:
+        return replace(self._prefetch_stats)
+
+    def _timed_valid_tokens(
+        self,
+        sequences: list[SequenceState],
+        cancelled: threading.Event,
+        metrics: StepMetrics | None,
+    ) -> tuple[list[list[int]], float]:
+        start = time.perf_counter()
+        valid_tokens = self._get_valid_tokens(sequences, cancelled, metrics)
+        return valid_tokens, time.perf_counter() - start
+
+    def _cancel_prefetch(self):
+        if self._prefetched is not None:
+            self._prefetched[3].set()
+            self._prefetched = None
+
+    def _take_prefetched(
+        self, input_ids: torch.LongTensor, metrics: StepMetrics | None = None
+    ) -> dict[int, list[int]] | None:
+        # the valid tokens per row computed by `prefetch`, waiting for them
+        # if they aren't ready yet
+        if self._prefetched is None:
+            return None
+        prefetched_input_ids, rows, future, cancelled, walk_metrics = self._prefetched
+        self._prefetched = None
+        if not torch.equal(prefetched_input_ids, input_ids):
+            cancelled.set()
+            self._prefetch_stats.misses += 1
+            return None
+        ready = future.done()
+        start = time.perf_counter()
+        valid_tokens, compute_seconds = future.result()
+        wait_seconds = time.perf_counter() - start
+        self._prefetch_stats.hits += 1
+        self._prefetch_stats.ready += ready
+        self._prefetch_stats.compute_seconds += compute_seconds
+        self._prefetch_stats.wait_seconds += wait_seconds
+        if metrics is not None and walk_metrics is not None:
+            # the walk ran in the background, only the wait for it is timed
+            metrics.parser_calls += walk_metrics.parser_calls
+            metrics.trie_nodes_visited += walk_metrics.trie_nodes_visited
+        return dict(zip(rows, valid_tokens))
+
+    def _finished_rows(self, input_ids: torch.LongTensor) -> list[bool]:
+        last_token_ids = input_ids[:, -1]
+        finished = last_token_ids == self.eos_token_id
+        if self.padding_token_id is not None:
+            finished |= last_token_ids == self.padding_token_id
+        return finished.tolist()
+
+    def step_metrics(self) -> StepMetrics:
+        with self._metrics_lock:
+            return replace(self._step_metrics)
 
     def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor):
-        # Decode the text so far.
-        text_batch = self.tokenizer.batch_decode(input_ids, skip_special_tokens=True)
-        # Determine which tokens would be valid next.
-        return_tensor = torch.full_like(scores, -1e10, dtype=torch.float32)
-        for i, text in enumerate(text_batch):
+        if not self.profile:
+            return self._process(input_ids, scores)
+        metrics = StepMetrics(calls=1, rows=input_ids.shape[0])
+        token_sets, masks = replace(self._token_set_stats), replace(self._mask_stats)
+        self._metrics = metrics
+        try:
+            scores = self._process(input_ids, scores)
+        finally:
+            self._metrics = None
+        metrics.token_set_hits = self._token_set_stats.hits - token_sets.hits
+        metrics.token_set_misses = self._token_set_stats.misses - token_sets.misses
+        metrics.mask_hits = self._mask_stats.hits - masks.hits
+        metrics.mask_misses = self._mask_stats.misses - masks.misses
+        with self._metrics_lock:
+            self._step_metrics.add(metrics)
+        if self.on_step is not None:
+            self.on_step(metrics)
+        return scores
+
+    def _process(self, input_ids: torch.LongTensor, scores: torch.FloatTensor):
+        metrics = self._metrics
+        # wait for a prefetch first, it is still parsing in the background
+        with phase_timer(metrics, "trie_walk_seconds"):
+            prefetched = self._take_prefetched(input_ids, metrics)
+        sequences = self._advance_sequences(input_ids)
+        # Rows that already ended keep their scores untouched.
+        finished = self._finished_rows(input_ids)
+        # Determine which tokens would be valid next, for all rows at once.
+        # Rows the lazy top-k check answers get a mask of their own, the
+        # others share the mask cached for their state, and missing masks
+        # are computed together so they can be spread over `executor`.
+        size, device = scores.shape[-1], scores.device
+        row_masks: list[torch.Tensor | None] = [None] * len(sequences)
+        pending_rows = []
+        for i, is_finished in enumerate(finished):
+            if is_finished:
+                row_masks[i] = self._full_mask(size, device)
+                continue
             if (
-                self.padding_token_id is not None
-                and input_ids[i][-1] == self.padding_token_id
-            ) or (
-                self.eos_token_id is not None and input_ids[i][-1] == self.eos_token_id
+                prefetched is None
+                and self.lazy_top_k is not None
+                and self.automaton is None
             ):
-                return_tensor[i] = scores[i]
-                continue
-            valid_tokens = self._get_next_valid_tokens(text)
-            if self.verbose:
+                with phase_timer(metrics, "trie_walk_seconds"):
+                    top_k_tokens = self._valid_top_k_tokens(sequences[i], scores[i])
+                if top_k_tokens is not None:
+                    with phase_timer(metrics, "mask_seconds"):
+                        row_masks[i] = self._tokens_mask(top_k_tokens, size, device)
+            if row_masks[i] is None:
+                pending_rows.append(i)
+        pending_masks = self._get_masks(
+            [sequences[i] for i in pending_rows],
+            size,
+            device,
+            None if prefetched is None else [prefetched[i] for i in pending_rows],
+            metrics=metrics,
+        )
+        for i, mask in zip(pending_rows, pending_masks):
+            row_masks[i] = mask
+        if self.verbose:
+            for i, mask in enumerate(row_masks):
                 print(
-                    f"input_ids[{i}] = '{text}', valid_tokens = {len(valid_tokens)}, input_id length = {len(input_ids[i])}"
+                    f"input_ids[{i}] tail = '{sequences[i].tail}', valid_tokens = {int(mask.sum())}, input_id length = {len(input_ids[i])}"
                 )
-            if len(valid_tokens) == 0:
-                valid_tokens = [self.eos_token_id, self.padding_token_id]
-            invalid_tensor = torch.full_like(scores[i], -1e10, dtype=torch.float32)
-            # set the original scores for the valid tokens in the new tensor
-            invalid_tensor[valid_tokens] = scores[i][valid_tokens]
-            return_tensor[i] = invalid_tensor
-        return return_tensor
+        with phase_timer(metrics, "mask_seconds"):
+            allowed = torch.stack(row_masks)
+            # callers may hold on to `scores`, so the masked copy is returned
+            scores = scores.masked_fill(~allowed, -1e10)
+        if metrics is not None:
+            allowed_tokens = [
+                count
+                for count, is_finished in zip(allowed.sum(dim=1).tolist(), finished)
+                if not is_finished
+            ]
+            metrics.allowed_tokens = sum(allowed_tokens)
+            metrics.max_allowed_tokens = max(allowed_tokens, default=0)
+        return scores
 
-    def _get_next_valid_tokens(self, text: str) -> list[int]:
-        valid_tokens_ids = self.decoded_token_tree.find_valid_tokens(
-            text,
-            lambda prefix, next_token: parse_partial_json_value(
-                prefix, next_token, self.schema
-            ),
+    def mask_stats(self) -> CacheStats:
+        with self._token_sets_lock:
+            return CacheStats(
+                hits=self._mask_stats.hits,
+                misses=self._mask_stats.misses,
+                evictions=self._mask_stats.evictions,
+                entries=len(self._masks),
+                resident_bytes=sum(
+                    mask.numel() * mask.element_size() for mask in self._masks.values()
+                ),
+            )
+
+    def _get_masks(
+        self,
+        sequences: list[SequenceState],
+        size: int,
+        device: torch.device,
+        valid_tokens: list[list[int]] | None = None,
+        cancelled: threading.Event | None = None,
+        metrics: StepMetrics | None = None,
+    ) -> list[torch.Tensor]:
+        # Boolean masks over `size` token ids on `device`, cached per state
+        # like the token sets so a known state is masked without building
+        # any index tensors. `valid_tokens` are the rows' valid tokens, when
+        # they are known already.
+        keys = [(self._state_key(sequence), size, device) for sequence in sequences]
+        masks: list[torch.Tensor | None] = [None] * len(sequences)
+        with self._token_sets_lock:
+            for i, key in enumerate(keys):
+                mask = self._masks.get(key)
+                if mask is not None:
+                    self._mask_stats.hits += 1
+                    self._masks.move_to_end(key)
+                    masks[i] = mask
+        missing = [i for i, mask in enumerate(masks) if mask is None]
+        if valid_tokens is None:
+            missing_tokens = self._get_valid_tokens(
+                [sequences[i] for i in missing], cancelled, metrics
+            )
+        else:
+            missing_tokens = [valid_tokens[i] for i in missing]
+        for i, tokens in zip(missing, missing_tokens):
+            with phase_timer(metrics, "mask_seconds"):
+                mask = self._tokens_mask(
+                    self._valid_or_end_tokens(tokens), size, device
+                )
+            masks[i] = mask
+            with self._token_sets_lock:
+                self._mask_stats.misses += 1
+                self._masks[keys[i]] = mask
+                while len(self._masks) > self.mask_cache_size:
+                    self._masks.popitem(last=False)
+                    self._mask_stats.evictions += 1
+        return masks
+
+    def _state_key(self, sequence: SequenceState) -> Hashable:
+        if self.automaton is not None:
+            return sequence.automaton_state
+        return canonical_state_key(self.schema, sequence.parser_state)
+
+    def _tokens_mask(
+        self, token_ids: list[int], size: int, device: torch.device
+    ) -> torch.Tensor:
+        mask = torch.zeros(size, dtype=torch.bool, device=device)
+        mask[torch.tensor(token_ids, dtype=torch.long, device=device)] = True
+        return mask
+
+    def _full_mask(self, size: int, device: torch.device) -> torch.Tensor:
+        key = (size, device)
+        mask = self._full_masks.get(key)
+        if mask is None:
+            mask = torch.ones(size, dtype=torch.bool, device=device)
+            self._full_masks[key] = mask
+        return mask
+
+    def forced_tokens(
+        self, input_ids: torch.LongTensor, max_tokens: int | None = None
+    ) -> list[list[int]]:
+        # The tokens each row is forced to continue with, because the schema
+        # allows a single token, or only tokens that start with the same
+        # text. Those can be appended without asking the model, see
+        # `generation.generate_fast_forward`.
+        sequences = self._advance_sequences(input_ids)
+        last_token_ids = input_ids[:, -1].tolist()
+        forced = []
+        for sequence, last_token_id in zip(sequences, last_token_ids):
+            if last_token_id in (self.eos_token_id, self.padding_token_id):
+                forced.append([])
+                continue
+            forced.append(self._forced_sequence_tokens(sequence, max_tokens))
+        return forced
+
+    def _forced_sequence_tokens(
+        self, sequence: SequenceState, max_tokens: int | None
+    ) -> list[int]:
+        tokens: list[int] = []
+        while max_tokens is None or len(tokens) < max_tokens:
+            candidates = self._forced_candidates(sequence)
+            if max_tokens is not None:
+                candidates = candidates[: max_tokens - len(tokens)]
+            forced = 0
+            for token_id in candidates:
+                # the tokenizer may split the text in a way the schema
+                # doesn't allow, what comes after is left to the model
+                if token_id not in self._get_sequence_valid_tokens(sequence):
+                    break
+                tokens.append(token_id)
+                sequence = self._advance_sequence(
+                    sequence, self._decode_token(token_id)
+                )
+                forced += 1
+            if forced == 0:
+                break
+        return tokens
+
+    def _forced_candidates(self, sequence: SequenceState) -> list[int]:
+        # The text the schema forces next, split the way the tokenizer would
+        # write it, or else the only token the schema allows. Tokens that
+        # decode to nothing don't change the text and are never forced.
+        text = self._forced_text(sequence)
+        if text != "":
+            return self.tokenizer.encode(text, add_special_tokens=False)
+        valid_tokens = self._get_sequence_valid_tokens(sequence)
+        if (
+            len(valid_tokens) == 1
+            and valid_tokens[0] != self.eos_token_id
+            and self._decode_token(valid_tokens[0]) != ""
+        ):
+            return valid_tokens
+        return []
+
+    def _forced_text(self, sequence: SequenceState) -> str:
+        # the characters the parser accepts one at a time, up to the first
+        # point where it accepts several or the value could end
+        if self.automaton is None:
+            state = sequence.parser_state
+        elif sequence.automaton_state == DEAD_STATE:
+            return ""
+        else:
+            state = self.automaton.characters.parser_state(sequence.automaton_state)
+        chars = []
+        while state.valid and not (
+            state.complete and state.schema_id == SchemaId(0)
+        ):
+            next_characters = self.memo.next_characters(state)
+            if next_characters.others or len(next_characters.successors) != 1:
+                break
+            ((char, state),) = next_characters.successors.items()
+            chars.append(char)
+        return "".join(chars)
+
+    def _advance_sequences(self, input_ids: torch.LongTensor) -> list[SequenceState]:
+        # Each step normally appends one token to every row of the previous
+        # batch, so only that token has to be decoded and parsed. Several
+        # tokens are appended at once when forced tokens are skipped. Rows
+        # that can't be matched to a previous row (a new generation, or beams
+        # that were reordered onto an unknown history) are decoded from
+        # scratch.
+        previous_input_ids = self._previous_input_ids
+        previous_sequences = self._sequences
+        if previous_input_ids is not None and torch.equal(
+            previous_input_ids, input_ids
+        ):
+            return previous_sequences
+        if (
+            previous_input_ids is not None
+            and previous_input_ids.shape[1] >= input_ids.shape[1]
+        ):
+            # a new generation, nothing from the last one can be reused
+            self.memo.clear()
+            previous_input_ids = None
+        metrics = self._metrics
+        sequences = []
+        for i in range(input_ids.shape[0]):
+            previous = None
+            if previous_input_ids is not None:
+                previous = self._find_previous_sequence(
+                    input_ids[i, : previous_input_ids.shape[1]],
+                    i,
+                    previous_input_ids,
+                    previous_sequences,
+                )
+            with phase_timer(metrics, "decode_seconds"):
+                if previous is None:
+                    text = self.tokenizer.decode(input_ids[i], skip_special_tokens=True)
+                else:
+                    new_token_ids = input_ids[i, previous_input_ids.shape[1] :].tolist()
+                    text = "".join(self._decode_token(t) for t in new_token_ids)
+            with phase_timer(metrics, "parse_seconds"):
+                if previous is None:
+                    sequences.append(self._start_sequence(text))
+                else:
+                    sequences.append(self._advance_sequence(previous, text))
+        self._sequences = sequences
+        self._previous_input_ids = input_ids
+        return sequences
+
+    def _find_previous_sequence(
+        self,
+        history: torch.Tensor,
+        row: int,
+        previous_input_ids: torch.Tensor,
+        previous_sequences: list[SequenceState],
+    ) -> SequenceState | None:
+        if row < len(previous_sequences) and torch.equal(
+            history, previous_input_ids[row]
+        ):
+            return previous_sequences[row]
+        for j, previous_history in enumerate(previous_input_ids):
+            if torch.equal(history, previous_history):
+                return previous_sequences[j]
+        return None
+
+    def _decode_token(self, token_id: int) -> str:
+        if token_id < len(self.decoded_tokens):
+            return self.decoded_tokens[token_id]
+        return self.tokenizer.decode([token_id], skip_special_tokens=True)
+
+    def _start_sequence(self, text: str) -> SequenceState:
+        sequence = SequenceState(tail="", parser_state=initial_parser_state())
+        if self.automaton is not None:
+            sequence.automaton_state = self.automaton.characters.initial_state
+        return self._advance_sequence(sequence, text)
+
+    def _advance_sequence(self, sequence: SequenceState, text: str) -> SequenceState:
+        if self.automaton is not None:
+            assert sequence.automaton_state is not None
+            return SequenceState(
+                tail=sequence.tail,
+                parser_state=sequence.parser_state,
+                automaton_state=self.automaton.characters.run(
+                    text, sequence.automaton_state
+                ),
+            )
+        tail, parser_state = advance_partial_json_value(
+            sequence.tail, sequence.parser_state, text, self.schema, self.memo
         )
+        return SequenceState(tail=tail, parser_state=parser_state)
+
+    def _get_next_valid_tokens(self, text: str) -> list[int]:
+        return self._get_sequence_valid_tokens(self._start_sequence(text))
+
+    def _get_sequence_valid_tokens(self, sequence: SequenceState) -> list[int]:
+        return self._get_valid_tokens([sequence])[0]
+
+    def _get_valid_tokens(
+        self,
+        sequences: list[SequenceState],
+        cancelled: threading.Event | None = None,
+        metrics: StepMetrics | None = None,
+    ) -> list[list[int]]:
+        if self.automaton is not None:
+            # the automaton is a table lookup once the text has been run
+            # through the character-level states
+            return [
+                self.automaton.valid_tokens(sequence.automaton_state)
+                for sequence in sequences
+            ]
+        # Parser states that only differ in offsets or accumulated string
+        # values allow the same tokens, so the trie is walked once per
+        # canonical state.
+        keys = [
+            canonical_state_key(self.schema, sequence.parser_state)
+            for sequence in sequences
+        ]
+        valid_tokens: list[list[int] | None] = [None] * len(sequences)
+        missing: dict[Hashable, SequenceState] = {}
+        with self._token_sets_lock:
+            for i, (key, sequence) in enumerate(zip(keys, sequences)):
+                cached = self._token_sets.get(key)
+                if cached is not None:
+                    self._token_set_stats.hits += 1
+                    self._token_sets.move_to_end(key)
+                    valid_tokens[i] = cached
+                elif key in missing:
+                    self._token_set_stats.hits += 1
+                else:
+                    self._token_set_stats.misses += 1
+                    missing[key] = sequence
+        with phase_timer(metrics, "trie_walk_seconds"):
+            if cancelled is None:
+                found_tokens = self._find_all_valid_tokens(
+                    list(missing.values()), metrics
+                )
+            else:
+                found_tokens = [
+                    self._find_valid_tokens(sequence, True, cancelled, metrics)
+                    for sequence in missing.values()
+                ]
+        found = dict(zip(missing, found_tokens))
+        with self._token_sets_lock:
+            for key, valid_tokens_ids in found.items():
+                self._token_sets[key] = valid_tokens_ids
+                self._token_set_bytes += sys.getsizeof(valid_tokens_ids)
+            while len(self._token_sets) > self.token_set_cache_size:
+                _, evicted = self._token_sets.popitem(last=False)
+                self._token_set_bytes -= sys.getsizeof(evicted)
+                self._token_set_stats.evictions += 1
+        return [
+            found[key] if tokens is None else tokens
+            for key, tokens in zip(keys, valid_tokens)
+        ]
+
+    def _find_all_valid_tokens(
+        self, sequences: list[SequenceState], metrics: StepMetrics | None = None
+    ) -> list[list[int]]:
+        # Rows are handed to the executor in order and collected in order,
+        # and each walk only depends on its own state, so the result doesn't
+        # depend on how the work was spread.
+        if self.executor is None or len(sequences) < 2:
+            return [
+                self._find_valid_tokens(sequence, metrics=metrics)
+                for sequence in sequences
+            ]
+        if isinstance(self.executor, ProcessPoolExecutor):
+            futures = [
+                self.executor.submit(
+                    worker_valid_tokens, id(self), sequence.tail, sequence.parser_state
+                )
+                for sequence in sequences
+            ]
+        else:
+            futures = [
+                self.executor.submit(
+                    self._find_valid_tokens, sequence, True, None, metrics
+                )
+                for sequence in sequences
+            ]
+        return [future.result() for future in futures]
+
+    def _find_valid_tokens(
+        self,
+        sequence: SequenceState,
+        in_thread: bool = False,
+        cancelled: threading.Event | None = None,
+        metrics: StepMetrics | None = None,
+    ) -> list[int]:
+        # threads each parse with their own memo, it isn't thread safe
+        memo = self._thread_memo() if in_thread else self.memo
+
+        def step(state, next_token):
+            return self._step(state, next_token, memo)
+
+        def cancellable_step(state, next_token):
+            if cancelled.is_set():
+                raise CancelledError()
+            return self._step(state, next_token, memo)
+
+        def characters(state, children):
+            return self._characters(state, children, memo)
+
+        if cancelled is not None:
+            step = cancellable_step
+
+        if metrics is not None:
+            # parser calls and the nodes they let the walk into
+            counts = [0, 0]
+            uncounted_step, uncounted_characters = step, characters
+
+            def step(state, next_token):
+                out = uncounted_step(state, next_token)
+                counts[0] += 1
+                counts[1] += out[0] is not None
+                return out
+
+            def characters(state, children):
+                out = uncounted_characters(state, children)
+                if out is None:
+                    return None
+                stepped, others = out
+                counts[0] += len(stepped) + 1
+                return _CountedSteps(stepped, counts), others
+
+        if self._in_string_body(sequence.parser_state):
+            plain_token_ids, special = self.vocabulary.string_body_tokens()
+            valid_tokens_ids, _ = special.find_valid_token_states(
+                sequence.parser_state, step, characters
+            )
+            valid_tokens_ids = plain_token_ids + valid_tokens_ids
+        else:
+            valid_tokens_ids, _ = self.decoded_token_tree.find_valid_token_states(
+                sequence.parser_state, step, characters
+            )
+        if metrics is not None:
+            with self._metrics_lock:
+                metrics.parser_calls += counts[0]
+                metrics.trie_nodes_visited += counts[1]
         return valid_tokens_ids
+
+    def _thread_memo(self) -> ParserMemo:
+        memo = getattr(self._thread_local, "memo", None)
+        if memo is None:
+            memo = ParserMemo(self.schema, max_entries=self.memo.max_entries)
+            self._thread_local.memo = memo
+            with self._thread_memos_lock:
+                self._thread_memos.append(memo)
+        return memo
+
+    def _valid_top_k_tokens(
+        self, sequence: SequenceState, row_scores: torch.Tensor
+    ) -> list[int] | None:
+        # The valid tokens among the `lazy_top_k` best scoring ones, or None
+        # when there are none and every valid token is needed. The best
+        # valid token overall is among them, so greedy decoding picks the
+        # same token, and sampling is limited to them like top-k sampling.
+        # Whether EOS is valid is only known after walking every token, so
+        # the check stops there.
+        k = min(self.lazy_top_k, row_scores.shape[-1])
+        valid_tokens = []
+        for token_id in torch.topk(row_scores, k).indices.tolist():
+            if token_id == self.eos_token_id:
+                break
+            if self._is_valid_token(sequence, token_id):
+                valid_tokens.append(token_id)
+        if len(valid_tokens) == 0:
+            self._lazy_top_k_stats.misses += 1
+            return None
+        self._lazy_top_k_stats.hits += 1
+        return valid_tokens
+
+    def _is_valid_token(self, sequence: SequenceState, token_id: int) -> bool:
+        # the same check as the trie walk, for a single token
+        if token_id >= len(self.decoded_tokens):
+            return False
+        token = self.decoded_tokens[token_id]
+        if self.vocabulary.token_ids().get(token) != token_id:
+            return False
+        state = sequence.parser_state
+        if not state.valid:
+            return token == ""
+        for char in token:
+            state, _ = self._step(state, char)
+            if state is None:
+                return False
+        return True
+
+    def _in_string_body(self, parser_state: IterativeParserResult) -> bool:
+        # free-form strings accept anything but a closing quote or an escape
+        return (
+            parser_state.valid
+            and parser_state.next_state == StringState.STRING
+            and isinstance(self.schema[parser_state.schema_id], StringJsonSchema)
+        )
+
+    def _step(
+        self,
+        parser_state: IterativeParserResult,
+        next_token: str,
+        memo: ParserMemo | None = None,
+    ) -> tuple[IterativeParserResult | None, bool]:
+        if not parser_state.valid:
+            return None, False
+        out = (memo or self.memo).step(parser_state, next_token)
+        if not out.valid:
+            return None, False
+        return out, out.complete and out.schema_id == SchemaId(0)
+
+    def _characters(
+        self, parser_state: IterativeParserResult, children: int, memo: ParserMemo
+    ) -> CharacterClass[IterativeParserResult] | None:
+        # Matching a node's children against everything the state accepts
+        # pays off when there are more of them than letters in the schema's
+        # alphabet, like at the root of the trie.
+        if not parser_state.valid or children <= len(memo.alphabet):
+            return None
+        next_characters = memo.next_characters(parser_state)
+        stepped = dict.fromkeys(next_characters.alphabet, (None, False))
+        for char, out in next_characters.successors.items():
+            stepped[char] = (out, out.complete and out.schema_id == SchemaId(0))
+        return stepped, next_characters.others
@@ -0,0 +1,65 @@
+import time
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, fields
+
+
+@dataclass
+class StepMetrics:
+    # Where the time of `__call__` goes, and how much work it did. Phases:
+    # decoding the new tokens, parsing them, finding the allowed tokens
+    # (walking the trie, or waiting for a prefetch) and building and
+    # applying the masks. Walks on a process pool aren't counted. A
+    # prefetched walk counts towards the call that takes its result, with
+    # only the wait for it timed.
+    calls: int = 0
+    rows: int = 0
+    decode_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    trie_walk_seconds: float = 0.0
+    mask_seconds: float = 0.0
+    # parser calls made by the trie walk, including the ones for character
+    # classes, and the nodes it went into
+    parser_calls: int = 0
+    trie_nodes_visited: int = 0
+    token_set_hits: int = 0
+    token_set_misses: int = 0
+    mask_hits: int = 0
+    mask_misses: int = 0
+    # over the rows that haven't ended
+    allowed_tokens: int = 0
+    max_allowed_tokens: int = 0
+
+    def add(self, other: "StepMetrics"):
+        for field in fields(self):
+            value = getattr(other, field.name)
+            if field.name == "max_allowed_tokens":
+                value = max(value, self.max_allowed_tokens)
+            else:
+                value += getattr(self, field.name)
+            setattr(self, field.name, value)
+
+    def as_dict(self) -> dict[str, int | float]:
+        return asdict(self)
+
+
+class PhaseTimer:
+    __slots__ = ("metrics", "phase", "start")
+
+    def __init__(self, metrics: StepMetrics, phase: str):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        setattr(self.metrics, self.phase, getattr(self.metrics, self.phase) + seconds)
+
+
+_no_timer = nullcontext()
+
+
+def phase_timer(metrics: StepMetrics | None, phase: str) -> PhaseTimer | nullcontext:
+    # adds the time spent in a `with` block to `phase`, when profiling
+    return _no_timer if metrics is None else PhaseTimer(metrics, phase)
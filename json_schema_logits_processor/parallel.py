@@ -0,0 +1,47 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+from json_schema_logits_processor.iterative_parser.types import \
+    IterativeParserResult
+
+if TYPE_CHECKING:
+    from json_schema_logits_processor.json_schema_logits_processor import \
+        JsonSchemaLogitsProcessor
+
+# the processors a worker process was forked with, by their id in the parent
+_processors: dict[int, "JsonSchemaLogitsProcessor"] = {}
+
+
+def process_pool(
+    processor: "JsonSchemaLogitsProcessor", max_workers: int | None = None
+) -> ProcessPoolExecutor:
+    # Workers are forked, so they start with the processor, its vocabulary
+    # and its caches without pickling them, and a vocabulary loaded from
+    # `cache_dir` stays a shared memory mapping. Only parser states and the
+    # resulting token ids go through pipes.
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_register,
+        initargs=(processor,),
+    )
+
+
+def _register(processor: "JsonSchemaLogitsProcessor"):
+    _processors[id(processor)] = processor
+
+
+def worker_valid_tokens(
+    processor_id: int, tail: str, parser_state: IterativeParserResult
+) -> list[int]:
+    from json_schema_logits_processor.json_schema_logits_processor import \
+        SequenceState
+
+    processor = _processors.get(processor_id)
+    if processor is None:
+        raise RuntimeError(
+            "the process pool wasn't created for this processor, "
+            "use parallel.process_pool"
+        )
+    return processor._find_valid_tokens(SequenceState(tail, parser_state))
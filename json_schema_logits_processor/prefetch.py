@@ -0,0 +1,28 @@
+import torch
+import transformers
+from transformers import StoppingCriteria
+
+from json_schema_logits_processor.json_schema_logits_processor import \
+    JsonSchemaLogitsProcessor
+
+# Before 4.39 `StoppingCriteriaList` takes `any` of what each criterion
+# returns, which can't be a tensor with more than one row.
+_PER_ROW_STOPPING = tuple(map(int, transformers.__version__.split(".")[:2])) >= (4, 39)
+
+
+class MaskPrefetcher(StoppingCriteria):
+    # `generate` checks its stopping criteria right after picking the next
+    # tokens and before the next forward pass, so this is where the masks
+    # for the next step can start. It never stops generation itself.
+    def __init__(self, processor: JsonSchemaLogitsProcessor):
+        self.processor = processor
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor | bool:
+        self.processor.prefetch(input_ids)
+        if not _PER_ROW_STOPPING:
+            return False
+        return torch.zeros(
+            input_ids.shape[0], dtype=torch.bool, device=input_ids.device
+        )
@@ -1,3 +1,5 @@
+import dataclasses
+import hashlib
 import json
 from dataclasses import dataclass
 from typing import NewType, Optional
@@ -22,6 +24,9 @@ class NumberJsonSchema:
     type = SchemaType.NUMBER
     id: SchemaId
     parent_id: SchemaId | None
+    minimum: float | None = None
+    maximum: float | None = None
+    integer: bool = False
 
     def __hash__(self):
         return self.id
@@ -34,6 +39,10 @@ class EnumJsonSchema:
     id: SchemaId
     parent_id: SchemaId | None
 
+    def __post_init__(self):
+        # sorted once so prefix lookups can bisect instead of scanning
+        self.sorted_values = tuple(sorted(self.values))
+
     def __hash__(self):
         return self.id
 
@@ -46,25 +55,130 @@ class ObjectJsonSchema:
     properties: dict[str, SchemaId]
     aditional_properties = False
     keys_schema: EnumJsonSchema
+    required: tuple[str, ...] = ()
+
+    def __hash__(self):
+        return self.id
+
+
+@dataclass
+class ArrayJsonSchema:
+    type = SchemaType.ARRAY
+    id: SchemaId
+    parent_id: SchemaId | None
+    items: SchemaId
+    min_items: int = 0
+    max_items: int | None = None
+
+    def __hash__(self):
+        return self.id
+
+
+@dataclass
+class BooleanJsonSchema:
+    type = SchemaType.BOOLEAN
+    id: SchemaId
+    parent_id: SchemaId | None
+
+    def __hash__(self):
+        return self.id
+
+
+@dataclass
+class NullJsonSchema:
+    type = SchemaType.NULL
+    id: SchemaId
+    parent_id: SchemaId | None
+
+    def __hash__(self):
+        return self.id
+
+
+@dataclass
+class UnionJsonSchema:
+    # anyOf and oneOf, a value matching any of the alternatives is accepted
+    type = SchemaType.UNION
+    id: SchemaId
+    parent_id: SchemaId | None
+    alternatives: tuple[SchemaId, ...]
+
+    def __post_init__(self):
+        # the alternatives a value can start with each character, filled in
+        # by `JsonSchema` once every alternative has been parsed
+        self.alternatives_by_first_char: dict[str, tuple[SchemaId, ...]] = {}
 
     def __hash__(self):
         return self.id
 
 
 JsonSchemaUnion = (
-    ObjectJsonSchema | StringJsonSchema | NumberJsonSchema | EnumJsonSchema
+    ObjectJsonSchema
+    | StringJsonSchema
+    | NumberJsonSchema
+    | EnumJsonSchema
+    | ArrayJsonSchema
+    | BooleanJsonSchema
+    | NullJsonSchema
+    | UnionJsonSchema
 )
 
 
+def first_characters(
+    schemas: dict[SchemaId, JsonSchemaUnion], schema: JsonSchemaUnion
+) -> frozenset[str]:
+    # The characters a value of `schema` can start with, after any
+    # whitespace.
+    match schema:
+        case StringJsonSchema() | EnumJsonSchema():
+            return frozenset('"')
+        case NumberJsonSchema():
+            return frozenset("-0123456789")
+        case ObjectJsonSchema():
+            return frozenset("{")
+        case ArrayJsonSchema():
+            return frozenset("[")
+        case BooleanJsonSchema():
+            return frozenset("tf")
+        case NullJsonSchema():
+            return frozenset("n")
+        case UnionJsonSchema():
+            return frozenset().union(
+                *(
+                    first_characters(schemas, schemas[alternative])
+                    for alternative in schema.alternatives
+                )
+            )
+    raise NotImplementedError(f"schema type {schema} not implemented")
+
+
+def canonical_schema_hash(schemas: dict[SchemaId, JsonSchemaUnion]) -> str:
+    # Stable across processes, unlike `hash`, so it can key caches of
+    # compiled schemas.
+    canonical = [
+        (type(schemas[schema_id]).__name__, dataclasses.asdict(schemas[schema_id]))
+        for schema_id in sorted(schemas)
+    ]
+    return hashlib.sha256(
+        json.dumps(canonical, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
 class JsonSchema:
     schemas: dict[SchemaId, JsonSchemaUnion] = {}
     hash: int
+    fingerprint: str
 
     def __init__(self, schemas: dict[SchemaId, JsonSchemaUnion]):
         self.schemas = schemas
         # a sanity check here to ensure the schema_ids are contiguous
         assert len(self.schemas) == max(self.schemas.keys()) + 1
         self.hash = hash(frozenset(self.schemas.items()))
+        self.fingerprint = canonical_schema_hash(self.schemas)
+        for curr_schema in self.schemas.values():
+            if isinstance(curr_schema, UnionJsonSchema):
+                curr_schema.alternatives_by_first_char = _alternatives_by_first_char(
+                    self.schemas, curr_schema
+                )
 
     def __getitem__(self, item: SchemaId) -> JsonSchemaUnion:
         return self.schemas[item]
@@ -73,13 +187,32 @@ class JsonSchema:
         return self.hash
 
 
+def _alternatives_by_first_char(
+    schemas: dict[SchemaId, JsonSchemaUnion], union_schema: UnionJsonSchema
+) -> dict[str, tuple[SchemaId, ...]]:
+    table: dict[str, list[SchemaId]] = {}
+    for alternative in union_schema.alternatives:
+        for char in first_characters(schemas, schemas[alternative]):
+            table.setdefault(char, []).append(alternative)
+    return {char: tuple(alternatives) for char, alternatives in table.items()}
+
+
 class JsonSchemaParser:
-    counter: SchemaId = SchemaId(-1)
-    schemas: dict[SchemaId, JsonSchemaUnion] = {}
+    counter: SchemaId
+    schemas: dict[SchemaId, JsonSchemaUnion]
+
+    def __init__(self, root: dict | None = None):
+        # every parse gets its own table, otherwise all parsed schemas would
+        # share and overwrite each other's entries
+        self.counter = SchemaId(-1)
+        self.schemas = {}
+        # the document `$ref`s point into, and the ones being expanded
+        self.root = root if root is not None else {}
+        self.resolving: list[str] = []
 
     @staticmethod
     def parse_schema_from_dict(schema_dict: dict):
-        schema, _ = JsonSchemaParser()._parse_schema_from_dict(
+        schema, _ = JsonSchemaParser(schema_dict)._parse_schema_from_dict(
             schema_dict, None
         )
         return JsonSchema(schema)
@@ -95,6 +228,23 @@ class JsonSchemaParser:
         self, schema_dict: dict, schema_id: SchemaId, parent_id: Optional[SchemaId]
     ) -> JsonSchemaUnion:
         match schema_dict:
+            case {"$ref": ref}:
+                # references are expanded in place, every use gets its own
+                # copy since schemas only have one parent
+                if ref in self.resolving:
+                    raise NotImplementedError(f"recursive $ref {ref} not implemented")
+                self.resolving.append(ref)
+                schema = self._parse_schema(self._resolve(ref), schema_id, parent_id)
+                self.resolving.pop()
+                return schema
+            case {"anyOf": alternatives} | {"oneOf": alternatives}:
+                return self._parse_union(alternatives, schema_id, parent_id)
+            case {"type": list() as types}:
+                return self._parse_union(
+                    [{**schema_dict, "type": type_name} for type_name in types],
+                    schema_id,
+                    parent_id,
+                )
             case {"type": "object", "properties": properties}:
                 schema_properties = self._parse_properties(properties, schema_id)
                 self.counter = SchemaId(self.counter + 1)
@@ -110,16 +260,59 @@ class JsonSchemaParser:
                     parent_id=parent_id,
                     properties=schema_properties,
                     keys_schema=keys_schema,
+                    required=tuple(schema_dict.get("required", ())),
                 )
             case {"type": "string"}:
                 return StringJsonSchema(id=schema_id, parent_id=parent_id)
-            case {"type": "number"}:
-                return NumberJsonSchema(id=schema_id, parent_id=parent_id)
+            case {"type": "number" | "integer" as number_type}:
+                return NumberJsonSchema(
+                    id=schema_id,
+                    parent_id=parent_id,
+                    minimum=schema_dict.get("minimum"),
+                    maximum=schema_dict.get("maximum"),
+                    integer=number_type == "integer",
+                )
+            case {"type": "array", "items": items}:
+                _, items_id = self._parse_schema_from_dict(items, schema_id)
+                return ArrayJsonSchema(
+                    id=schema_id,
+                    parent_id=parent_id,
+                    items=items_id,
+                    min_items=schema_dict.get("minItems", 0),
+                    max_items=schema_dict.get("maxItems"),
+                )
             case {"type": "enum", "values": values}:
                 return EnumJsonSchema(values=values, id=schema_id, parent_id=parent_id)
+            case {"type": "boolean"}:
+                return BooleanJsonSchema(id=schema_id, parent_id=parent_id)
+            case {"type": "null"}:
+                return NullJsonSchema(id=schema_id, parent_id=parent_id)
             case other:
                 raise NotImplementedError(f"schema type {other} not implemented")
 
+    def _parse_union(
+        self,
+        alternatives: list[dict],
+        schema_id: SchemaId,
+        parent_id: Optional[SchemaId],
+    ) -> UnionJsonSchema:
+        alternative_ids = []
+        for alternative in alternatives:
+            _, alternative_id = self._parse_schema_from_dict(alternative, schema_id)
+            alternative_ids.append(alternative_id)
+        return UnionJsonSchema(
+            id=schema_id, parent_id=parent_id, alternatives=tuple(alternative_ids)
+        )
+
+    def _resolve(self, ref: str) -> dict:
+        # only references within the document, like "#/$defs/address"
+        if not ref.startswith("#"):
+            raise NotImplementedError(f"$ref {ref} not implemented")
+        target = self.root
+        for part in ref[1:].split("/")[1:]:
+            target = target[part.replace("~1", "/").replace("~0", "~")]
+        return target
+
     def _parse_properties(
         self, properties: dict, parent_id: SchemaId
     ) -> dict[str, SchemaId]:
@@ -6,6 +6,7 @@ class SchemaType(Enum):
     NUMBER = 1
     OBJECT = 2
     ENUM = 3
-    # BOOLEAN = "boolean"
-    # ARRAY = "array"
-    # NULL = "null"
+    ARRAY = 4
+    BOOLEAN = 5
+    NULL = 6
+    UNION = 7
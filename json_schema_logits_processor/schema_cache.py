@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from json_schema_logits_processor.automaton import (CharacterAutomaton,
+                                                    TokenAutomaton)
+from json_schema_logits_processor.schema.interative_schema import JsonSchema
+from json_schema_logits_processor.vocabulary import VocabularyIndex
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    resident_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class CompiledSchemaCache:
+    # Compiled token automata keyed by the canonical schema hash and the
+    # vocabulary fingerprint, evicted least recently used first once their
+    # combined size goes over `max_bytes`. Automata fill in lazily, so sizes
+    # are re-measured on every lookup.
+    def __init__(self, max_bytes: int = 256 << 20):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, str], TokenAutomaton] = OrderedDict()
+        self._sizes: dict[tuple[str, str], int] = {}
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: tuple[JsonSchema, VocabularyIndex]):
+        return self._key(*key) in self._entries
+
+    @staticmethod
+    def _key(schema: JsonSchema, vocabulary: VocabularyIndex) -> tuple[str, str]:
+        fingerprint = vocabulary.fingerprint
+        if fingerprint is None:
+            fingerprint = f"id:{id(vocabulary)}"
+        return schema.fingerprint, fingerprint
+
+    def get(
+        self,
+        schema: JsonSchema,
+        vocabulary: VocabularyIndex,
+        compile: bool = False,
+    ) -> TokenAutomaton:
+        key = self._key(schema, vocabulary)
+        with self._lock:
+            automaton = self._entries.get(key)
+            if automaton is not None:
+                self._stats.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self._stats.misses += 1
+        if automaton is None:
+            # compile outside the lock, a concurrent miss on the same schema
+            # just compiles it twice
+            automaton = TokenAutomaton(CharacterAutomaton(schema), vocabulary.trie)
+            if compile:
+                automaton.compile()
+            with self._lock:
+                automaton = self._entries.setdefault(key, automaton)
+                self._entries.move_to_end(key)
+        elif compile:
+            automaton.compile()
+        with self._lock:
+            self._resize()
+        return automaton
+
+    def _resize(self):
+        for key, automaton in self._entries.items():
+            self._sizes[key] = automaton.nbytes
+        resident_bytes = sum(self._sizes.values())
+        # the most recently used entry is kept even if it alone is too big
+        while resident_bytes > self.max_bytes and len(self._entries) > 1:
+            key, _ = self._entries.popitem(last=False)
+            resident_bytes -= self._sizes.pop(key)
+            self._stats.evictions += 1
+        self._stats.resident_bytes = resident_bytes
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            self._resize()
+            return CacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+                entries=len(self._entries),
+                resident_bytes=self._stats.resident_bytes,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._stats.resident_bytes = 0
+
+
+default_compiled_schema_cache = CompiledSchemaCache()
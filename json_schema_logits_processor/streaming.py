@@ -0,0 +1,278 @@
+import json
+import re
+from dataclasses import dataclass
+from queue import Queue
+from typing import Any, Iterator
+
+from transformers.generation.streamers import BaseStreamer
+
+from json_schema_logits_processor.iterative_parser import (
+    ParserMemo, advance_partial_json_value, initial_parser_state)
+from json_schema_logits_processor.iterative_parser.string_parser import \
+    StringState
+from json_schema_logits_processor.iterative_parser.types import (
+    IncrementalArrayValue, IncrementalLiteralValue, IncrementalNumberValue,
+    IncrementalObjectValue, IncrementalStringValue, IncrementalUnionValue,
+    IterativeParserResult)
+from json_schema_logits_processor.json_schema_logits_processor import \
+    JsonSchemaLogitsProcessor
+from json_schema_logits_processor.schema.interative_schema import (
+    JsonSchema, ObjectJsonSchema, SchemaId, StringJsonSchema)
+
+JsonPath = tuple[str | int, ...]
+
+
+@dataclass
+class ValueEvent:
+    path: JsonPath
+    value: Any
+    # partial events carry the text added to a string that is still being
+    # written since its last event, starting with "" when it opens
+    complete: bool = True
+
+
+class JsonValueStream:
+    # Turns generated text into an event for every value as soon as it is
+    # complete, from the parser states instead of parsing the output again.
+    # Objects and arrays are assembled from the events of their values. A
+    # number is only known to be complete once the character after it
+    # arrives, or at `finish`. Inside a union the first alternative that
+    # still matches is followed.
+    def __init__(
+        self,
+        schema: JsonSchema,
+        memo: ParserMemo | None = None,
+        partial: bool = False,
+    ):
+        self.schema = schema
+        self.memo = memo
+        self.partial = partial
+        self.document: Any = None
+        self._tail = ""
+        self._state = initial_parser_state()
+        self._keys_schema_ids = {
+            s.keys_schema.id
+            for s in schema.schemas.values()
+            if isinstance(s, ObjectJsonSchema)
+        }
+        # the number that completes the value if nothing else follows
+        self._pending_number: tuple[SchemaId, JsonPath, str] | None = None
+        # the string being reported: its path, how much of its raw text was
+        # read and the escape at the end of it that isn't complete yet
+        self._partial_string: tuple[JsonPath, int, str] | None = None
+
+    def feed(self, text: str) -> list[ValueEvent]:
+        events: list[ValueEvent] = []
+        for char in text:
+            if not self._state.valid:
+                break
+            self._tail, self._state = advance_partial_json_value(
+                self._tail, self._state, char, self.schema, self.memo
+            )
+            if self._state.valid:
+                self._collect_events(events)
+        return events
+
+    def finish(self) -> list[ValueEvent]:
+        events: list[ValueEvent] = []
+        if self._pending_number is not None:
+            _, path, value = self._pending_number
+            self._pending_number = None
+            events.append(self._complete(path, json.loads(value)))
+        return events
+
+    def _collect_events(self, events: list[ValueEvent]):
+        frames, innermost = _frames(self._state)
+        schema_id = innermost.schema_id
+        top_id, top_value = frames[-1] if len(frames) > 0 else (None, None)
+        if self._pending_number is not None:
+            number_id, path, value = self._pending_number
+            if schema_id != number_id or top_id != number_id:
+                # something else is being parsed, so the number ended
+                self._pending_number = None
+                events.append(self._complete(path, json.loads(value)))
+        if top_id != schema_id or schema_id in self._keys_schema_ids:
+            return
+        path = _path(frames[:-1])
+        curr_schema = self.schema[schema_id]
+        if isinstance(top_value, IncrementalNumberValue):
+            if innermost.complete:
+                self._pending_number = (schema_id, path, top_value.value)
+        elif innermost.complete:
+            self._partial_string = None
+            value = self._value(curr_schema, top_value, path)
+            events.append(self._complete(path, value))
+        elif (
+            self.partial
+            and isinstance(curr_schema, StringJsonSchema)
+            and isinstance(top_value, IncrementalStringValue)
+            and innermost.next_state == StringState.STRING
+        ):
+            self._collect_partial_string(events, path, top_value)
+
+    def _collect_partial_string(
+        self, events: list[ValueEvent], path: JsonPath, value: IncrementalStringValue
+    ):
+        # Only the raw text added since the last event is decoded, so a long
+        # string costs the same per character as a short one.
+        if self._partial_string is None or self._partial_string[0] != path:
+            self._partial_string = (path, 0, "")
+            events.append(ValueEvent(path, "", False))
+        _, read, pending = self._partial_string
+        added = value.text_from(read)
+        if added == "":
+            return
+        raw, pending = _split_escape(pending + added)
+        self._partial_string = (path, read + len(added), pending)
+        if raw != "":
+            events.append(ValueEvent(path, _decode_string(raw), False))
+
+    def _value(self, curr_schema: JsonSchema, value: Any, path: JsonPath) -> Any:
+        if isinstance(value, IncrementalStringValue):
+            return _decode_string(value.value)
+        if isinstance(value, IncrementalLiteralValue):
+            return json.loads(value.value)
+        # containers are built up by the events of their values
+        container = self._get(path)
+        if container is None:
+            container = {} if isinstance(curr_schema, ObjectJsonSchema) else []
+        return container
+
+    def _complete(self, path: JsonPath, value: Any) -> ValueEvent:
+        self._set(path, value)
+        return ValueEvent(path, value)
+
+    def _get(self, path: JsonPath) -> Any:
+        node = self.document
+        for key in path:
+            if isinstance(node, dict) and key in node:
+                node = node[key]
+            elif isinstance(node, list) and isinstance(key, int) and key < len(node):
+                node = node[key]
+            else:
+                return None
+        return node
+
+    def _set(self, path: JsonPath, value: Any):
+        if len(path) == 0:
+            self.document = value
+            return
+        if self.document is None:
+            self.document = {} if isinstance(path[0], str) else []
+        node = self.document
+        for key, next_key in zip(path, path[1:]):
+            node = _child(node, key, lambda: {} if isinstance(next_key, str) else [])
+        _child(node, path[-1], lambda: value, replace=True)
+
+
+class JsonValueStreamer(BaseStreamer):
+    # A `generate` streamer that puts the value events of the generated
+    # text in a queue, to be iterated over from another thread while
+    # generation runs. Only supports a batch size of 1, like `generate`'s
+    # own streamers.
+    def __init__(
+        self,
+        processor: JsonSchemaLogitsProcessor,
+        skip_prompt: bool = True,
+        partial: bool = False,
+        timeout: float | None = None,
+    ):
+        self.processor = processor
+        self.stream = JsonValueStream(processor.schema, processor.memo, partial)
+        self.skip_prompt = skip_prompt
+        self.timeout = timeout
+        self._next_tokens_are_prompt = True
+        self._queue: Queue[ValueEvent | None] = Queue()
+
+    def put(self, value):
+        if self.skip_prompt and self._next_tokens_are_prompt:
+            self._next_tokens_are_prompt = False
+            return
+        text = "".join(
+            self.processor._decode_token(int(token_id))
+            for token_id in value.reshape(-1).tolist()
+        )
+        for event in self.stream.feed(text):
+            self._queue.put(event)
+
+    def end(self):
+        for event in self.stream.finish():
+            self._queue.put(event)
+        self._queue.put(None)
+
+    def __iter__(self) -> Iterator[ValueEvent]:
+        while True:
+            event = self._queue.get(timeout=self.timeout)
+            if event is None:
+                return
+            yield event
+
+
+def _frames(
+    state: IterativeParserResult,
+) -> tuple[list[tuple[SchemaId, Any]], IterativeParserResult]:
+    # The value stack, with the stack of the followed union alternative in
+    # place of the union, and the state of the innermost value.
+    frames = []
+    while True:
+        frames.extend(state.value_stack)
+        if len(frames) == 0 or not isinstance(frames[-1][1], IncrementalUnionValue):
+            return frames, state
+        _, union_value = frames.pop()
+        state = union_value.states[0]
+
+
+def _path(frames: list[tuple[SchemaId, Any]]) -> JsonPath:
+    path: list[str | int] = []
+    for _, value in frames:
+        if isinstance(value, IncrementalObjectValue):
+            if value.latest_added_key is not None:
+                path.append(value.latest_added_key)
+        elif isinstance(value, IncrementalArrayValue):
+            path.append(value.count)
+    return tuple(path)
+
+
+# raw string text up to an escape that isn't complete yet
+_COMPLETE_ESCAPES = re.compile(r"(?:[^\\]|\\u[0-9a-fA-F]{4}|\\[^u])*")
+# the first half of a surrogate pair, decoded together with the second
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+
+
+def _split_escape(raw: str) -> tuple[str, str]:
+    # `raw` split into the text that can be decoded now and the escape at
+    # its end that has to wait for more characters
+    end = _COMPLETE_ESCAPES.match(raw).end()
+    surrogate = _HIGH_SURROGATE.search(raw, 0, end)
+    if surrogate is not None:
+        start = surrogate.start()
+        # and not an escaped backslash followed by "u"
+        backslashes = start - len(raw[:start].rstrip("\\"))
+        if backslashes % 2 == 0:
+            end = start
+    return raw[:end], raw[end:]
+
+
+def _decode_string(value: str) -> str:
+    # the string parser lets raw control characters through, like a newline
+    try:
+        return json.loads(f'"{value}"', strict=False)
+    except json.JSONDecodeError:
+        escape = value.rfind(chr(92))
+        if escape == -1:
+            raise
+        # a partial value ending in the middle of an escape
+        return json.loads(f'"{value[:escape]}"', strict=False)
+
+
+def _child(node: dict | list, key: str | int, default, replace: bool = False) -> Any:
+    if isinstance(node, dict):
+        if replace or key not in node:
+            node[key] = default()
+        return node[key]
+    assert isinstance(key, int)
+    while len(node) <= key:
+        node.append(None)
+    if replace or node[key] is None:
+        node[key] = default()
+    return node[key]
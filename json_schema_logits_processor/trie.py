@@ -0,0 +1,289 @@
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Iterable, Sequence, TypeVar
+
+State = TypeVar("State")
+# What `step` returns for every character of an alphabet, and whether it
+# can accept characters outside it at all.
+CharacterClass = tuple[dict[str, tuple[State | None, bool]], bool]
+Child = TypeVar("Child")
+
+
+@dataclass
+class TrieNode:
+    id: int | None = None
+    is_root: bool = False
+
+    def __init__(self):
+        self.children = {}
+
+
+class Trie:
+    def __init__(self, eos_token_id: int):
+        self.root = TrieNode()
+        self.root.is_root = True
+        self.eos_token_id = eos_token_id
+
+    def insert(self, token: str, id: int):
+        node = self.root
+        for char in token:
+            if char not in node.children:
+                node.children[char] = TrieNode()
+            node = node.children[char]
+        node.id = id
+
+    def to_arrays(self) -> tuple[array, array, array, array]:
+        # Flattens the trie breadth first: node n has token id token_ids[n]
+        # (-1 for none) and its children are the edges
+        # child_offsets[n]:child_offsets[n + 1], labelled with the code point
+        # in labels and pointing at the node index in targets.
+        token_ids, child_offsets = array("i"), array("I", [0])
+        labels, targets = array("I"), array("I")
+        nodes = [self.root]
+        for node in nodes:
+            token_ids.append(-1 if node.id is None else node.id)
+            for letter, child in node.children.items():
+                labels.append(ord(letter))
+                targets.append(len(nodes))
+                nodes.append(child)
+            child_offsets.append(len(labels))
+        return token_ids, child_offsets, labels, targets
+
+    @classmethod
+    def from_arrays(
+        cls,
+        eos_token_id: int,
+        token_ids: Sequence[int],
+        child_offsets: Sequence[int],
+        labels: Sequence[int],
+        targets: Sequence[int],
+    ) -> "Trie":
+        trie = cls(eos_token_id)
+        nodes = [trie.root] + [TrieNode() for _ in range(len(token_ids) - 1)]
+        for n, node in enumerate(nodes):
+            if token_ids[n] >= 0:
+                node.id = token_ids[n]
+            for edge in range(child_offsets[n], child_offsets[n + 1]):
+                node.children[chr(labels[edge])] = nodes[targets[edge]]
+        return trie
+
+    def _search_for_valid_token_ids(
+        self,
+        prefix: str,
+        next_token: str,
+        node: TrieNode,
+        is_valid: Callable[[str, str], tuple[bool, bool]],
+        valid_token_ids: list[int],
+    ):
+        stack = [(prefix, next_token, node)]  # Create a stack with the initial state
+        while stack:  # While the stack is not empty
+            prefix, next_token, node = stack.pop()
+
+            valid, complete = None, None
+            if not node.is_root:
+                valid, complete = is_valid(prefix, next_token)
+            new_prefix = prefix + next_token
+
+            if valid is False:
+                continue
+            for letter, child_node in node.children.items():
+                stack.append(
+                    (new_prefix, letter, child_node)
+                )  # Add children to the stack
+
+            if node.id is not None:
+                valid_token_ids.append(node.id)
+            if complete is True:
+                valid_token_ids.append(self.eos_token_id)
+
+    def find_valid_tokens(
+        self, prefix: str, is_valid: Callable[[str, str], tuple[bool, bool]]
+    ):
+        valid_tokens = []
+        self._search_for_valid_token_ids("", prefix, self.root, is_valid, valid_tokens)
+        return valid_tokens
+
+    def find_valid_token_states(
+        self,
+        state: State,
+        step: Callable[[State, str], tuple[State | None, bool]],
+        characters: Callable[[State, int], CharacterClass[State] | None] | None = None,
+    ) -> tuple[list[int], dict[int, State]]:
+        # Same walk as `find_valid_tokens`, but each node carries the state
+        # reached after its prefix so children only advance by one letter.
+        # `step` returns None for an invalid letter, and whether the json
+        # value is complete after it. `characters` can answer `step` for a
+        # whole class of letters at once, given a state and its number of
+        # children, and children outside the class are skipped unvisited.
+        valid_token_ids = []
+        next_states = {}
+        if self.root.id is not None:
+            valid_token_ids.append(self.root.id)
+            next_states[self.root.id] = state
+        stack = []
+        children = self.root.children
+        _push_children(stack, state, children.items(), len(children), characters)
+        while stack:
+            parent_state, letter, node, stepped = stack.pop()
+            if stepped is None:
+                stepped = step(parent_state, letter)
+            node_state, complete = stepped
+            if node_state is None:
+                continue
+            _push_children(
+                stack, node_state, node.children.items(), len(node.children), characters
+            )
+            if node.id is not None:
+                valid_token_ids.append(node.id)
+                next_states[node.id] = node_state
+            if complete:
+                valid_token_ids.append(self.eos_token_id)
+        return valid_token_ids, next_states
+
+
+class CompactTrie:
+    # The flattened layout of `Trie.to_arrays`, walked directly. The sections
+    # can be `array`s or memoryviews over a memory mapped file, so worker
+    # processes can share one copy of the trie.
+    def __init__(
+        self,
+        eos_token_id: int,
+        token_ids: Sequence[int],
+        child_offsets: Sequence[int],
+        labels: Sequence[int],
+        targets: Sequence[int],
+    ):
+        self.eos_token_id = eos_token_id
+        self.token_ids = token_ids
+        self.child_offsets = child_offsets
+        self.labels = labels
+        self.targets = targets
+
+    @classmethod
+    def from_trie(cls, trie: Trie) -> "CompactTrie":
+        return cls(trie.eos_token_id, *trie.to_arrays())
+
+    def __len__(self):
+        return len(self.token_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            memoryview(section).nbytes
+            for section in (
+                self.token_ids,
+                self.child_offsets,
+                self.labels,
+                self.targets,
+            )
+        )
+
+    def to_arrays(self) -> tuple[array, array, array, array]:
+        return (
+            _as_array("i", self.token_ids),
+            _as_array("I", self.child_offsets),
+            _as_array("I", self.labels),
+            _as_array("I", self.targets),
+        )
+
+    def __getstate__(self):
+        # memoryviews can't be pickled, so a mapped trie is copied out
+        return (self.eos_token_id, *self.to_arrays())
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def find_valid_tokens(
+        self, prefix: str, is_valid: Callable[[str, str], tuple[bool, bool]]
+    ) -> list[int]:
+        token_ids, child_offsets = self.token_ids, self.child_offsets
+        labels, targets = self.labels, self.targets
+        valid_token_ids = []
+        if token_ids[0] >= 0:
+            valid_token_ids.append(token_ids[0])
+        stack = [
+            (prefix, edge) for edge in range(child_offsets[0], child_offsets[1])
+        ]
+        while stack:
+            prefix, edge = stack.pop()
+            next_token = chr(labels[edge])
+            valid, complete = is_valid(prefix, next_token)
+            if valid is False:
+                continue
+            new_prefix = prefix + next_token
+            node = targets[edge]
+            for child_edge in range(child_offsets[node], child_offsets[node + 1]):
+                stack.append((new_prefix, child_edge))
+            if token_ids[node] >= 0:
+                valid_token_ids.append(token_ids[node])
+            if complete is True:
+                valid_token_ids.append(self.eos_token_id)
+        return valid_token_ids
+
+    def find_valid_token_states(
+        self,
+        state: State,
+        step: Callable[[State, str], tuple[State | None, bool]],
+        characters: Callable[[State, int], CharacterClass[State] | None] | None = None,
+    ) -> tuple[list[int], dict[int, State]]:
+        token_ids, targets = self.token_ids, self.targets
+        valid_token_ids = []
+        next_states = {}
+        if token_ids[0] >= 0:
+            valid_token_ids.append(token_ids[0])
+            next_states[token_ids[0]] = state
+        stack = []
+        _push_children(stack, state, *self._children(0), characters)
+        while stack:
+            parent_state, letter, edge, stepped = stack.pop()
+            if stepped is None:
+                stepped = step(parent_state, letter)
+            node_state, complete = stepped
+            if node_state is None:
+                continue
+            node = targets[edge]
+            _push_children(stack, node_state, *self._children(node), characters)
+            token_id = token_ids[node]
+            if token_id >= 0:
+                valid_token_ids.append(token_id)
+                next_states[token_id] = node_state
+            if complete:
+                valid_token_ids.append(self.eos_token_id)
+        return valid_token_ids, next_states
+
+    def _children(self, node: int) -> tuple[Iterable[tuple[str, int]], int]:
+        # (letter, edge) pairs leaving `node`, and how many there are
+        first, last = self.child_offsets[node], self.child_offsets[node + 1]
+        return zip(map(chr, self.labels[first:last]), range(first, last)), last - first
+
+
+def _push_children(
+    stack: list,
+    state: State,
+    children: Iterable[tuple[str, Child]],
+    count: int,
+    characters: Callable[[State, int], CharacterClass[State] | None] | None,
+):
+    # Pushes the `count` children whose letter `state` may accept, with the
+    # step already taken for them when `characters` knows it. Shared by both
+    # tries, a child is a TrieNode or a CompactTrie edge.
+    classes = None if characters is None else characters(state, count)
+    if classes is None:
+        stack.extend((state, letter, node, None) for letter, node in children)
+        return
+    stepped, others = classes
+    for letter, node in children:
+        out = stepped.get(letter)
+        if out is None:
+            if others:
+                stack.append((state, letter, node, None))
+        elif out[0] is not None:
+            stack.append((state, letter, node, out))
+
+
+def _as_array(typecode: str, section: Sequence[int]) -> array:
+    if isinstance(section, array):
+        return section
+    out = array(typecode)
+    out.frombytes(memoryview(section).cast("B"))
+    return out
@@ -0,0 +1,285 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import weakref
+from array import array
+from pathlib import Path
+
+import torch
+from transformers import PreTrainedTokenizer
+
+from json_schema_logits_processor.trie import CompactTrie, Trie
+
+CACHE_FORMAT_VERSION = 1
+_MAGIC = b"JSLPVOC\0"
+# magic, format version, token count, node count, edge count
+_HEADER = struct.Struct("<8sIIII")
+
+
+def tokenizer_fingerprint(tokenizer: PreTrainedTokenizer) -> str:
+    config = {
+        "format": CACHE_FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "name": tokenizer.name_or_path,
+        "class": type(tokenizer).__name__,
+        "vocab_size": tokenizer.vocab_size,
+        "special_tokens": tokenizer.special_tokens_map,
+        "special_ids": tokenizer.all_special_ids,
+        "eos_token_id": tokenizer.eos_token_id,
+        "clean_up_tokenization_spaces": getattr(
+            tokenizer, "clean_up_tokenization_spaces", None
+        ),
+    }
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode())
+    vocab = sorted(tokenizer.get_vocab().items(), key=lambda item: item[1])
+    digest.update(json.dumps(vocab).encode())
+    return digest.hexdigest()
+
+
+def _memoized_fingerprint(tokenizer: PreTrainedTokenizer) -> str:
+    # Hashing the whole vocabulary takes a while, so it is done once per
+    # tokenizer object.
+    with _fingerprints_lock:
+        fingerprint = _fingerprints.get(tokenizer)
+    if fingerprint is None:
+        fingerprint = tokenizer_fingerprint(tokenizer)
+        with _fingerprints_lock:
+            _fingerprints[tokenizer] = fingerprint
+    return fingerprint
+
+
+def decode_vocabulary(tokenizer: PreTrainedTokenizer) -> list[str]:
+    return tokenizer.batch_decode(
+        torch.arange(tokenizer.vocab_size), skip_special_tokens=True
+    )
+
+
+def build_token_trie(decoded_tokens: list[str], eos_token_id: int) -> CompactTrie:
+    trie = Trie(eos_token_id)
+    for i, token in enumerate(decoded_tokens):
+        trie.insert(token, i)
+    return CompactTrie.from_trie(trie)
+
+
+def split_string_body_tokens(
+    decoded_tokens: list[str], eos_token_id: int
+) -> tuple[list[int], CompactTrie]:
+    # Inside a string value every character but a quote or a backslash keeps
+    # the string open, so most tokens are always valid there. Only the rest
+    # go into a trie that still has to be walked. Like the full trie, each
+    # text keeps the last token id that decodes to it.
+    token_ids = {token: i for i, token in enumerate(decoded_tokens)}
+    plain_token_ids, special = [], Trie(eos_token_id)
+    for token, i in token_ids.items():
+        if '"' in token or "\\" in token:
+            special.insert(token, i)
+        else:
+            plain_token_ids.append(i)
+    return plain_token_ids, CompactTrie.from_trie(special)
+
+
+def save_vocabulary(
+    path: str | os.PathLike, decoded_tokens: list[str], trie: Trie | CompactTrie
+):
+    # Every section is a flat array of 4 byte integers, followed by the
+    # decoded tokens as one utf-8 string, so the file can be memory mapped.
+    token_offsets = array("I", [0])
+    for token in decoded_tokens:
+        token_offsets.append(token_offsets[-1] + len(token))
+    token_ids, child_offsets, labels, targets = trie.to_arrays()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first so concurrent readers never see a
+    # partially written cache
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+        f.write(
+            _HEADER.pack(
+                _MAGIC,
+                CACHE_FORMAT_VERSION,
+                len(decoded_tokens),
+                len(token_ids),
+                len(labels),
+            )
+        )
+        for section in (token_offsets, token_ids, child_offsets, labels, targets):
+            section.tofile(f)
+        f.write("".join(decoded_tokens).encode("utf-8"))
+    os.replace(f.name, path)
+
+
+def load_vocabulary(
+    path: str | os.PathLike, eos_token_id: int
+) -> tuple[list[str], CompactTrie]:
+    # The trie sections stay views over the mapped file, so every process
+    # loading the same cache shares its pages.
+    with open(path, "rb") as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    magic, version, token_count, node_count, edge_count = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != CACHE_FORMAT_VERSION:
+        raise ValueError(f"{path} is not a vocabulary cache")
+    offset = _HEADER.size
+    sections = []
+    for typecode, length in (
+        ("I", token_count + 1),
+        ("i", node_count),
+        ("I", node_count + 1),
+        ("I", edge_count),
+        ("I", edge_count),
+    ):
+        sections.append(data[offset : offset + 4 * length].cast(typecode))
+        offset += 4 * length
+    if offset > len(data):
+        raise ValueError(f"{path} is truncated")
+    token_offsets, token_ids, child_offsets, labels, targets = sections
+    text = str(data[offset:], "utf-8")
+    decoded_tokens = [
+        text[token_offsets[i] : token_offsets[i + 1]] for i in range(token_count)
+    ]
+    trie = CompactTrie(eos_token_id, token_ids, child_offsets, labels, targets)
+    return decoded_tokens, trie
+
+
+def load_or_build_vocabulary(
+    tokenizer: PreTrainedTokenizer,
+    cache_dir: str | os.PathLike,
+    fingerprint: str | None = None,
+) -> tuple[list[str], CompactTrie]:
+    assert tokenizer.eos_token_id is not None
+    if fingerprint is None:
+        fingerprint = _memoized_fingerprint(tokenizer)
+    path = Path(cache_dir).expanduser() / f"{fingerprint}.vocab"
+    if path.exists():
+        try:
+            return load_vocabulary(path, tokenizer.eos_token_id)
+        except (ValueError, TypeError, IndexError, struct.error):
+            pass
+    decoded_tokens = decode_vocabulary(tokenizer)
+    trie = build_token_trie(decoded_tokens, tokenizer.eos_token_id)
+    save_vocabulary(path, decoded_tokens, trie)
+    return decoded_tokens, trie
+
+
+class VocabularyIndex:
+    # Everything the processor needs that only depends on the tokenizer, so
+    # it can be built once and shared by every schema.
+    def __init__(
+        self,
+        decoded_tokens: list[str],
+        trie: CompactTrie,
+        eos_token_id: int,
+        pad_token_id: int | None = None,
+        bos_token_id: int | None = None,
+        fingerprint: str | None = None,
+        tokenizer: PreTrainedTokenizer | None = None,
+    ):
+        self.decoded_tokens = decoded_tokens
+        self.trie = trie
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = pad_token_id
+        self.bos_token_id = bos_token_id
+        # without one the fingerprint is taken from `tokenizer` on first use
+        self._fingerprint = fingerprint
+        self._tokenizer = weakref.ref(tokenizer) if tokenizer is not None else None
+        self._string_body_tokens: tuple[list[int], CompactTrie] | None = None
+        self._token_ids: dict[str, int] | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.decoded_tokens)
+
+    @property
+    def fingerprint(self) -> str | None:
+        with self._lock:
+            if self._fingerprint is None and self._tokenizer is not None:
+                tokenizer = self._tokenizer()
+                if tokenizer is not None:
+                    self._fingerprint = _memoized_fingerprint(tokenizer)
+            return self._fingerprint
+
+    def string_body_tokens(self) -> tuple[list[int], CompactTrie]:
+        # built on first use, most schemas have a string somewhere
+        with self._lock:
+            if self._string_body_tokens is None:
+                self._string_body_tokens = split_string_body_tokens(
+                    self.decoded_tokens, self.eos_token_id
+                )
+            return self._string_body_tokens
+
+    def token_ids(self) -> dict[str, int]:
+        # the token id the trie keeps for each text, the last one decoding to it
+        with self._lock:
+            if self._token_ids is None:
+                self._token_ids = {
+                    token: i for i, token in enumerate(self.decoded_tokens)
+                }
+            return self._token_ids
+
+    @classmethod
+    def build(
+        cls,
+        tokenizer: PreTrainedTokenizer,
+        cache_dir: str | os.PathLike | None = None,
+        fingerprint: str | None = None,
+    ) -> "VocabularyIndex":
+        assert tokenizer.eos_token_id is not None
+        if cache_dir is not None:
+            if fingerprint is None:
+                fingerprint = _memoized_fingerprint(tokenizer)
+            decoded_tokens, trie = load_or_build_vocabulary(
+                tokenizer, cache_dir, fingerprint
+            )
+        else:
+            decoded_tokens = decode_vocabulary(tokenizer)
+            trie = build_token_trie(decoded_tokens, tokenizer.eos_token_id)
+        return cls(
+            decoded_tokens,
+            trie,
+            eos_token_id=tokenizer.eos_token_id,
+            pad_token_id=tokenizer.pad_token_id,
+            bos_token_id=tokenizer.bos_token_id,
+            fingerprint=fingerprint,
+            tokenizer=tokenizer,
+        )
+
+    @classmethod
+    def from_tokenizer(
+        cls,
+        tokenizer: PreTrainedTokenizer,
+        cache_dir: str | os.PathLike | None = None,
+    ) -> "VocabularyIndex":
+        # Indexes are shared per tokenizer object, and with a `cache_dir`
+        # between tokenizer objects with the same fingerprint, for as long as
+        # anyone uses them. Without one the fingerprint is only taken if a
+        # compiled schema cache asks for it.
+        with _registry_lock:
+            index = _indexes_by_tokenizer.get(tokenizer)
+            if index is not None:
+                return index
+            if cache_dir is None:
+                index = cls.build(tokenizer)
+            else:
+                fingerprint = _memoized_fingerprint(tokenizer)
+                index = _indexes_by_fingerprint.get(fingerprint)
+                if index is None:
+                    index = cls.build(tokenizer, cache_dir, fingerprint)
+                    _indexes_by_fingerprint[fingerprint] = index
+            _indexes_by_tokenizer[tokenizer] = index
+            return index
+
+
+_registry_lock = threading.Lock()
+_indexes_by_tokenizer: weakref.WeakKeyDictionary[
+    PreTrainedTokenizer, VocabularyIndex
+] = weakref.WeakKeyDictionary()
+_indexes_by_fingerprint: "weakref.WeakValueDictionary[str, VocabularyIndex]" = (
+    weakref.WeakValueDictionary()
+)
+_fingerprints_lock = threading.Lock()
+_fingerprints: "weakref.WeakKeyDictionary[PreTrainedTokenizer, str]" = (
+    weakref.WeakKeyDictionary()
+)
@@ -0,0 +1,92 @@
+import pytest
+
+from json_schema_logits_processor.iterative_parser import (
+    advance_partial_json_value, canonical_state_key, initial_parser_state)
+from json_schema_logits_processor.iterative_parser.types import (
+    IterativeParserResult, pop_array_value)
+from json_schema_logits_processor.schema.interative_schema import (
+    JsonSchema, SchemaId, parse_schema_from_string)
+
+
+def _parse(schema: JsonSchema, text: str) -> IterativeParserResult:
+    _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+    return state
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ("[", True, False),
+        ("[]", True, True),
+        ("[ ]", True, True),
+        ('["a"', True, False),
+        ('["a",', True, False),
+        ('[ "a" , "b"]', True, True),
+        ('["a",]', False, False),
+        ("[,", False, False),
+        ("[1]", False, False),
+    ],
+)
+def test_array_of_strings(text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(
+        '{"type": "array", "items": {"type": "string"}}'
+    )
+    state = _parse(schema, text)
+    assert state.valid == valid
+    assert (state.complete and state.schema_id == SchemaId(0)) == complete
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ("[]", False, False),
+        ("[1]", True, True),
+        ("[1, -2.5]", True, True),
+        ("[1, 2,", False, False),
+    ],
+)
+def test_array_item_counts(text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(
+        '{"type": "array", "items": {"type": "number"}, "minItems": 1, "maxItems": 2}'
+    )
+    state = _parse(schema, text)
+    assert state.valid == valid
+    assert (state.complete and state.schema_id == SchemaId(0)) == complete
+
+
+def test_array_of_objects():
+    schema = parse_schema_from_string(
+        """
+        {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"a": {"type": "string"}, "n": {"type": "number"}}
+            }
+        }
+        """
+    )
+    state = _parse(schema, '[{"a": "x", "n": 2}, {"n": 1}]')
+    assert state.valid
+    assert state.complete
+    value, _ = pop_array_value(state.value_stack, SchemaId(0))
+    assert value is not None
+    assert value.count == 2
+    assert not _parse(schema, '[{"a": "x"}, {"b": 1}]').valid
+
+
+def test_long_array_state_stays_small():
+    schema = parse_schema_from_string(
+        '{"type": "array", "items": {"type": "string"}}'
+    )
+    tail, state = advance_partial_json_value(
+        "", initial_parser_state(), '["first"', schema
+    )
+    key = canonical_state_key(schema, state)
+    for _ in range(500):
+        tail, state = advance_partial_json_value(tail, state, ', "more"', schema)
+        assert len(state.value_stack) == 2
+    assert canonical_state_key(schema, state) == key
+    value, _ = pop_array_value(state.value_stack[:1], SchemaId(0))
+    assert value is not None
+    assert value.count == 500
@@ -1,5 +1,9 @@
+import json
+
 import pytest
 
+from json_schema_logits_processor.iterative_parser import (
+    advance_partial_json_value, initial_parser_state)
 from json_schema_logits_processor.iterative_parser.enum_parser import \
     is_valid_enum
 from json_schema_logits_processor.iterative_parser.types import (
@@ -58,3 +62,28 @@ def test_state_changes(enum_schema: EnumJsonSchema, start_state: IterativeParser
     assert value.start_index == 0
     assert value.value == "a"
     assert len(rest) == 0
+
+
+def test_enum_prefix_lookup():
+    values = [f"SKU-{i:05}" for i in range(5000)] + ["SKU", "other"]
+    schema = parse_schema_from_string(
+        '{"type": "enum", "values": ' + json.dumps(values) + "}"
+    )
+    enum_schema = schema[SchemaId(0)]
+    assert isinstance(enum_schema, EnumJsonSchema)
+    for text, valid in [
+        ('"SKU-0499', True),
+        ('"SKU-5', False),
+        ('"SKU', True),
+        ('"o', True),
+        ('"q', False),
+    ]:
+        _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+        assert state.valid == valid, text
+    for text, valid in [
+        ('"SKU"', True),
+        ('"SKU-0"', False),
+        ('"SKU-04999"', True),
+    ]:
+        _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+        assert state.valid == valid, text
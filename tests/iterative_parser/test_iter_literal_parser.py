@@ -0,0 +1,26 @@
+import pytest
+
+from json_schema_logits_processor.iterative_parser import (
+    advance_partial_json_value, initial_parser_state)
+from json_schema_logits_processor.schema.interative_schema import (
+    SchemaId, parse_schema_from_string)
+
+
+@pytest.mark.parametrize(
+    "schema_str, text, valid, complete",
+    [
+        ('{"type": "boolean"}', "t", True, False),
+        ('{"type": "boolean"}', " true", True, True),
+        ('{"type": "boolean"}', "false", True, True),
+        ('{"type": "boolean"}', "fals e", False, False),
+        ('{"type": "boolean"}', "null", False, False),
+        ('{"type": "null"}', "nul", True, False),
+        ('{"type": "null"}', "null", True, True),
+        ('{"type": "null"}', "true", False, False),
+    ],
+)
+def test_literals(schema_str: str, text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(schema_str)
+    _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+    assert state.valid == valid
+    assert (state.complete and state.schema_id == SchemaId(0)) == complete
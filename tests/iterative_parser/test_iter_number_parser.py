@@ -0,0 +1,186 @@
+import pytest
+
+from json_schema_logits_processor.iterative_parser import (
+    advance_partial_json_value, initial_parser_state)
+from json_schema_logits_processor.iterative_parser.number_parser import (
+    NumberState, is_valid_number)
+from json_schema_logits_processor.iterative_parser.types import (
+    IterativeParserResult, pop_number_value)
+from json_schema_logits_processor.schema.interative_schema import (
+    JsonSchema, NumberJsonSchema, SchemaId, parse_schema_from_string)
+
+
+@pytest.fixture
+def number_schema() -> NumberJsonSchema:
+    schema = parse_schema_from_string('{"type": "number"}')
+    number_schema = schema[SchemaId(0)]
+    assert isinstance(number_schema, NumberJsonSchema)
+    return number_schema
+
+
+@pytest.fixture
+def start_state() -> IterativeParserResult:
+    return IterativeParserResult(
+        valid=True,
+        complete=False,
+        string_index=0,
+        schema_id=SchemaId(0),
+        value_stack=(),
+        next_state=0,
+    )
+
+
+def _parse(schema: JsonSchema, text: str) -> IterativeParserResult:
+    _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+    return state
+
+
+def test_state_changes(
+    number_schema: NumberJsonSchema, start_state: IterativeParserResult
+):
+    out = is_valid_number("-12.5e3", number_schema, start_state)
+    states = [out.next_state]
+    while out.string_index < len("-12.5e3"):
+        out = is_valid_number("-12.5e3", number_schema, out)
+        states.append(out.next_state)
+    assert states == [
+        NumberState.MINUS,
+        NumberState.INTEGER,
+        NumberState.INTEGER,
+        NumberState.DOT,
+        NumberState.FRACTION,
+        NumberState.EXPONENT,
+        NumberState.EXPONENT_DIGITS,
+    ]
+    assert out.valid
+    assert out.complete
+    value, rest = pop_number_value(out.value_stack, number_schema.id)
+    assert value is not None
+    assert value.value == "-12.5e3"
+    assert len(rest) == 0
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ("0", True, True),
+        ("01", False, False),
+        ("-", True, False),
+        ("-0", True, True),
+        ("1.", True, False),
+        ("1.05", True, True),
+        ("1e", True, False),
+        ("1E+", True, False),
+        ("1e-5", True, True),
+        (" 3", True, True),
+        ("1.e5", False, False),
+        ("--1", False, False),
+    ],
+)
+def test_number_literals(text: str, valid: bool, complete: bool):
+    state = _parse(parse_schema_from_string('{"type": "number"}'), text)
+    assert state.valid == valid
+    assert state.complete == complete
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ("1", True, False),
+        ("9", True, False),
+        ("25", True, True),
+        ("250", True, True),
+        ("251", False, False),
+        ("26", True, True),
+        ("260", False, False),
+        ("0", False, False),
+        ("-", False, False),
+        ("1.", False, False),
+        ("1e", False, False),
+    ],
+)
+def test_integer_range(text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(
+        '{"type": "integer", "minimum": 10, "maximum": 250}'
+    )
+    state = _parse(schema, text)
+    assert state.valid == valid
+    assert state.complete == complete
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ('{"n": 1.5', True, False),
+        ('{"n": 1.5}', True, True),
+        ('{"n": -1.5 }', True, True),
+        ('{"n": -1.6', False, False),
+        ('{"n": -1.', True, False),
+        ('{"n": 2.01', False, False),
+        ('{"n": 2.00,"s":"x"}', True, True),
+        ('{"n": 3', False, False),
+    ],
+)
+def test_number_in_object(text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(
+        """
+        {
+            "type": "object",
+            "properties": {
+                "n": {"type": "number", "minimum": -1.5, "maximum": 2},
+                "s": {"type": "string"}
+            }
+        }
+        """
+    )
+    state = _parse(schema, text)
+    assert state.valid == valid
+    assert (state.complete and state.schema_id == SchemaId(0)) == complete
+
+
+@pytest.mark.parametrize(
+    "schema_str, text, valid",
+    [
+        ('{"type": "integer", "minimum": 5, "maximum": 9}', "1", False),
+        ('{"type": "integer", "minimum": 5, "maximum": 9}', "7", True),
+        ('{"type": "integer", "minimum": -9, "maximum": -5}', "-1", False),
+        ('{"type": "integer", "minimum": -9, "maximum": -5}', "-6", True),
+        ('{"type": "number", "minimum": 5, "maximum": 9}', "1", False),
+        ('{"type": "number", "minimum": 5, "maximum": 9}', "5.", True),
+        ('{"type": "integer", "minimum": 18, "maximum": 120}', "1", True),
+        ('{"type": "integer", "minimum": 18, "maximum": 120}', "13", False),
+        ('{"type": "integer", "minimum": 18, "maximum": 120}', "12", True),
+        ('{"type": "integer", "minimum": 18, "maximum": 120}', "120", True),
+        ('{"type": "integer", "minimum": 5.5, "maximum": 5.9}', "5", False),
+        ('{"type": "number", "minimum": 5.5, "maximum": 5.9}', "5", True),
+    ],
+)
+def test_range_dead_ends(schema_str: str, text: str, valid: bool):
+    assert _parse(parse_schema_from_string(schema_str), text).valid == valid
+
+
+@pytest.mark.parametrize(
+    "schema_str",
+    [
+        '{"type": "integer", "minimum": 5, "maximum": 9}',
+        '{"type": "integer", "minimum": 18, "maximum": 120}',
+        '{"type": "integer", "minimum": -120, "maximum": -18}',
+        '{"type": "integer", "minimum": -7, "maximum": 1300}',
+        '{"type": "number", "minimum": 5, "maximum": 9}',
+        '{"type": "number", "minimum": -2.5, "maximum": 31.25}',
+    ],
+)
+def test_every_valid_prefix_can_be_finished(schema_str: str):
+    schema = parse_schema_from_string(schema_str)
+    prefixes = [""]
+    while prefixes:
+        extended = [
+            prefix + char
+            for prefix in prefixes
+            for char in "0123456789.-"
+            if _parse(schema, prefix + char).valid
+        ]
+        for prefix in prefixes:
+            if prefix and not _parse(schema, prefix).complete:
+                assert any(text.startswith(prefix) for text in extended), prefix
+        prefixes = [text for text in extended if len(text) < 5]
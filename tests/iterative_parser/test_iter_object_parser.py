@@ -1,7 +1,9 @@
 import pytest
 
+from json_schema_logits_processor.iterative_parser import (
+    advance_partial_json_value, initial_parser_state)
 from json_schema_logits_processor.iterative_parser.object_parser import (
-    ObjectState, _colon, _post_value, _start)
+    ObjectState, _colon, _open, _post_value, _start)
 from json_schema_logits_processor.iterative_parser.types import (
     IncrementalObjectValue, IterativeParserResult)
 from json_schema_logits_processor.schema.interative_schema import (
@@ -57,8 +59,8 @@ def test_start(start_state: IterativeParserResult, object_schema: ObjectJsonSche
     result = _start(partial_json, start_state.string_index, object_schema)
     assert result.valid is True
     assert result.complete is False
-    assert result.next_state == 0
-    assert result.schema_id == SchemaId(3)
+    assert result.next_state == ObjectState.OPEN
+    assert result.schema_id == SchemaId(0)
     assert result.string_index == 1
     assert result.value_stack == ()
 
@@ -155,3 +157,65 @@ def test_post_value(
     assert result.next_state == ObjectState.POST_VALUE
     assert result.string_index == 0
     assert result.value_stack == ()
+
+
+def test_open(start_state: IterativeParserResult, object_schema: ObjectJsonSchema):
+    result = _open(" ", start_state.string_index, object_schema)
+    assert result.valid is True
+    assert result.next_state == ObjectState.OPEN
+    # nothing is required, so the object can be empty
+    result = _open("}", start_state.string_index, object_schema)
+    assert result.valid is True
+    assert result.complete is True
+    assert result.next_state == ObjectState.DONE
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ("{}", False, False),
+        ('{"a": "x"}', False, False),
+        ('{"a": "x"', True, False),
+        ('{"b": 1}', True, True),
+        ('{ "a": "x", "b": 2 }', True, True),
+    ],
+)
+def test_required_properties(text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(
+        """
+        {
+            "type": "object",
+            "properties": {"a": {"type": "string"}, "b": {"type": "number"}},
+            "required": ["b"]
+        }
+        """
+    )
+    _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+    assert state.valid == valid
+    assert (state.complete and state.schema_id == SchemaId(0)) == complete
+
+
+def test_nested_objects():
+    schema = parse_schema_from_string(
+        """
+        {
+            "type": "object",
+            "properties": {
+                "a": {
+                    "type": "object",
+                    "properties": {"x": {"type": "string"}, "y": {"type": "string"}}
+                },
+                "b": {"type": "string"}
+            }
+        }
+        """
+    )
+    _, state = advance_partial_json_value(
+        "", initial_parser_state(), '{"a": {"y": "1", "x": "2"}, "b": "3"}', schema
+    )
+    assert state.valid
+    assert state.complete
+    _, state = advance_partial_json_value(
+        "", initial_parser_state(), '{"a": {"x": "1", "b"', schema
+    )
+    assert not state.valid
@@ -1,3 +1,5 @@
+import tracemalloc
+
 import pytest
 
 from json_schema_logits_processor.iterative_parser.string_parser import \
@@ -84,3 +86,55 @@ def test_state_changes(
     assert value.start_index == 0
     assert value.value == "test"
     assert len(rest) == 0
+
+
+def test_value_is_shared_between_steps(
+    string_schema: StringJsonSchema, start_state: IterativeParserResult
+):
+    states = [is_valid_string('"test"', string_schema, start_state)]
+    while not states[-1].complete:
+        states.append(is_valid_string('"test"', string_schema, states[-1]))
+    values = [state.value_stack[-1][1] for state in states]
+    assert [value.value for value in values] == ["", "t", "te", "tes", "test", "test"]
+    assert values[2] == IncrementalStringValue("te", 0)
+    assert hash(values[2]) == hash(IncrementalStringValue("te", 0))
+    assert values[2] != IncrementalStringValue("te", 1)
+    # earlier states keep their values and stacks
+    assert states[2].value_stack == ((SchemaId(0), IncrementalStringValue("te", 0)),)
+    assert states[2] == IterativeParserResult(
+        valid=True,
+        complete=False,
+        string_index=3,
+        schema_id=SchemaId(0),
+        next_state=1,
+        value_stack=((SchemaId(0), IncrementalStringValue("te", 0)),),
+    )
+
+
+def test_read_values_release_earlier_ones(
+    string_schema: StringJsonSchema, start_state: IterativeParserResult
+):
+    text = '"' + "ab" * 2000 + '"'
+    tracemalloc.start()
+    state = is_valid_string(text, string_schema, start_state)
+    for i in range(1, len(text) - 1):
+        state = is_valid_string(text, string_schema, state)
+        assert state.value_stack[-1][1].value == text[1 : i + 1]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # only the last value is kept, not every value read before it (~8 MB)
+    assert retained < 500_000
+    value = state.value_stack[-1][1]
+    assert value == IncrementalStringValue(text[1:-1], 0)
+    assert value != IncrementalStringValue(text[1:-2] + "c", 0)
+
+
+def test_values_compare_without_joining():
+    value = IncrementalStringValue("", 0)
+    for char in "hello":
+        value = value.append(char)
+    other = IncrementalStringValue("he", 0).append("l").append("lo")
+    assert value == other
+    assert value._value is None and other._value is None
+    assert value != IncrementalStringValue("", 0).append("hellp")
+    assert value != IncrementalStringValue("hello", 1)
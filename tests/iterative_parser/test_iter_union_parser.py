@@ -0,0 +1,115 @@
+import pytest
+
+from json_schema_logits_processor.iterative_parser import (
+    _parse_one_token, advance_partial_json_value, canonical_state_key,
+    initial_parser_state)
+from json_schema_logits_processor.iterative_parser.types import (
+    IterativeParserResult, pop_union_value)
+from json_schema_logits_processor.iterative_parser.union_parser import \
+    is_valid_union
+from json_schema_logits_processor.schema.interative_schema import (
+    JsonSchema, SchemaId, parse_schema_from_string)
+
+
+def _parse(schema: JsonSchema, text: str) -> IterativeParserResult:
+    _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+    return state
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ('"a"', True, True),
+        ("12.5", True, True),
+        ("-", True, False),
+        ("1", True, True),
+        ('1"', False, False),
+        ("null", False, False),
+    ],
+)
+def test_any_of(text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(
+        '{"anyOf": [{"type": "string"}, {"type": "number"}]}'
+    )
+    state = _parse(schema, text)
+    assert state.valid == valid
+    assert (state.complete and state.schema_id == SchemaId(0)) == complete
+
+
+@pytest.mark.parametrize(
+    "text, valid, complete",
+    [
+        ('{"u": {"x": 1}, "z": "q"}', True, True),
+        ('{"u": [true, false]  , "z": "q"}', True, True),
+        ('{"u": null}', True, True),
+        ('{"u": 1}', False, False),
+        ('{"u": [null]}', False, False),
+    ],
+)
+def test_one_of_in_object(text: str, valid: bool, complete: bool):
+    schema = parse_schema_from_string(
+        """
+        {
+            "type": "object",
+            "properties": {
+                "u": {
+                    "oneOf": [
+                        {"type": "object", "properties": {"x": {"type": "number"}}},
+                        {"type": "array", "items": {"type": "boolean"}},
+                        {"type": "null"}
+                    ]
+                },
+                "z": {"type": "string"}
+            }
+        }
+        """
+    )
+    state = _parse(schema, text)
+    assert state.valid == valid
+    assert (state.complete and state.schema_id == SchemaId(0)) == complete
+
+
+def test_type_list():
+    schema = parse_schema_from_string('{"type": ["integer", "null"]}')
+    assert _parse(schema, "3").complete
+    assert _parse(schema, "null").complete
+    assert not _parse(schema, "3.5").valid
+
+
+def test_alternatives_drop_out():
+    schema = parse_schema_from_string(
+        '{"anyOf": [{"type": "string"}, {"type": "number"}, {"type": "boolean"}]}'
+    )
+    state = _parse(schema, "1")
+    value, _ = pop_union_value(state.value_stack, SchemaId(0))
+    assert value is not None
+    assert len(value.states) == 1
+    assert canonical_state_key(schema, state) == canonical_state_key(
+        schema, _parse(schema, " 7")
+    )
+
+
+def test_only_matching_alternatives_are_parsed():
+    alternatives = [
+        f'{{"type": "object", "properties": {{"k{i}": {{"type": "string"}}}}}}'
+        for i in range(20)
+    ]
+    schema = parse_schema_from_string(
+        f'{{"anyOf": [{", ".join(alternatives)}, {{"type": "null"}}]}}'
+    )
+    parsed = []
+
+    def parse(text: str, state: IterativeParserResult) -> IterativeParserResult:
+        parsed.append(state.schema_id)
+        return _parse_one_token(text, state, schema)
+
+    # leading whitespace is skipped by the union itself
+    state = _parse(schema, "  ")
+    assert pop_union_value(state.value_stack, SchemaId(0))[0] is None
+    text = " " * state.string_index + "n"
+    state = is_valid_union(text, schema[SchemaId(0)], state, parse)
+    assert state.valid
+    assert parsed == [schema[SchemaId(0)].alternatives[-1]]
+    assert canonical_state_key(schema, state) == canonical_state_key(
+        schema, _parse(schema, "n")
+    )
@@ -1,7 +1,11 @@
+import sys
+
 import pytest
 
-from json_schema_logits_processor.iterative_parser import \
-    parse_partial_json_value
+from json_schema_logits_processor.iterative_parser import (
+    ParserMemo, advance_partial_json_value, canonical_state_key,
+    initial_parser_state, parse_partial_json_value)
+from json_schema_logits_processor.iterative_parser.characters import SPACES
 from json_schema_logits_processor.iterative_parser.types import \
     IncrementalStringValue
 from json_schema_logits_processor.schema.interative_schema import (
@@ -82,3 +86,112 @@ def test_invalid_input_state_changes(global_schema: JsonSchema):
             failed = True
             break
     assert failed, "should have failed on double key"
+
+
+def test_advance_partial_json_value(global_schema: JsonSchema):
+    test_str = '{"a_word": "test", "second_word": "more"}'
+    tail, state = "", initial_parser_state()
+    for i in range(0, len(test_str), 3):
+        tail, state = advance_partial_json_value(
+            tail, state, test_str[i : i + 3], global_schema
+        )
+        assert state.valid
+        # only the open string value, if any, is kept around
+        assert len(tail) <= len('"second_word"')
+        assert state.string_index == len(tail)
+    assert state.complete
+    assert tail == ""
+
+
+def test_advance_partial_json_value_invalid(global_schema: JsonSchema):
+    tail, state = advance_partial_json_value(
+        "", initial_parser_state(), '{"x', global_schema
+    )
+    assert not state.valid
+    tail, state = advance_partial_json_value(tail, state, '"', global_schema)
+    assert not state.valid
+
+
+def test_parser_memo(global_schema: JsonSchema):
+    memo = ParserMemo(global_schema)
+    test_str = '{"a_word": "test", "second_word": "test"}'
+    tail, state = advance_partial_json_value(
+        "", initial_parser_state(), test_str, global_schema, memo
+    )
+    assert state.complete
+    expected = advance_partial_json_value(
+        "", initial_parser_state(), test_str, global_schema
+    )
+    assert (tail, state) == expected
+    assert memo.misses == len(memo) == len(test_str)
+    advance_partial_json_value(
+        "", initial_parser_state(), test_str, global_schema, memo
+    )
+    assert memo.hits == len(test_str)
+    memo.clear()
+    assert len(memo) == 0
+
+
+def test_parser_memo_is_bounded(str_only_json_schema: JsonSchema):
+    memo = ParserMemo(str_only_json_schema, max_entries=4)
+    _, state = advance_partial_json_value(
+        "", initial_parser_state(), '"abcdefgh"', str_only_json_schema, memo
+    )
+    assert state.complete
+    assert len(memo) == 4
+
+
+def test_next_characters(global_schema: JsonSchema):
+    memo = ParserMemo(global_schema)
+    assert set(SPACES) == {
+        chr(i) for i in range(sys.maxunicode + 1) if chr(i).isspace()
+    }
+    text = '{"a_word": "x\\y", "second_word": "z"} '
+    for i in range(len(text)):
+        _, state = advance_partial_json_value(
+            "", initial_parser_state(), text[:i], global_schema
+        )
+        next_characters = memo.next_characters(state)
+        for char in next_characters.alphabet | set("xyzé中\x00"):
+            out = memo.step(state, char)
+            if char in next_characters.alphabet:
+                assert out.valid == (char in next_characters.successors)
+            else:
+                assert out.valid == next_characters.others
+        # only string values take characters outside the alphabet
+        assert next_characters.others == (i in (12, 13, 14, 15, 34, 35))
+
+
+def test_string_value_with_escapes(str_only_json_schema: JsonSchema):
+    tail, state = "", initial_parser_state()
+    for char in ' "a\\"b\\\\':
+        tail, state = advance_partial_json_value(
+            tail, state, char, str_only_json_schema
+        )
+        assert state.valid
+    assert state.value_stack[0][1].value == 'a\\"b\\\\'
+
+
+def test_canonical_state_key(global_schema: JsonSchema):
+    def key(text: str):
+        _, state = advance_partial_json_value(
+            "", initial_parser_state(), text, global_schema
+        )
+        return canonical_state_key(global_schema, state)
+
+    assert key('{"a_word": "xx') == key('{"a_word": "yyyy')
+    assert key('{"a_word": "xx') == key('{ "a_word":"x')
+    assert key('{"a_word": "xx') != key('{"second_word": "xx')
+    assert key('{"a_word": "xx') != key('{"a_word": "xx\\')
+    assert key('{"a_word": "xx"') != key('{"a_word": "xx')
+
+
+def test_canonical_state_key_keeps_enum_values():
+    schema = parse_schema_from_string('{"type": "enum", "values": ["ab", "ba"]}')
+
+    def key(text: str):
+        _, state = advance_partial_json_value("", initial_parser_state(), text, schema)
+        return canonical_state_key(schema, state)
+
+    assert key('"a') != key('"b')
+    assert key('"a') == key(' "a')
@@ -1,5 +1,8 @@
+import pytest
+
 from json_schema_logits_processor.schema.interative_schema import (
-    SchemaId, parse_schema_from_string)
+    ArrayJsonSchema, NumberJsonSchema, ObjectJsonSchema, SchemaId,
+    UnionJsonSchema, parse_schema_from_string)
 from json_schema_logits_processor.schema.types import SchemaType
 
 
@@ -9,3 +12,103 @@ def test_iterative_schema_parsing():
     assert schema[SchemaId(0)].type == SchemaType.OBJECT
     assert schema[SchemaId(1)].type == SchemaType.STRING
     assert schema[SchemaId(2)].type == SchemaType.ENUM
+
+
+def test_schemas_are_independent():
+    first = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    second = parse_schema_from_string('{"type": "string"}')
+    assert len(first.schemas) == 3
+    assert len(second.schemas) == 1
+    assert first[SchemaId(0)].type == SchemaType.OBJECT
+    assert second[SchemaId(0)].type == SchemaType.STRING
+
+
+def test_schema_fingerprint():
+    schema_str = '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    reordered = '{"properties": {"a": {"type": "string"}}, "type": "object"}'
+    other = '{"type": "object", "properties": {"b": {"type": "string"}}}'
+    fingerprint = parse_schema_from_string(schema_str).fingerprint
+    assert fingerprint == parse_schema_from_string(reordered).fingerprint
+    assert fingerprint != parse_schema_from_string(other).fingerprint
+
+
+def test_number_schema_parsing():
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "number"},'
+        ' "b": {"type": "integer", "minimum": 0, "maximum": 10}}}'
+    )
+    number, integer = schema[SchemaId(1)], schema[SchemaId(2)]
+    assert isinstance(number, NumberJsonSchema)
+    assert isinstance(integer, NumberJsonSchema)
+    assert not number.integer and number.minimum is None
+    assert integer.integer and (integer.minimum, integer.maximum) == (0, 10)
+
+
+def test_array_schema_parsing():
+    schema = parse_schema_from_string(
+        '{"type": "array", "items": {"type": "string"}, "maxItems": 3}'
+    )
+    array = schema[SchemaId(0)]
+    assert isinstance(array, ArrayJsonSchema)
+    assert schema[array.items].type == SchemaType.STRING
+    assert schema[array.items].parent_id == array.id
+    assert (array.min_items, array.max_items) == (0, 3)
+
+
+def test_union_and_literal_parsing():
+    schema = parse_schema_from_string(
+        '{"anyOf": [{"type": "boolean"}, {"type": "null"}, {"type": "string"}]}'
+    )
+    union = schema[SchemaId(0)]
+    assert isinstance(union, UnionJsonSchema)
+    assert [schema[i].type for i in union.alternatives] == [
+        SchemaType.BOOLEAN,
+        SchemaType.NULL,
+        SchemaType.STRING,
+    ]
+    assert all(schema[i].parent_id == union.id for i in union.alternatives)
+
+
+def test_union_alternatives_by_first_char():
+    schema = parse_schema_from_string(
+        '{"anyOf": [{"type": "integer"}, {"type": ["null", "string"]},'
+        ' {"type": "boolean"}, {"type": "string"}]}'
+    )
+    union = schema[SchemaId(0)]
+    assert isinstance(union, UnionJsonSchema)
+    integer, nested, boolean, string = union.alternatives
+    assert union.alternatives_by_first_char["-"] == (integer,)
+    assert union.alternatives_by_first_char["n"] == (nested,)
+    assert union.alternatives_by_first_char['"'] == (nested, string)
+    assert union.alternatives_by_first_char["f"] == (boolean,)
+    assert "{" not in union.alternatives_by_first_char
+    assert " " not in union.alternatives_by_first_char
+
+
+def test_ref_parsing():
+    schema = parse_schema_from_string(
+        """
+        {
+            "$defs": {"name": {"type": "string"}},
+            "type": "object",
+            "properties": {
+                "first": {"$ref": "#/$defs/name"},
+                "last": {"$ref": "#/$defs/name"}
+            },
+            "required": ["first"]
+        }
+        """
+    )
+    root = schema[SchemaId(0)]
+    assert isinstance(root, ObjectJsonSchema)
+    assert root.required == ("first",)
+    first, last = root.properties["first"], root.properties["last"]
+    assert first != last
+    assert schema[first].type == schema[last].type == SchemaType.STRING
+
+
+def test_recursive_ref_is_rejected():
+    with pytest.raises(NotImplementedError):
+        parse_schema_from_string('{"type": "array", "items": {"$ref": "#"}}')
@@ -0,0 +1,164 @@
+import pytest
+
+from json_schema_logits_processor.automaton import (DEAD_STATE,
+                                                    CharacterAutomaton,
+                                                    TokenAutomaton,
+                                                    compile_token_automaton)
+from json_schema_logits_processor.iterative_parser import \
+    parse_partial_json_value
+from json_schema_logits_processor.schema.interative_schema import (
+    JsonSchema, parse_schema_from_string)
+from json_schema_logits_processor.trie import Trie
+
+EOS_TOKEN_ID = 0
+
+decoded_tokens = [
+    "",
+    "{",
+    '{"',
+    "}",
+    '"',
+    '"}',
+    '":',
+    '": "',
+    ", ",
+    ',"',
+    " ",
+    "a",
+    "_word",
+    "second",
+    "_",
+    "word",
+    "test",
+    "\\",
+    '\\"',
+    "x",
+    ":",
+    "ab",
+]
+
+
+@pytest.fixture
+def global_schema() -> JsonSchema:
+    schema_text = """
+    {
+        "type": "object",
+        "properties": {
+            "a_word": {"type": "string"},
+            "second_word": {"type": "string"}
+         }
+    }
+    """
+    return parse_schema_from_string(schema_text)
+
+
+@pytest.fixture
+def trie() -> Trie:
+    trie = Trie(EOS_TOKEN_ID)
+    for i, token in enumerate(decoded_tokens):
+        trie.insert(token, i)
+    return trie
+
+
+def _trie_valid_tokens(trie: Trie, schema: JsonSchema, text: str) -> set[int]:
+    return set(
+        trie.find_valid_tokens(
+            text,
+            lambda prefix, next_token: parse_partial_json_value(
+                prefix, next_token, schema
+            ),
+        )
+    )
+
+
+def test_matches_trie(global_schema: JsonSchema, trie: Trie):
+    automaton = compile_token_automaton(global_schema, trie)
+    test_str = '{"a_word": "te\\"st", "second_word":"x"} '
+    for i in range(len(test_str) + 1):
+        text = test_str[:i]
+        state = automaton.characters.run(text)
+        assert set(automaton.valid_tokens(state)) == _trie_valid_tokens(
+            trie, global_schema, text
+        ), f"failed at {i}, {text}"
+
+
+def test_invalid_text(global_schema: JsonSchema, trie: Trie):
+    automaton = TokenAutomaton(CharacterAutomaton(global_schema), trie)
+    state = automaton.characters.run('{"b')
+    assert state == DEAD_STATE
+    # only the empty token stays valid, same as the trie walk
+    assert automaton.valid_tokens(state) == [0]
+
+
+def test_token_transitions(global_schema: JsonSchema, trie: Trie):
+    automaton = TokenAutomaton(CharacterAutomaton(global_schema), trie)
+    characters = automaton.characters
+    state = characters.initial_state
+    text = ""
+    for token_id in [2, 11, 12, 7, 16, 5]:
+        assert token_id in automaton.valid_tokens(state)
+        state = automaton.next_state(state, token_id)
+        text += decoded_tokens[token_id]
+        assert state == characters.run(text)
+    assert characters.accepting[state]
+    assert automaton.next_state(state, 1) == DEAD_STATE
+
+
+def test_equivalent_states_are_shared(global_schema: JsonSchema):
+    characters = CharacterAutomaton(global_schema)
+    assert characters.run('{"a_word": "xx') == characters.run('{"a_word": "yyyy')
+    assert characters.run('{"a_word": "xx') != characters.run('{"second_word": "xx')
+
+
+@pytest.mark.parametrize(
+    "schema_str",
+    [
+        '{"type": "number", "minimum": 0, "maximum": 1}',
+        '{"type": "integer", "maximum": 10}',
+    ],
+)
+def test_bounded_numbers_have_finitely_many_states(schema_str: str):
+    schema = parse_schema_from_string(schema_str)
+    trie = Trie(EOS_TOKEN_ID)
+    for i, token in enumerate(["", *"0123456789.-", "10", "00", "25", " "]):
+        trie.insert(token, i)
+    automaton = compile_token_automaton(schema, trie)
+    assert len(automaton) < 100
+    for text in ["0", "0.", "0.000", "0.25", "1", "10", "-", "-100", "1.0000"]:
+        state = automaton.characters.run(text)
+        assert set(automaton.valid_tokens(state)) == _trie_valid_tokens(
+            trie, schema, text
+        ), text
+
+
+def test_compile_gives_up_past_max_states(global_schema: JsonSchema, trie: Trie):
+    automaton = TokenAutomaton(CharacterAutomaton(global_schema), trie)
+    assert not automaton.compile(max_states=2)
+    assert automaton.too_large
+    # what didn't get compiled still fills in when reached
+    text = '{"a_word": "x"}'
+    state = automaton.characters.run(text)
+    assert set(automaton.valid_tokens(state)) == _trie_valid_tokens(
+        trie, global_schema, text
+    )
+    assert compile_token_automaton(global_schema, trie).compile()
+
+
+def test_unions_compile_into_the_automaton(trie: Trie):
+    schema = parse_schema_from_string(
+        """
+        {
+            "anyOf": [
+                {"type": "object", "properties": {"a_word": {"type": "string"}}},
+                {"type": "object", "properties": {"second_word": {"type": "string"}}},
+                {"type": "string"}
+            ]
+        }
+        """
+    )
+    automaton = compile_token_automaton(schema, trie)
+    for text in ['{"', '{"a_word": "x', '{"second_word":"ab"} ', '"test', '"x" ']:
+        state = automaton.characters.run(text)
+        assert set(automaton.valid_tokens(state)) == _trie_valid_tokens(
+            trie, schema, text
+        ), text
@@ -0,0 +1,155 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+import torch
+from transformers import BartTokenizer
+
+from json_schema_logits_processor import JsonSchemaLogitsProcessor
+from json_schema_logits_processor.generation import generate_fast_forward
+from json_schema_logits_processor.schema.interative_schema import \
+    parse_schema_from_string
+
+schema_str = """
+{
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "country": {"type": "enum", "values": ["United States", "Germany"]}
+    },
+    "required": ["name", "country"]
+}
+"""
+
+
+@pytest.fixture
+def tokenizer() -> BartTokenizer:
+    return BartTokenizer.from_pretrained("facebook/bart-base")
+
+
+class ScriptedModel:
+    # prefers a token that continues `text` from whatever it has been fed
+    def __init__(self, tokenizer: BartTokenizer, text: str):
+        self.tokenizer = tokenizer
+        self.text = text
+        self.calls = 0
+        self.input_ids: list[int] = []
+
+    def __call__(self, input_ids, attention_mask, past_key_values, use_cache):
+        self.calls += 1
+        if past_key_values is None:
+            self.input_ids = []
+        self.input_ids += input_ids[0].tolist()
+        assert len(self.input_ids) == attention_mask.shape[1]
+        seen = self.tokenizer.decode(self.input_ids)
+        remaining = self.tokenizer.encode(
+            self.text[len(seen) :], add_special_tokens=False
+        )
+        logits = torch.zeros(1, input_ids.shape[1], len(self.tokenizer))
+        logits[0, -1, remaining[0] if remaining else 0] = 10.0
+        return SimpleNamespace(logits=logits, past_key_values=len(self.input_ids))
+
+
+def test_forced_tokens(tokenizer):
+    processor = JsonSchemaLogitsProcessor(
+        schema=parse_schema_from_string(schema_str), tokenizer=tokenizer
+    )
+    input_ids = torch.tensor(
+        [tokenizer.encode('<s>{"name": "ab", "c', add_special_tokens=False)]
+    )
+    forced = processor.forced_tokens(input_ids)
+    assert tokenizer.decode(forced[0]) == 'ountry"'
+    assert processor.forced_tokens(input_ids, max_tokens=1)[0] == forced[0][:1]
+    # a string value could go on with anything
+    input_ids = torch.tensor(
+        [tokenizer.encode('<s>{"name": "ab', add_special_tokens=False)]
+    )
+    assert processor.forced_tokens(input_ids) == [[]]
+
+
+def test_forced_key_keeps_the_tokenizers_split(tokenizer):
+    schema = parse_schema_from_string(
+        """
+        {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "temperature_celsius": {"type": "number"}
+            },
+            "required": ["name", "temperature_celsius"]
+        }
+        """
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    input_ids = torch.tensor(
+        [tokenizer.encode('<s>{"name": "ab", "t', add_special_tokens=False)]
+    )
+    expected = tokenizer.encode('emperature_celsius"', add_special_tokens=False)
+    assert len(expected) > 1
+    # the whole remainder of the key, as the tokenizer writes it rather than
+    # one character per token
+    assert processor.forced_tokens(input_ids) == [expected]
+
+
+def test_generate_fast_forward(tokenizer):
+    schema = parse_schema_from_string(schema_str)
+    text = '<s>{"name": "ab", "country": "Germany"}'
+    model = ScriptedModel(tokenizer, text)
+    output = generate_fast_forward(
+        model,
+        JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer),
+        torch.tensor([[tokenizer.bos_token_id]]),
+        max_new_tokens=32,
+    )
+    assert tokenizer.decode(output.sequences[0]).startswith(text)
+    assert output.forced_tokens > 0
+    assert output.model_calls == model.calls
+    assert output.model_calls + output.forced_tokens == output.sequences.shape[1] - 1
+
+
+def test_generate_fast_forward_stops_on_padding(tokenizer):
+    class PaddingModel:
+        def __call__(self, input_ids, attention_mask, past_key_values, use_cache):
+            logits = torch.zeros(1, input_ids.shape[1], len(tokenizer))
+            logits[0, -1, tokenizer.pad_token_id] = 10.0
+            return SimpleNamespace(logits=logits, past_key_values=None)
+
+    # nothing can follow the prompt, so eos and padding are allowed
+    input_ids = torch.tensor([tokenizer.encode("<s>nope", add_special_tokens=False)])
+    output = generate_fast_forward(
+        PaddingModel(),
+        JsonSchemaLogitsProcessor(
+            schema=parse_schema_from_string(schema_str), tokenizer=tokenizer
+        ),
+        input_ids,
+        max_new_tokens=8,
+    )
+    assert output.sequences[0, -1].item() == tokenizer.pad_token_id
+    assert output.sequences.shape[1] == input_ids.shape[1] + 1
+    assert output.model_calls == 1
+
+
+def test_sampling_with_lazy_top_k_warns(tokenizer, caplog):
+    schema = parse_schema_from_string(schema_str)
+    processor = JsonSchemaLogitsProcessor(
+        schema=schema, tokenizer=tokenizer, lazy_top_k=4
+    )
+    with caplog.at_level(logging.WARNING):
+        generate_fast_forward(
+            ScriptedModel(tokenizer, '<s>{"name": "ab", "country": "Germany"}'),
+            processor,
+            torch.tensor([[tokenizer.bos_token_id]]),
+            max_new_tokens=4,
+            do_sample=True,
+        )
+    assert "lazy_top_k" in caplog.text
+
+
+def test_generate_fast_forward_batch(tokenizer):
+    processor = JsonSchemaLogitsProcessor(
+        schema=parse_schema_from_string(schema_str), tokenizer=tokenizer
+    )
+    with pytest.raises(ValueError):
+        generate_fast_forward(
+            ScriptedModel(tokenizer, ""), processor, torch.zeros(2, 1).long()
+        )
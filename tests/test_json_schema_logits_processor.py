@@ -1,10 +1,17 @@
+import asyncio
+import gc
 import re
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 
 import pytest
 import torch
-from transformers import BartTokenizer
+from transformers import BartTokenizer, StoppingCriteriaList
 
 from json_schema_logits_processor import JsonSchemaLogitsProcessor
+from json_schema_logits_processor.parallel import process_pool
+from json_schema_logits_processor import prefetch
+from json_schema_logits_processor.prefetch import MaskPrefetcher
 from json_schema_logits_processor.schema.interative_schema import \
     parse_schema_from_string
 
@@ -56,3 +63,350 @@ def test_end_to_end(tokenizer, decoded_tokens):
         )
         print(f"current text: {decoded}, next token: {next_token}")
         print(len(valid_tokens))
+
+
+def test_precompiled_matches_trie(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    precompiled = JsonSchemaLogitsProcessor(
+        schema=schema, tokenizer=tokenizer, precompile=True
+    )
+    text = '{"a": "b"}'
+    for i in range(len(text) + 1):
+        assert set(precompiled._get_next_valid_tokens(text[:i])) == set(
+            processor._get_next_valid_tokens(text[:i])
+        )
+
+
+def test_incremental_matches_full_decode(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    input_ids = torch.tensor(
+        tokenizer.encode(test_data, add_special_tokens=False)
+    ).unsqueeze(0)
+    test_logits = torch.tensor([0.0] * tokenizer.vocab_size).unsqueeze(0)
+    for i in range(2, len(input_ids[0])):
+        test_input_ids = input_ids[:, :i]
+        # a fresh processor has no previous state and decodes the whole row
+        fresh = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+        assert torch.equal(
+            processor(input_ids=test_input_ids, scores=test_logits),
+            fresh(input_ids=test_input_ids, scores=test_logits),
+        )
+
+
+def test_batch_masks(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    running = tokenizer.encode('<s>{"a', add_special_tokens=False)
+    finished = tokenizer.encode('<s>{"a": "b"}</s>', add_special_tokens=False)
+    running = [tokenizer.pad_token_id] * (len(finished) - len(running)) + running
+    input_ids = torch.tensor([running, finished])
+    scores = torch.randn(2, tokenizer.vocab_size)
+    processed = processor(input_ids=input_ids, scores=scores)
+    assert torch.equal(processed[1], scores[1])
+    single = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    assert torch.equal(
+        processed[0], single(input_ids=input_ids[:1], scores=scores[:1])[0]
+    )
+
+
+def test_processors_share_vocabulary(tokenizer):
+    first = JsonSchemaLogitsProcessor(
+        schema=parse_schema_from_string('{"type": "string"}'), tokenizer=tokenizer
+    )
+    second = JsonSchemaLogitsProcessor(
+        schema=parse_schema_from_string(
+            '{"type": "object", "properties": {"a": {"type": "string"}}}'
+        ),
+        tokenizer=tokenizer,
+        vocabulary=first.vocabulary,
+    )
+    assert second.decoded_token_tree is first.decoded_token_tree
+    assert (
+        JsonSchemaLogitsProcessor(
+            schema=second.schema, tokenizer=tokenizer
+        ).vocabulary
+        is first.vocabulary
+    )
+
+
+def test_token_sets_are_shared_between_states(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    input_ids = tokenizer.encode(
+        '<s>{"a": "' + "lorem ipsum dolor sit amet " * 4, add_special_tokens=False
+    )
+    scores = torch.zeros(1, tokenizer.vocab_size)
+    for i in range(2, len(input_ids) + 1):
+        processor(input_ids=torch.tensor([input_ids[:i]]), scores=scores)
+    stats = processor.token_set_stats()
+    mask_stats = processor.mask_stats()
+    # only the states up to the open string value are new, the rest are
+    # answered by their cached mask
+    assert stats.misses <= 6
+    assert mask_stats.misses <= 6
+    assert mask_stats.hits >= len(input_ids) - 7
+
+
+def test_lazy_top_k_matches_greedy(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    lazy = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer, lazy_top_k=4)
+    input_ids = tokenizer.encode('<s>{"a": "b c"}', add_special_tokens=False)
+    torch.manual_seed(0)
+    for i in range(2, len(input_ids) + 1):
+        scores = torch.randn(1, tokenizer.vocab_size)
+        if i < len(input_ids):
+            scores[0, input_ids[i]] += 10
+        expected = processor(input_ids=torch.tensor([input_ids[:i]]), scores=scores)
+        processed = lazy(input_ids=torch.tensor([input_ids[:i]]), scores=scores)
+        assert processed.argmax() == expected.argmax()
+        # only valid tokens are left
+        assert torch.all(expected[processed > -1e10] > -1e10)
+    assert lazy.lazy_top_k_stats().hits > 0
+
+
+@pytest.mark.parametrize("pool", ["thread", "process"])
+def test_executor_masks_match_serial(tokenizer, pool):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}, "b": {"type": "number"}}}'
+    )
+    texts = ['<s>{"a": "x', '<s>{"b": 1', "<s>{", '<s>{"a": "x", "b"']
+    rows = [tokenizer.encode(text, add_special_tokens=False) for text in texts]
+    length = max(map(len, rows))
+    input_ids = torch.tensor(
+        [[tokenizer.pad_token_id] * (length - len(row)) + row for row in rows]
+    )
+    scores = torch.zeros(len(rows), tokenizer.vocab_size)
+    expected = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)(
+        input_ids=input_ids, scores=scores
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    executor = ThreadPoolExecutor(2) if pool == "thread" else process_pool(processor, 2)
+    with executor:
+        processor.executor = executor
+        assert torch.equal(processor(input_ids=input_ids, scores=scores), expected)
+
+
+def test_compute_mask_async(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    reference = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    texts = ['{"a": "b c"}', '{ "a":"d"}']
+
+    async def generate(text: str):
+        token_ids = tokenizer.encode(text, add_special_tokens=False)
+        sequence = processor.start_sequence()
+        for i, token_id in enumerate(token_ids):
+            mask = await processor.compute_mask_async(sequence)
+            expected = reference._get_next_valid_tokens(tokenizer.decode(token_ids[:i]))
+            assert set(mask.nonzero().flatten().tolist()) == set(expected)
+            sequence = processor.advance(sequence, [token_id])
+
+    async def main():
+        # the sequences interleave on one processor
+        await asyncio.gather(*(generate(text) for text in texts * 2))
+
+    asyncio.run(main())
+
+
+def test_compute_mask_cancelled(tokenizer):
+    processor = JsonSchemaLogitsProcessor(
+        schema=parse_schema_from_string('{"type": "string"}'), tokenizer=tokenizer
+    )
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(CancelledError):
+        processor._compute_mask(processor.start_sequence(), cancelled=cancelled)
+
+    async def main():
+        task = asyncio.create_task(
+            processor.compute_mask_async(processor.start_sequence())
+        )
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+
+def test_prefetch(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    stopping_criteria = StoppingCriteriaList([MaskPrefetcher(processor)])
+    input_ids = tokenizer.encode('<s>{"a": "b"}', add_special_tokens=False)
+    scores = torch.zeros(1, tokenizer.vocab_size)
+    for i in range(2, len(input_ids) + 1):
+        step_ids = torch.tensor([input_ids[:i]])
+        assert not torch.as_tensor(stopping_criteria(step_ids, scores)).any()
+        expected = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)(
+            input_ids=step_ids, scores=scores
+        )
+        assert torch.equal(processor(input_ids=step_ids, scores=scores), expected)
+    stats = processor.prefetch_stats()
+    assert stats.hits == len(input_ids) - 1
+    assert stats.misses == 0
+    assert stats.hidden_seconds <= stats.compute_seconds
+    # a prefetch for other ids is dropped
+    processor.prefetch(torch.tensor([input_ids[:3]]))
+    processor(input_ids=torch.tensor([input_ids[:4]]), scores=scores)
+    assert processor.prefetch_stats().misses == 1
+
+
+@pytest.mark.parametrize("per_row", [False, True])
+def test_prefetch_batch(tokenizer, monkeypatch, per_row: bool):
+    monkeypatch.setattr(prefetch, "_PER_ROW_STOPPING", per_row)
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    prefetcher = MaskPrefetcher(processor)
+    input_ids = torch.tensor(
+        [
+            tokenizer.encode('<s>{"a": "b', add_special_tokens=False),
+            tokenizer.encode('<s>{"a": "c', add_special_tokens=False),
+        ]
+    )
+    scores = torch.zeros(2, tokenizer.vocab_size)
+    if per_row:
+        is_done = StoppingCriteriaList([prefetcher])(input_ids, scores)
+    else:
+        # how `StoppingCriteriaList` combines its criteria before 4.39
+        is_done = any(criteria(input_ids, scores) for criteria in [prefetcher])
+    assert not torch.as_tensor(is_done).any()
+    expected = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)(
+        input_ids=input_ids, scores=scores
+    )
+    assert torch.equal(processor(input_ids=input_ids, scores=scores), expected)
+    assert processor.prefetch_stats().hits == 1
+
+
+def test_prefetch_thread_is_stopped(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    input_ids = torch.tensor(
+        [tokenizer.encode('<s>{"a": "b', add_special_tokens=False)]
+    )
+    scores = torch.zeros(1, tokenizer.vocab_size)
+
+    def prefetch_threads(processor) -> set[threading.Thread]:
+        before = set(threading.enumerate())
+        processor.prefetch(input_ids)
+        processor(input_ids=input_ids, scores=scores)
+        return set(threading.enumerate()) - before
+
+    def assert_stopped(threads: set[threading.Thread]):
+        assert len(threads) == 1
+        for thread in threads:
+            thread.join(timeout=5)
+            assert not thread.is_alive()
+
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    threads = prefetch_threads(processor)
+    processor.close()
+    assert_stopped(threads)
+    # prefetching again after closing starts a new thread
+    threads = prefetch_threads(processor)
+    assert processor.prefetch_stats().hits == 2
+    processor.close()
+    assert_stopped(threads)
+
+    with JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer) as processor:
+        threads = prefetch_threads(processor)
+    assert_stopped(threads)
+
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    threads = prefetch_threads(processor)
+    del processor
+    gc.collect()
+    assert_stopped(threads)
+
+
+def test_masks_are_cached_per_state(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    first = processor.compute_mask(processor.start_sequence('{"a": "b'))
+    second = processor.compute_mask(processor.start_sequence('{"a": "b c d'))
+    assert first is second
+    assert first.dtype == torch.bool
+    assert set(first.nonzero().flatten().tolist()) == set(
+        processor._get_next_valid_tokens('{"a": "b')
+    )
+    # masks combine like any boolean tensor
+    key = processor.compute_mask(processor.start_sequence('{"'))
+    assert torch.equal(first & key, key & first)
+    assert processor.mask_stats().hits == 1
+
+
+def test_step_metrics(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    steps = []
+    processor = JsonSchemaLogitsProcessor(
+        schema=schema, tokenizer=tokenizer, on_step=steps.append
+    )
+    input_ids = tokenizer.encode('{"a": "b c"}', return_tensors="pt")[0][:-1]
+    scores = torch.zeros(1, tokenizer.vocab_size)
+    for i in range(1, len(input_ids) + 1):
+        out = processor(input_ids=input_ids[None, :i], scores=scores)
+        assert steps[-1].allowed_tokens == int((out[0] > -1e10).sum())
+    assert len(steps) == len(input_ids)
+    assert steps[0].parser_calls >= steps[0].trie_nodes_visited > 0
+    assert steps[0].token_set_misses == 1
+    totals = processor.step_metrics()
+    assert totals.calls == len(input_ids)
+    assert totals.parser_calls == sum(step.parser_calls for step in steps)
+    assert totals.max_allowed_tokens == max(step.allowed_tokens for step in steps)
+    assert totals.as_dict()["mask_hits"] == processor.mask_stats().hits
+    for phase in ("decode", "parse", "trie_walk", "mask"):
+        assert totals.as_dict()[f"{phase}_seconds"] > 0
+
+    # nothing is measured without `profile` or `on_step`
+    processor = JsonSchemaLogitsProcessor(schema=schema, tokenizer=tokenizer)
+    processor(input_ids=input_ids[None, :2], scores=scores)
+    assert processor.step_metrics().calls == 0
+
+
+def test_step_metrics_with_prefetch(tokenizer):
+    schema = parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+    input_ids = tokenizer.encode('{"a": "b c"}', return_tensors="pt")[0][:-1]
+    scores = torch.zeros(1, tokenizer.vocab_size)
+    steps, prefetched_steps = [], []
+    processor = JsonSchemaLogitsProcessor(
+        schema=schema, tokenizer=tokenizer, on_step=steps.append
+    )
+    prefetching = JsonSchemaLogitsProcessor(
+        schema=schema, tokenizer=tokenizer, on_step=prefetched_steps.append
+    )
+    for i in range(1, len(input_ids) + 1):
+        processor(input_ids=input_ids[None, :i], scores=scores)
+        prefetching.prefetch(input_ids[None, :i])
+        prefetching(input_ids=input_ids[None, :i], scores=scores)
+    assert prefetching.prefetch_stats().hits == len(input_ids)
+    # the background walks count towards the call that takes them, once
+    for step, prefetched_step in zip(steps, prefetched_steps):
+        assert prefetched_step.parser_calls == step.parser_calls
+        assert prefetched_step.trie_nodes_visited == step.trie_nodes_visited
+    assert prefetching.step_metrics().calls == len(input_ids)
@@ -0,0 +1,71 @@
+import pytest
+
+from json_schema_logits_processor.schema.interative_schema import \
+    parse_schema_from_string
+from json_schema_logits_processor.schema_cache import CompiledSchemaCache
+from json_schema_logits_processor.vocabulary import (VocabularyIndex,
+                                                     build_token_trie)
+
+decoded_tokens = ["", "{", '{"', "}", '"', '"}', '":', " ", "a", "b", "ab"]
+
+
+@pytest.fixture
+def vocabulary() -> VocabularyIndex:
+    return VocabularyIndex(
+        decoded_tokens,
+        build_token_trie(decoded_tokens, eos_token_id=0),
+        eos_token_id=0,
+        fingerprint="test",
+    )
+
+
+def _schema(key: str):
+    return parse_schema_from_string(
+        f'{{"type": "object", "properties": {{"{key}": {{"type": "string"}}}}}}'
+    )
+
+
+def test_hits_and_misses(vocabulary: VocabularyIndex):
+    cache = CompiledSchemaCache()
+    automaton = cache.get(_schema("a"), vocabulary)
+    # a separately parsed but identical schema shares the compiled automaton
+    assert cache.get(_schema("a"), vocabulary) is automaton
+    assert cache.get(_schema("b"), vocabulary) is not automaton
+    assert (_schema("a"), vocabulary) in cache
+    stats = cache.stats()
+    assert stats.hits == 1
+    assert stats.misses == 2
+    assert stats.entries == 2
+    assert stats.evictions == 0
+    assert stats.hit_rate == pytest.approx(1 / 3)
+
+
+def test_resident_size_grows_with_compilation(vocabulary: VocabularyIndex):
+    cache = CompiledSchemaCache()
+    automaton = cache.get(_schema("a"), vocabulary)
+    lazy_bytes = cache.stats().resident_bytes
+    automaton.compile()
+    assert cache.stats().resident_bytes > lazy_bytes
+    assert cache.stats().resident_bytes == automaton.nbytes
+
+
+def test_lru_eviction(vocabulary: VocabularyIndex):
+    cache = CompiledSchemaCache()
+    first = cache.get(_schema("a"), vocabulary, compile=True)
+    budget = first.nbytes
+    cache.max_bytes = int(budget * 1.5)
+    cache.get(_schema("b"), vocabulary, compile=True)
+    assert len(cache) == 1
+    assert (_schema("a"), vocabulary) not in cache
+    assert (_schema("b"), vocabulary) in cache
+    stats = cache.stats()
+    assert stats.evictions == 1
+    assert stats.resident_bytes <= cache.max_bytes
+
+
+def test_clear(vocabulary: VocabularyIndex):
+    cache = CompiledSchemaCache()
+    cache.get(_schema("a"), vocabulary)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats().resident_bytes == 0
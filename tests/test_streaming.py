@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+from json_schema_logits_processor.schema.interative_schema import \
+    parse_schema_from_string
+from json_schema_logits_processor.streaming import JsonValueStream, ValueEvent
+
+schema_str = """
+{
+    "type": "object",
+    "properties": {
+        "artifactType": {"type": "enum", "values": ["image", "video"]},
+        "name": {"type": "string"},
+        "size": {"type": "number"},
+        "tags": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"x": {"type": "integer"}, "y": {"type": "boolean"}}
+            }
+        },
+        "other": {"anyOf": [{"type": "string"}, {"type": "null"}]}
+    }
+}
+"""
+
+
+def _events(
+    text: str, partial: bool = False
+) -> tuple[list[ValueEvent], JsonValueStream]:
+    stream = JsonValueStream(parse_schema_from_string(schema_str), partial=partial)
+    events = []
+    for char in text:
+        events += stream.feed(char)
+    return events + stream.finish(), stream
+
+
+def test_events_in_order():
+    events, stream = _events(
+        '{"artifactType": "image", "tags": [{"x": 1, "y": true}, {}], "size": 2.5}'
+    )
+    assert [(event.path, event.value) for event in events] == [
+        (("artifactType",), "image"),
+        (("tags", 0, "x"), 1),
+        (("tags", 0, "y"), True),
+        (("tags", 0), {"x": 1, "y": True}),
+        (("tags", 1), {}),
+        (("tags",), [{"x": 1, "y": True}, {}]),
+        (("size",), 2.5),
+        ((), stream.document),
+    ]
+    assert all(event.complete for event in events)
+
+
+def test_field_before_generation_ends():
+    stream = JsonValueStream(parse_schema_from_string(schema_str))
+    events = stream.feed('{"artifactType": "video", "other": "still go')
+    assert events == [ValueEvent(("artifactType",), "video")]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"name": "a \\"quoted\\" \\u00e9 name", "other": null}',
+        '{ "size" : -1e3 , "other" : "x" , "tags" : [ ] }',
+        "{}",
+    ],
+)
+def test_document_matches_json(text: str):
+    _, stream = _events(text)
+    assert stream.document == json.loads(text)
+
+
+def test_numbers_complete_when_followed():
+    stream = JsonValueStream(parse_schema_from_string('{"type": "number"}'))
+    assert stream.feed("12") == []
+    assert stream.finish() == [ValueEvent((), 12)]
+
+
+def test_partial_strings():
+    events, _ = _events('{"name": "ab\\n"}', partial=True)
+    # the text added to the string, the escape only once it is complete
+    assert [event.value for event in events if not event.complete] == [
+        "",
+        "a",
+        "b",
+        "\n",
+    ]
+    assert events[-2] == ValueEvent(("name",), "ab\n")
+
+
+@pytest.mark.parametrize("partial", [False, True])
+def test_raw_control_characters(partial: bool):
+    text = '{"name": "line1\nline2\tend"}'
+    events, stream = _events(text, partial=partial)
+    assert ValueEvent(("name",), "line1\nline2\tend") in events
+    assert stream.document == json.loads(text, strict=False)
+    if partial:
+        added = [event.value for event in events if not event.complete]
+        assert "".join(added) == "line1\nline2\tend"
+
+
+def test_long_partial_string():
+    value = "".join(f'word {i} "quoted" \\ caf\u00e9 \U0001F600\n' for i in range(300))
+    text = json.dumps({"name": value})
+    assert len(text) > 10_000
+    stream = JsonValueStream(parse_schema_from_string(schema_str), partial=True)
+    events = []
+    # tokens of a few characters each, splitting escapes between them
+    for start in range(0, len(text), 3):
+        events += stream.feed(text[start : start + 3])
+    added = [event.value for event in events if not event.complete]
+    assert added[0] == ""
+    assert "".join(added) == value
+    assert all("\ud83d" not in part and "\\u" not in part for part in added)
+    assert events[-2] == ValueEvent(("name",), value)
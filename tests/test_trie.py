@@ -0,0 +1,88 @@
+import pickle
+
+import pytest
+
+from json_schema_logits_processor.iterative_parser import \
+    parse_partial_json_value
+from json_schema_logits_processor.schema.interative_schema import (
+    JsonSchema, parse_schema_from_string)
+from json_schema_logits_processor.trie import CompactTrie, Trie
+
+decoded_tokens = ["", "{", '{"', "}", '"', '"}', '":', " ", "a", "ab", "é", "x", ""]
+
+
+@pytest.fixture
+def schema() -> JsonSchema:
+    return parse_schema_from_string(
+        '{"type": "object", "properties": {"a": {"type": "string"}}}'
+    )
+
+
+@pytest.fixture
+def trie() -> Trie:
+    trie = Trie(eos_token_id=0)
+    for i, token in enumerate(decoded_tokens):
+        trie.insert(token, i)
+    return trie
+
+
+def test_compact_trie_matches_trie(trie: Trie, schema: JsonSchema):
+    compact = CompactTrie.from_trie(trie)
+    assert len(compact) == 12
+
+    def is_valid(prefix, next_token):
+        return parse_partial_json_value(prefix, next_token, schema)
+
+    text = '{"a": "éx"}'
+    for i in range(len(text) + 1):
+        assert sorted(compact.find_valid_tokens(text[:i], is_valid)) == sorted(
+            trie.find_valid_tokens(text[:i], is_valid)
+        )
+
+
+def test_find_valid_token_states(trie: Trie):
+    compact = CompactTrie.from_trie(trie)
+
+    # only allow tokens made of "a" and "b", tracking the text as the state
+    def step(text, letter):
+        if letter not in "ab":
+            return None, False
+        return text + letter, letter == "b"
+
+    for walked in (trie, compact):
+        valid_token_ids, next_states = walked.find_valid_token_states("", step)
+        assert sorted(valid_token_ids) == [0, 8, 9, 12]
+        assert next_states == {12: "", 8: "a", 9: "ab"}
+
+
+def test_find_valid_token_states_with_characters(trie: Trie):
+    compact = CompactTrie.from_trie(trie)
+    steps = []
+
+    def step(text, letter):
+        steps.append(letter)
+        if letter not in "ab":
+            return None, False
+        return text + letter, letter == "b"
+
+    # "a" and "b" are answered for the root, which accepts nothing else
+    def characters(text, children):
+        if text != "":
+            return None
+        return {"a": ("a", False), "b": (None, False)}, False
+
+    for walked in (trie, compact):
+        steps.clear()
+        valid_token_ids, next_states = walked.find_valid_token_states(
+            "", step, characters
+        )
+        assert sorted(valid_token_ids) == [0, 8, 9, 12]
+        assert next_states == {12: "", 8: "a", 9: "ab"}
+        assert steps == ["b"]
+
+
+def test_pickle(trie: Trie):
+    compact = CompactTrie.from_trie(trie)
+    copy = pickle.loads(pickle.dumps(compact))
+    assert copy.to_arrays() == compact.to_arrays()
+    assert copy.eos_token_id == compact.eos_token_id
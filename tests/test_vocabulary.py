@@ -0,0 +1,125 @@
+import pytest
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from transformers import PreTrainedTokenizerFast
+
+from json_schema_logits_processor import vocabulary
+from json_schema_logits_processor.trie import CompactTrie, Trie
+from json_schema_logits_processor.vocabulary import (VocabularyIndex,
+                                                     build_token_trie,
+                                                     load_or_build_vocabulary,
+                                                     load_vocabulary,
+                                                     save_vocabulary,
+                                                     split_string_body_tokens,
+                                                     tokenizer_fingerprint)
+
+words = ["<pad>", "</s>", "<unk>", "{", '{"', "}", '"', "a", "ab", "é", "ünï", ":"]
+
+
+def _make_tokenizer() -> PreTrainedTokenizerFast:
+    vocab = {word: i for i, word in enumerate(words)}
+    return PreTrainedTokenizerFast(
+        tokenizer_object=Tokenizer(WordLevel(vocab, unk_token="<unk>")),
+        pad_token="<pad>",
+        eos_token="</s>",
+        unk_token="<unk>",
+    )
+
+
+@pytest.fixture
+def tokenizer() -> PreTrainedTokenizerFast:
+    return _make_tokenizer()
+
+
+def _walk(trie: Trie) -> list[tuple[str, int | None]]:
+    nodes, stack = [], [("", trie.root)]
+    while stack:
+        prefix, node = stack.pop()
+        nodes.append((prefix, node.id))
+        for letter, child in node.children.items():
+            stack.append((prefix + letter, child))
+    return nodes
+
+
+def test_trie_arrays_round_trip():
+    trie = Trie(0)
+    for i, token in enumerate(["", "a", "ab", "b", "é"]):
+        trie.insert(token, i)
+    copy = Trie.from_arrays(0, *trie.to_arrays())
+    assert _walk(copy) == _walk(trie)
+
+
+def test_save_and_load(tmp_path):
+    decoded_tokens = ["", "{", '{"', "ünï", "a", "ab"]
+    trie = build_token_trie(decoded_tokens, eos_token_id=0)
+    save_vocabulary(tmp_path / "vocab", decoded_tokens, trie)
+    loaded_tokens, loaded_trie = load_vocabulary(tmp_path / "vocab", 0)
+    assert loaded_tokens == decoded_tokens
+    assert isinstance(loaded_trie, CompactTrie)
+    assert loaded_trie.to_arrays() == trie.to_arrays()
+
+
+def test_load_or_build_vocabulary(tokenizer, tmp_path):
+    decoded_tokens, trie = load_or_build_vocabulary(tokenizer, tmp_path)
+    assert decoded_tokens[:3] == ["", "", ""]
+    assert decoded_tokens[9] == "é"
+    path = tmp_path / f"{tokenizer_fingerprint(tokenizer)}.vocab"
+    assert path.exists()
+    cached_tokens, cached_trie = load_or_build_vocabulary(tokenizer, tmp_path)
+    assert cached_tokens == decoded_tokens
+    assert cached_trie.to_arrays() == trie.to_arrays()
+
+
+def test_corrupt_cache_is_rebuilt(tokenizer, tmp_path):
+    path = tmp_path / f"{tokenizer_fingerprint(tokenizer)}.vocab"
+    path.write_bytes(b"not a cache")
+    decoded_tokens, _ = load_or_build_vocabulary(tokenizer, tmp_path)
+    assert decoded_tokens[7] == "a"
+    assert load_vocabulary(path, tokenizer.eos_token_id)[0] == decoded_tokens
+
+
+def test_fingerprint_depends_on_special_tokens(tokenizer):
+    fingerprint = tokenizer_fingerprint(tokenizer)
+    assert fingerprint == tokenizer_fingerprint(tokenizer)
+    tokenizer.eos_token = "}"
+    assert fingerprint != tokenizer_fingerprint(tokenizer)
+
+
+def test_vocabulary_index(tokenizer, tmp_path):
+    index = VocabularyIndex.from_tokenizer(tokenizer)
+    assert index.decoded_tokens[4] == '{"'
+    assert index.eos_token_id == 1
+    assert index.pad_token_id == 0
+    assert len(index) == len(words)
+    assert VocabularyIndex.from_tokenizer(tokenizer) is index
+    # with a cache, a different tokenizer object with the same vocabulary
+    # shares the index
+    cached = VocabularyIndex.from_tokenizer(_make_tokenizer(), tmp_path)
+    assert VocabularyIndex.from_tokenizer(_make_tokenizer(), tmp_path) is cached
+
+
+def test_fingerprint_is_taken_when_needed(tokenizer, monkeypatch):
+    calls = []
+
+    def fingerprint(tokenizer):
+        calls.append(tokenizer)
+        return tokenizer_fingerprint(tokenizer)
+
+    monkeypatch.setattr(vocabulary, "tokenizer_fingerprint", fingerprint)
+    index = VocabularyIndex.from_tokenizer(tokenizer)
+    assert calls == []
+    assert index.fingerprint == tokenizer_fingerprint(tokenizer)
+    assert index.fingerprint == tokenizer_fingerprint(tokenizer)
+    assert VocabularyIndex.build(tokenizer).fingerprint == index.fingerprint
+    assert calls == [tokenizer]
+
+
+def test_split_string_body_tokens():
+    decoded_tokens = ["", "a", '"', 'a"', "\\", "b", "a"]
+    plain_token_ids, special = split_string_body_tokens(decoded_tokens, 0)
+    assert sorted(plain_token_ids) == [0, 5, 6]
+    assert sorted(special.find_valid_tokens("", lambda *_: (True, False))) == [
+        2,
+        3,
+        4,
+    ]